@@ -16,6 +16,7 @@ from threading import Thread
 import six
 
 import aetros.cuda_gpu
+from aetros.io_loop import get_io_loop
 import numpy as np
 
 
@@ -55,93 +56,123 @@ class MonitoringThread(Thread):
         self.stat_stream = None
 
         self.docker_last_last_reponse = None
+        self.docker_reader = None
         self.docker_last_stream_data = 0
         self.docker_last_mem = None
         self.docker_last_cpu = None
 
+        # with `io_core: asyncio` ticks are scheduled by the shared IOLoop, this thread is never started
+        self.io_loop = get_io_loop(job_backend.home_config, job_backend.logger)
+        self.periodic = None
+
+    def start(self):
+        if self.io_loop:
+            # cpu_percent() without interval measures since the previous call
+            psutil.cpu_percent(percpu=True)
+            self.periodic = self.io_loop.every(1, self.tick, None, blocking=True)
+        else:
+            Thread.start(self)
+
     def stop(self):
         self.running = False
 
+    def join(self, timeout=None):
+        if not self.periodic:
+            return Thread.join(self, timeout)
+
+        self.periodic.cancel()
+        self.periodic.join(timeout)
+
+        # ended. So queue last network sync update
+        self.network_sync()
+
     def run(self):
-        def docker_stats_reader(response):
-            previous_cpu = 0
-            previous_system = 0
+        while self.running:
+            time.sleep(self.tick(cpu_interval=1))
+
+        # thread requested to end. So queue last network sync update
+        self.network_sync()
 
-            stream = self.docker_api._stream_helper(response)
+    def docker_stats_reader(self, response):
+        previous_cpu = 0
+        previous_system = 0
 
-            try:
-                for line in stream:
-                    data = simplejson.loads(line)
-                    if 'cpu_stats' not in data or not data['cpu_stats']:
-                        return
+        stream = self.docker_api._stream_helper(response)
 
-                    if 'system_cpu_usage' not in data['cpu_stats']:
-                        return
+        try:
+            for line in stream:
+                data = simplejson.loads(line)
+                if 'cpu_stats' not in data or not data['cpu_stats']:
+                    return
 
-                    cpu_util = 0
-                    cpu_delta = data['cpu_stats']['cpu_usage']['total_usage'] - previous_cpu
-                    system_delta = data['cpu_stats']['system_cpu_usage'] - previous_system
+                if 'system_cpu_usage' not in data['cpu_stats']:
+                    return
 
-                    previous_cpu = data['cpu_stats']['cpu_usage']['total_usage']
-                    previous_system = data['cpu_stats']['system_cpu_usage']
+                cpu_util = 0
+                cpu_delta = data['cpu_stats']['cpu_usage']['total_usage'] - previous_cpu
+                system_delta = data['cpu_stats']['system_cpu_usage'] - previous_system
 
-                    if cpu_delta > 0 and system_delta > 0:
-                        cpu_cores = len(data['cpu_stats']['cpu_usage']['percpu_usage'])
+                previous_cpu = data['cpu_stats']['cpu_usage']['total_usage']
+                previous_system = data['cpu_stats']['system_cpu_usage']
 
-                        cpu_util = (cpu_delta / system_delta) * cpu_cores / self.cpu_cores * 100
+                if cpu_delta > 0 and system_delta > 0:
+                    cpu_cores = len(data['cpu_stats']['cpu_usage']['percpu_usage'])
 
-                    mem_util = data['memory_stats']['usage'] / data['memory_stats']['limit'] * 100
-                    self.docker_last_stream_data = time.time()
-                    self.docker_last_cpu = min(cpu_util, 100)
-                    self.docker_last_mem = min(mem_util, 100)
-            except Exception:
-                return
+                    cpu_util = (cpu_delta / system_delta) * cpu_cores / self.cpu_cores * 100
 
-        docker_reader = None
+                mem_util = data['memory_stats']['usage'] / data['memory_stats']['limit'] * 100
+                self.docker_last_stream_data = time.time()
+                self.docker_last_cpu = min(cpu_util, 100)
+                self.docker_last_mem = min(mem_util, 100)
+        except Exception:
+            return
 
-        while self.running:
-            self.handle_early_stop()
+    def tick(self, cpu_interval):
+        """
+        One monitoring round. Returns the seconds to wait until the next one.
 
-            self.job_backend.git.store_file('aetros/job/times/elapsed.json', simplejson.dumps(time.time() - self.job_backend.start_time))
+        :param cpu_interval: passed to psutil.cpu_percent(), which blocks that long. None measures since the
+                             last call, used when ticks are scheduled by the IOLoop.
+        """
+        self.handle_early_stop()
 
-            if self.job_backend.is_paused:
-                # when paused, we do not monitor anything, except elapsed.
-                time.sleep(1)
-                continue
+        self.job_backend.git.store_file('aetros/job/times/elapsed.json', simplejson.dumps(time.time() - self.job_backend.start_time))
 
-            # always sent network information even when marked as ended. The real end will tear down this thread.
-            self.network_sync()
+        if self.job_backend.is_paused:
+            # when paused, we do not monitor anything, except elapsed.
+            return 1
 
-            if self.job_backend.ended:
-                # stop hardware monitoring when ended
-                time.sleep(1)
-                continue
+        # always sent network information even when marked as ended. The real end will tear down this thread.
+        self.network_sync()
 
-            if self.docker_container:
-                if docker_reader and self.docker_last_last_reponse and time.time()-self.docker_last_stream_data > 3:
-                    self.docker_last_last_reponse.close()
-                    docker_reader.join()
+        if self.job_backend.ended:
+            # stop hardware monitoring when ended
+            return 1
 
-                if not docker_reader or not docker_reader.isAlive():
-                    url = self.docker_api._url("/containers/{0}/stats", self.docker_container)
-                    self.docker_last_last_reponse = self.docker_api._get(url, stream=True)
+        if self.docker_container:
+            if self.docker_reader and self.docker_last_last_reponse and time.time()-self.docker_last_stream_data > 3:
+                self.docker_last_last_reponse.close()
+                self.docker_reader.join()
 
-                    docker_reader = Thread(target=docker_stats_reader, args=[self.docker_last_last_reponse])
-                    docker_reader.daemon = True
-                    docker_reader.start()
+            if not self.docker_reader or not self.docker_reader.is_alive():
+                url = self.docker_api._url("/containers/{0}/stats", self.docker_container)
+                self.docker_last_last_reponse = self.docker_api._get(url, stream=True)
 
-                if self.docker_last_cpu is not None:
-                    self.monitor(self.docker_last_cpu, self.docker_last_mem)
+                self.docker_reader = Thread(target=self.docker_stats_reader, args=[self.docker_last_last_reponse])
+                self.docker_reader.daemon = True
+                self.docker_reader.start()
 
-                time.sleep(1)
-            else:
-                cpu_util = np.mean(psutil.cpu_percent(interval=1, percpu=True))  # blocks 1sec
-                mem_util = psutil.virtual_memory().percent
-                self.monitor(cpu_util, mem_util) #takes always at least 1sec, no need for sleep
-                time.sleep(0.01)
+            if self.docker_last_cpu is not None:
+                self.monitor(self.docker_last_cpu, self.docker_last_mem)
 
-        # thread requested to end. So queue last network sync update
-        self.network_sync()
+            return 1
+
+        cpu_util = np.mean(psutil.cpu_percent(interval=cpu_interval, percpu=True))  # blocks cpu_interval
+        mem_util = psutil.virtual_memory().percent
+        self.monitor(cpu_util, mem_util)
+
+        # cpu_percent took already the time
+        return 0.01 if cpu_interval else 1
 
     def handle_early_stop(self):
         if not self.early_stopped and self.handle_max_time and self.max_minutes > 0:
@@ -162,19 +193,37 @@ class MonitoringThread(Thread):
                 'sent': self.job_backend.client.bytes_sent,
                 'total': self.job_backend.client.bytes_total,
                 'speed': self.job_backend.client.bytes_speed,
+                'compression': dict(self.job_backend.client.compressor.stats),
+                'connection': self.job_backend.client.reconnect.metrics(),
             }
 
-            for channel, messages in six.iteritems(self.job_backend.client.queues):
-                messages = messages[:]
+            uploads = {}
 
-                for message in messages:
-                    if 'type' not in message:
-                        continue
+            for channel, queue in six.iteritems(self.job_backend.client.queues):
+                network['channels'][channel] = {'messages': queue.count, 'bytes': queue.bytes}
 
+                # only store-blob and git-unpack-objects messages, without copying the whole queue
+                for message in queue.tracked_messages():
                     if message['type'] == 'store-blob' and message['path'] in ['aetros/job/network.json']:
                         continue
 
-                    if message['type'] == 'git-unpack-objects':
+                    if message['type'] == 'git-unpack-objects' and '_upload' in message:
+                        # a pack streamed in parts is one entry. Parts no longer queued are sent completely.
+                        upload = message['_upload']
+                        if id(upload) not in uploads:
+                            uploads[id(upload)] = {
+                                'sent': upload['total'],
+                                'total': upload['total'],
+                                'parts': upload['parts'],
+                                'complete': upload['complete'],
+                                'objects': upload['objects']
+                            }
+                            network['git'].append(uploads[id(upload)])
+
+                        uploads[id(upload)]['sent'] -= message['_total'] - message['_bytes_sent']
+                        network['messages'] += 1
+
+                    elif message['type'] == 'git-unpack-objects':
                         bytes_sent = message['_bytes_sent']
                         total = message['_total']
                         network['git'].append({
@@ -29,6 +29,7 @@ command_summaries = [
     ['init', 'Creates a new model and places a aetros.yml in current working (or specified) directory.'],
     ['id', 'Shows under which account the machine is authenticated.'],
     ['gpu', 'Shows information about installed GPUs.'],
+    ['replay', 'Replays a captured job client session against a local stand-in server.'],
 ]
 
 
@@ -81,6 +82,7 @@ def main(args=None):
     from aetros.commands.IdCommand import IdCommand
     from aetros.commands.GPUCommand import GPUCommand
     from aetros.commands.AuthenticateCommand import AuthenticateCommand
+    from aetros.commands.ReplayCommand import ReplayCommand
 
     commands_dict = {
         'start': StartCommand,
@@ -105,6 +107,7 @@ def main(args=None):
         'add': AddCommand,
         'init': InitCommand,
         'gpu': GPUCommand,
+        'replay': ReplayCommand,
     }
 
     if cmd_name not in commands_dict:
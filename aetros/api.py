@@ -8,7 +8,7 @@ from six.moves.urllib.parse import urlencode
 import simplejson
 
 from aetros.logger import drain_stream
-from aetros.utils import read_home_config, create_ssh_stream
+from aetros.utils import read_home_config, open_ssh_session
 
 class ApiError(Exception):
     def __init__(self, message, error):
@@ -86,17 +86,17 @@ def request(path, query=None, body=None, method='get', config=None):
     if method == 'get' and body is not None:
         method = 'post'
 
-    ssh_stream = create_ssh_stream(config)
-    stdin, stdout, stderr = ssh_stream.exec_command('api ' + method + ' ' + simplejson.dumps(path))
+    channel = open_ssh_session(config)
+    channel.exec_command('api ' + method + ' ' + simplejson.dumps(path))
 
     if body is not None:
         input = six.b(simplejson.dumps(body))
-        stdin.write(input)
-        stdin.flush()
-        stdin.channel.shutdown_write()
+        channel.sendall(input)
+        channel.shutdown_write()
 
-    stdout = drain_stream(stdout)
-    stderr = drain_stream(stderr)
+    stdout = drain_stream(channel.makefile('rb'))
+    stderr = drain_stream(channel.makefile_stderr('rb'))
+    channel.close()
 
     if len(stderr) > 0:
         if hasattr(stderr, 'decode'):
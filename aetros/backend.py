@@ -1085,6 +1085,11 @@ class JobBackend:
             self.logger.debug("Last wait_until_queue_empty")
             self.client.wait_until_queue_empty(['', 'files'], report=report, clear_end=False)
 
+            if self.is_master_process():
+                # the final pack is written now, so a restarted job continues from here
+                with self.git.push_lock:
+                    self.git.store_written_commits()
+
             # it's important to have it here, since its tracks not only hardware but also network speed
             # for uploading last messages and Git.
             # Also, after each message we get from this thread on the server, we check if the job
@@ -1102,8 +1107,9 @@ class JobBackend:
             # wait for end of client. Server will now close connection when ready.
             self.client.end()
 
-            if self.is_master_process():
-                # check if we have uncommitted stuff
+            if self.is_master_process() and not self.client.is_acknowledged():
+                # without acks from the server we can't know whether everything arrived,
+                # so check if we have uncommitted stuff
                 objects_to_sync, types = self.git.diff_objects(self.git.get_head_commit())
 
                 if objects_to_sync:
@@ -1360,22 +1366,23 @@ class JobBackend:
         self.logger.debug("sync weights...")
         self.set_status('SYNC WEIGHTS', add_section=False)
 
-        with open(self.get_job_model().get_weights_filepath_latest(), 'rb') as f:
-            import keras.backend
-            self.git.commit_file('Added weights', 'aetros/weights/latest.hdf5', f.read())
+        import keras.backend
+        # stored in chunks, only the changed parts are pushed, see Git.add_chunked_file
+        self.git.commit_file_path('Added weights', 'aetros/weights/latest.hdf5',
+                                  self.get_job_model().get_weights_filepath_latest())
 
-            image_data_format = None
-            if hasattr(keras.backend, 'set_image_data_format'):
-                image_data_format = keras.backend.image_data_format()
+        image_data_format = None
+        if hasattr(keras.backend, 'set_image_data_format'):
+            image_data_format = keras.backend.image_data_format()
 
-            info = {
-                'framework': 'keras',
-                'backend': keras.backend.backend(),
-                'image_data_format': image_data_format
-            }
-            self.git.commit_file('Added weights', 'aetros/weights/latest.json', simplejson.dumps(info))
-            if push:
-                self.git.push()
+        info = {
+            'framework': 'keras',
+            'backend': keras.backend.backend(),
+            'image_data_format': image_data_format
+        }
+        self.git.commit_file('Added weights', 'aetros/weights/latest.json', simplejson.dumps(info))
+        if push:
+            self.git.push()
 
         # todo, implement optional saving of self.get_job_model().get_weights_filepath_best()
 
@@ -1419,14 +1426,8 @@ class JobBackend:
                     self.commit_file(path + '/' + file)
                 return
 
-            if os.path.getsize(path) > 10 * 1024 * 1024:
-                self.logger.error('Can not upload files bigger than 10MB: ' + str(path))
-                return
-
-            with open(path, 'rb') as f:
-                contents = f.read()
-
-            self.git.commit_file('FILE ' + (title or git_path), git_path, contents)
+            # big files are stored in chunks, see Git.add_chunked_file
+            self.git.commit_file_path('FILE ' + (title or git_path), git_path, path)
 
     registered_actions = {}
 
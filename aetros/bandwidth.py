@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import time
+from threading import Lock
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter. rate is in bytes per second, burst the maximum amount of tokens that can be saved
+    up while idle (default one second worth of rate).
+
+    consume() takes the bytes that were just sent and returns how long the caller has to sleep to stay within
+    the rate. Tokens can go negative, so a single big write is allowed and paid back afterwards.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.lock = Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = self.capacity()
+        self.last = time.time()
+
+    def capacity(self):
+        return self.burst if self.burst else self.rate
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, self.capacity())
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity(), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, size):
+        with self.lock:
+            self.refill()
+            self.tokens -= size
+
+            if self.tokens >= 0:
+                return 0
+
+            return -self.tokens / self.rate
+
+
+class HostFairShare(object):
+    """
+    Splits a host-wide upload rate equally between all processes uploading at the moment, e.g. all jobs
+    started by `aetros server` on this host.
+
+    Each uploading process touches a heartbeat file in path. Processes with a heartbeat younger than
+    active_timeout count as active, so idle jobs do not hold back a share.
+    """
+
+    update_interval = 2
+    active_timeout = 5
+
+    def __init__(self, path, rate):
+        self.path = path
+        self.rate = rate
+        self.bucket = TokenBucket(rate)
+        self.heartbeat = os.path.join(self.path, str(os.getpid()))
+        self.last_update = 0
+        self.shares = 1
+
+        if not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # created by another process meanwhile
+                pass
+
+    def update(self):
+        now = time.time()
+        if now - self.last_update < self.update_interval:
+            return
+
+        self.last_update = now
+
+        try:
+            with open(self.heartbeat, 'w') as f:
+                f.write(str(now))
+
+            shares = 0
+            for name in os.listdir(self.path):
+                try:
+                    if now - os.path.getmtime(os.path.join(self.path, name)) < self.active_timeout:
+                        shares += 1
+                except OSError:
+                    # removed meanwhile
+                    pass
+        except (IOError, OSError):
+            return
+
+        self.shares = max(1, shares)
+        self.bucket.set_rate(self.rate / self.shares)
+
+    def consume(self, size):
+        self.update()
+
+        return self.bucket.consume(size)
+
+    def close(self):
+        try:
+            os.remove(self.heartbeat)
+        except OSError:
+            pass
+
+
+# all BackendClient instances of a process share the same limiters
+process_limiters = {}
+process_limiters_lock = Lock()
+
+
+def process_bucket(rate):
+    with process_limiters_lock:
+        key = ('process', rate)
+        if key not in process_limiters:
+            process_limiters[key] = TokenBucket(rate)
+
+        return process_limiters[key]
+
+
+def host_fair_share(path, rate):
+    with process_limiters_lock:
+        key = ('host', path, rate)
+        if key not in process_limiters:
+            process_limiters[key] = HostFairShare(path, rate)
+
+        return process_limiters[key]
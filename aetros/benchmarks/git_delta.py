@@ -0,0 +1,204 @@
+"""
+Pack size benchmark of Git.push with and without deltas (`git_delta` in the home config), no AETROS host needed.
+
+    $ python -m aetros.benchmarks.git_delta
+    $ python -m aetros.benchmarks.git_delta --epochs 50 --size 8 --frozen 0.9 --json
+
+Simulates a job committing aetros/weights/latest.hdf5 and a few job files after each epoch, like sync_weights
+does, and packs every epoch like a push would: complete objects (`never`), deltas against the previous epoch the
+server has (`always`) and the choice of DeltaHeuristic (`auto`). A stand-in server repository unpacks the thin
+packs to make sure they are complete.
+
+The weights are synthetic: --frozen is the part of the layers that does not change between epochs (pretrained
+layers in transfer learning), the rest is rewritten every epoch. Git keeps a delta only when it's at most half
+of the object, so below --frozen 0.5 nothing is saved.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import simplejson
+import six
+
+from aetros.git import DeltaHeuristic, pack_objects_command
+from aetros.git_batch import CatFile
+from aetros.git_writer import TreeBuilder, write_object, serialize_commit, signature
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+class GitDeltaBenchmark(object):
+    def __init__(self, size=4 * 1024 * 1024, frozen=0.75):
+        self.size = size
+        self.frozen = frozen
+
+        self.dir = tempfile.mkdtemp(prefix='aetros-benchmark-')
+        self.git_dir = os.path.join(self.dir, 'job.git')
+        self.server_dir = os.path.join(self.dir, 'server.git')
+        self.git(self.dir, ['init', '-q', '--bare', self.git_dir])
+        self.git(self.dir, ['init', '-q', '--bare', self.server_dir])
+
+        self.cat_file = CatFile(self.git_dir)
+        self.tree = TreeBuilder(self.git_dir, self.cat_file)
+        self.author = signature('benchmark', 'benchmark@localhost')
+
+        self.frozen_layers = os.urandom(int(self.size * self.frozen))
+        self.losses = []
+
+    def git(self, cwd, args, data=None):
+        p = subprocess.Popen(['git'] + args, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate(data)
+
+        if p.returncode:
+            raise Exception('git %s failed: %s' % (args[0], err.decode('utf-8', 'replace')))
+
+        return out
+
+    def weights(self, epoch):
+        header = ('HDF5 model weights, epoch %d\n' % (epoch, )).encode('utf-8').ljust(4096, b'\0')
+        trainable = os.urandom(self.size - len(self.frozen_layers))
+
+        return header + self.frozen_layers + trainable
+
+    def commit_epoch(self, epoch, parent):
+        self.losses.append('%d,%f,%f\n' % (epoch, 1 / (epoch + 1), 1.2 / (epoch + 1)))
+
+        files = {
+            'aetros/weights/latest.hdf5': self.weights(epoch),
+            'aetros/job/channel/loss/data.csv': ''.join(self.losses).encode('utf-8'),
+            'aetros/job/info/epoch.json': simplejson.dumps({'epoch': epoch, 'total': 0}).encode('utf-8'),
+        }
+
+        for path, content in six.iteritems(files):
+            self.tree.set(path, '100644', write_object(self.git_dir, 'blob', content))
+
+        message = 'EPOCH %d' % (epoch, )
+        content = serialize_commit(self.tree.write(), [parent] if parent else [], self.author, self.author, message)
+
+        return write_object(self.git_dir, 'commit', content)
+
+    def objects(self, head, parent):
+        revisions = head + '\n' + ('^' + parent + '\n' if parent else '')
+        out = self.git(self.dir, ['--git-dir', self.git_dir, 'rev-list', '--objects', '--stdin'],
+                       revisions.encode('ascii'))
+
+        shas = []
+        paths = {}
+        for line in out.decode('utf-8').splitlines():
+            shas.append(line[:40])
+            if len(line) > 41:
+                paths[line[:40]] = line[41:]
+
+        blobs = []
+        for sha, check in zip(shas, self.cat_file.check_many(shas)):
+            if check[1] == 'blob':
+                blobs.append((paths[sha], check[2]))
+            else:
+                paths.pop(sha, None)
+
+        return shas, paths, blobs
+
+    def pack(self, shas, paths, bases):
+        command, pack_input = pack_objects_command(self.git_dir, shas, paths, bases)
+
+        cpu = children_cpu_time()
+        start = time.time()
+        pack = self.git(self.dir, command[1:], pack_input.encode('utf-8'))
+
+        return pack, time.time() - start, children_cpu_time() - cpu
+
+    def run(self, epochs):
+        results = {}
+        for mode in ['never', 'always', 'auto']:
+            results[mode] = {'bytes': 0, 'seconds': 0.0, 'cpu': 0.0, 'deltified': 0}
+
+        heuristic = DeltaHeuristic()
+
+        parent = None
+        for epoch in range(epochs):
+            head = self.commit_epoch(epoch, parent)
+            shas, paths, blobs = self.objects(head, parent)
+
+            # the server has the previous epoch, its objects are the delta bases
+            bases = [parent] if parent else []
+            variants = {
+                'never': None,
+                'always': bases,
+                'auto': bases if heuristic.use_delta(blobs, bool(bases)) else None,
+            }
+
+            for mode, mode_bases in six.iteritems(variants):
+                pack, seconds, cpu = self.pack(shas, paths, mode_bases)
+                results[mode]['bytes'] += len(pack)
+                results[mode]['seconds'] += seconds
+                results[mode]['cpu'] += cpu
+                results[mode]['deltified'] += 0 if mode_bases is None else 1
+
+                if mode == 'auto' and mode_bases is not None:
+                    heuristic.record(len(pack), sum(size for path, size in blobs))
+
+                if mode == 'auto':
+                    # fails with unresolved deltas when the pack needs objects the server does not have
+                    self.git(self.dir, ['--git-dir', self.server_dir, 'unpack-objects', '-q'], pack)
+
+            parent = head
+
+        self.git(self.dir, ['--git-dir', self.server_dir, 'cat-file', '-e', parent + ':aetros/weights/latest.hdf5'])
+
+        full = results['never']['bytes']
+        for mode in ['always', 'auto']:
+            results[mode]['saved'] = full - results[mode]['bytes']
+            results[mode]['saved_percent'] = (full - results[mode]['bytes']) / full * 100 if full else 0
+
+        return results
+
+    def stop(self):
+        self.cat_file.close()
+        shutil.rmtree(self.dir)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m aetros.benchmarks.git_delta',
+                                     description='Compares push pack sizes with and without deltas.')
+    parser.add_argument('--epochs', type=int, default=50, help="Number of epochs")
+    parser.add_argument('--size', type=float, default=4, help="Size of the weights file in MB")
+    parser.add_argument('--frozen', type=float, default=0.75, help="Part of the weights not changing per epoch, 0-1")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    parsed_args = parser.parse_args(args)
+
+    benchmark = GitDeltaBenchmark(size=int(parsed_args.size * 1024 * 1024), frozen=parsed_args.frozen)
+
+    try:
+        results = benchmark.run(parsed_args.epochs)
+    finally:
+        benchmark.stop()
+
+    if parsed_args.json:
+        print(simplejson.dumps(results, indent=2))
+        return
+
+    for mode in ['never', 'always', 'auto']:
+        print(mode)
+        for key, value in sorted(six.iteritems(results[mode])):
+            if isinstance(value, float):
+                value = '%.4f' % value
+            print('    %-22s %s' % (key, value))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
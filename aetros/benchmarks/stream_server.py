@@ -0,0 +1,295 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import socket
+import threading
+import time
+import zlib
+
+import msgpack
+import paramiko
+import six
+
+
+class StandInServerInterface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self.server = server
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        if hasattr(command, 'decode'):
+            command = command.decode('utf-8')
+
+        thread = threading.Thread(target=self.server.handle_command, args=[channel, command])
+        thread.daemon = True
+        thread.start()
+
+        return True
+
+
+class StandInServer(object):
+    """
+    Local stand-in for the AETROS stream server, to measure BackendClient/JobClient without a live host.
+
+    Accepts any public key and speaks the `stream` command: sends the welcome message, answers
+    register_job_worker with registered and consumes store-blob, stream-blob, sync-blob and git-unpack-objects
+    until `end`. Every received message is recorded in self.messages as (time, channel name, message).
+
+    When the client asks for acks, [seq, message] frames are processed once per session and channel
+    and the highest contiguous seq is acknowledged after each read. Dropped duplicates are counted in
+    self.duplicates.
+
+    Git packs sent in parts are joined again and recorded as one git-unpack-objects message with the whole
+    pack, once the last part arrived. Packs the client reported as failed are dropped and counted in
+    self.failed_packs.
+
+    Network conditions can be injected:
+
+        latency     seconds every reply to the client is delayed
+        bandwidth   bytes per second the server reads at most, per channel
+        disconnect  drops all connections, like a server restart
+
+    Usage:
+
+        server = StandInServer()
+        server.start()
+        config = {'host': '127.0.0.1', 'ssh_port': server.port, 'ssh_key_base64': ...}
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, key_bits=2048):
+        self.host = host
+        self.host_key = paramiko.RSAKey.generate(key_bits)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(100)
+        self.port = self.socket.getsockname()[1]
+
+        self.active = False
+        self.transports = []
+        self.lock = threading.Lock()
+
+        self.latency = 0
+        self.bandwidth = 0
+
+        # codecs accepted for per-message compression, see aetros.utils.compression
+        self.compression = ['zlib']
+
+        # whether to acknowledge messages, see BackendClient.handle_ack
+        self.acks = True
+        # (session, channel name) -> {'acked': highest contiguous seq, 'seen': processed seqs above it}
+        self.sessions = {}
+        self.duplicates = 0
+
+        # whether to accept git packs in parts, see Git.send_pack
+        self.parts = True
+        self.failed_packs = 0
+
+        self.messages = []
+        self.bytes_received = 0
+        self.registrations = 0
+
+        # called with (channel name, message) for each received message
+        self.on_message = None
+
+    def start(self):
+        self.active = True
+        thread = threading.Thread(target=self.accept_loop)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.active = False
+
+        try:
+            # unblocks accept()
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+
+        try:
+            self.socket.close()
+        except Exception:
+            pass
+
+        self.disconnect()
+
+    def disconnect(self):
+        self.lock.acquire()
+        try:
+            transports = self.transports
+            self.transports = []
+        finally:
+            self.lock.release()
+
+        for transport in transports:
+            transport.close()
+
+    def accept_loop(self):
+        while self.active:
+            try:
+                client, address = self.socket.accept()
+            except Exception:
+                return
+
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+
+            self.lock.acquire()
+            try:
+                self.transports.append(transport)
+            finally:
+                self.lock.release()
+
+            try:
+                transport.start_server(server=StandInServerInterface(self))
+            except Exception:
+                # client went away during handshake
+                pass
+
+    def handle_command(self, channel, command):
+        try:
+            if command == 'stream':
+                self.handle_stream(channel)
+        except Exception:
+            # connection dropped
+            pass
+        finally:
+            try:
+                channel.send_exit_status(0)
+                channel.close()
+            except Exception:
+                pass
+
+    def recv(self, channel, size=65536):
+        if self.bandwidth:
+            size = max(1, min(size, int(self.bandwidth / 10)))
+
+        chunk = channel.recv(size)
+
+        if self.bandwidth and chunk:
+            time.sleep(len(chunk) / self.bandwidth)
+
+        return chunk
+
+    def send(self, channel, message):
+        if self.latency:
+            time.sleep(self.latency)
+
+        channel.sendall(msgpack.packb(message))
+
+    def join_parts(self, pack_parts, message):
+        """
+        Collects the parts of a git pack in pack_parts. Returns the message of the whole pack with the last part,
+        otherwise None.
+        """
+        if message['part'] == 0:
+            del pack_parts[:]
+
+        pack_parts.append(message)
+        if not message.get('last'):
+            return None
+
+        parts = list(pack_parts)
+        del pack_parts[:]
+
+        if message.get('failed') or [part['part'] for part in parts] != list(range(len(parts))):
+            self.failed_packs += 1
+            return None
+
+        pack = []
+        for part in parts:
+            data = part['pack']
+            if isinstance(data, six.text_type):
+                # raw msgpack strings are decoded with surrogateescape, which gives the bytes back
+                data = data.encode('utf-8', 'surrogateescape')
+            pack.append(data)
+
+        message = dict((key, value) for key, value in six.iteritems(parts[0]) if key not in ['part', 'last', 'upload'])
+        message['pack'] = b''.join(pack)
+
+        return message
+
+    def handle_stream(self, channel):
+        unpacker = msgpack.Unpacker(encoding='utf-8', unicode_errors='surrogateescape', max_buffer_size=2 ** 31 - 1)
+        self.send(channel, {'a': 'welcome'})
+        name = None
+        state = None
+        acked = 0
+        pack_parts = []
+
+        while True:
+            chunk = self.recv(channel)
+            if not chunk:
+                return
+
+            self.bytes_received += len(chunk)
+            unpacker.feed(chunk)
+
+            for message in unpacker:
+                if state is not None and isinstance(message, list) and len(message) == 2:
+                    seq, message = message
+
+                    if seq <= state['acked'] or seq in state['seen']:
+                        self.duplicates += 1
+                        continue
+
+                    state['seen'].add(seq)
+                    while state['acked'] + 1 in state['seen']:
+                        state['acked'] += 1
+                        state['seen'].remove(state['acked'])
+
+                if not isinstance(message, dict):
+                    continue
+
+                if message.get('type') == 'compressed':
+                    message = msgpack.unpackb(zlib.decompress(message['data']), encoding='utf-8',
+                                              unicode_errors='surrogateescape')
+
+                if message.get('type') == 'register_job_worker':
+                    name = message.get('name')
+                    self.registrations += 1
+                    codecs = [codec for codec in message.get('compression') or [] if codec in self.compression]
+                    reply = {'a': 'registered', 'compression': codecs}
+
+                    if self.acks and message.get('acks'):
+                        state = self.sessions.setdefault((message.get('session'), name), {'acked': 0, 'seen': set()})
+                        reply['acks'] = True
+                        reply['acked'] = acked = state['acked']
+
+                    if self.parts and message.get('parts'):
+                        reply['parts'] = True
+
+                    self.send(channel, reply)
+
+                if message.get('type') == 'git-unpack-objects' and 'part' in message:
+                    message = self.join_parts(pack_parts, message)
+                    if message is None:
+                        continue
+
+                self.lock.acquire()
+                try:
+                    self.messages.append((time.time(), name, message))
+                finally:
+                    self.lock.release()
+
+                if self.on_message:
+                    self.on_message(name, message)
+
+                if message.get('type') == 'end':
+                    return
+
+            if state is not None and state['acked'] > acked:
+                acked = state['acked']
+                self.send(channel, {'a': 'ack', 'seq': acked})
@@ -0,0 +1,331 @@
+"""
+Transport benchmarks of JobClient against the local StandInServer, no AETROS host needed.
+
+    $ python -m aetros.benchmarks.transport
+    $ python -m aetros.benchmarks.transport --latency 0.05 --bandwidth 2000000 --json
+
+Reports messages/sec and bytes/sec for many small messages, a log stream and one big git pack, end-to-end
+latency percentiles of single messages, the time to recover after the server dropped all connections and
+the CPU time and thread count of a mostly idle job, to compare `--io-core threads` with `--io-core asyncio`.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from threading import Event
+
+import paramiko
+import simplejson
+import six
+
+from aetros.backend import EventListener
+from aetros.benchmarks.stream_server import StandInServer
+from aetros.client import JobClient
+from aetros.logger import GeneralLogger
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+
+    return values[index]
+
+
+class TransportBenchmark(object):
+    def __init__(self, latency=0, bandwidth=0, config=None, logger=None):
+        self.logger = logger or logging.getLogger('aetros-benchmark')
+        self.server = StandInServer(key_bits=1024)
+        self.server.latency = latency
+        self.server.bandwidth = bandwidth
+        self.server.start()
+
+        key = paramiko.RSAKey.generate(1024)
+        key_string = six.StringIO()
+        key.write_private_key(key_string)
+
+        self.storage_dir = tempfile.mkdtemp(prefix='aetros-benchmark-')
+        self.config = {
+            'host': '127.0.0.1',
+            'ssh_port': self.server.port,
+            'ssh_key_base64': key_string.getvalue(),
+            'storage_dir': self.storage_dir,
+        }
+        self.config.update(config or {})
+
+        self.client = None
+
+        # set by on_message when the condition of expect() matches
+        self.received = Event()
+        self.condition = None
+
+    def start(self, channels=None):
+        self.client = JobClient(self.config, EventListener(), self.logger)
+        self.client.configure('benchmark', 'job', 'benchmark')
+
+        if not self.client.start(channels or ['', 'files']):
+            raise Exception('Could not connect to the stand-in server')
+
+        self.server.on_message = self.on_message
+
+    def stop(self):
+        if self.client:
+            self.client.wait_sending_last_messages()
+            self.client.end()
+            self.client.close()
+
+        self.server.stop()
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def on_message(self, channel, message):
+        if self.condition and self.condition(message):
+            self.received.set()
+
+    def expect(self, condition):
+        """
+        Call before sending, messages are checked with condition(message) as soon as they arrive.
+        """
+        self.received.clear()
+        self.condition = condition
+
+    def wait(self, timeout=300):
+        """
+        Blocks until condition(message) of expect() returned True for a received message.
+        """
+        if not self.received.wait(timeout):
+            raise Exception('Timeout while waiting for the stand-in server')
+
+        self.condition = None
+
+    def small_messages(self, count, size):
+        """
+        store-blobs with distinct paths, so none of them gets merged.
+        """
+        data = 'x' * size
+        last = 'bench/small/%d' % (count - 1)
+        bytes_before = self.server.bytes_received
+
+        self.expect(lambda m: m.get('path') == last)
+
+        start = time.time()
+        for i in range(count):
+            self.client.send({'type': 'store-blob', 'path': 'bench/small/%d' % i, 'data': data}, channel='files')
+
+        self.wait()
+        took = time.time() - start
+
+        return {
+            'messages': count,
+            'seconds': took,
+            'messages_per_second': count / took,
+            'bytes_per_second': count * size / took,
+            'wire_bytes': self.server.bytes_received - bytes_before,
+        }
+
+    def log_stream(self, lines, line_size):
+        """
+        stream-blob appends of the same file, like a chatty stdout.
+        """
+        line = 'y' * (line_size - 1) + '\n'
+        total = lines * line_size
+        received = {'bytes': 0}
+        bytes_before = self.server.bytes_received
+
+        def done(message):
+            if message.get('type') == 'stream-blob' and message.get('path') == 'bench/log.txt':
+                received['bytes'] += len(message['data'])
+
+            return received['bytes'] >= total
+
+        self.expect(done)
+
+        start = time.time()
+        for i in range(lines):
+            self.client.send({'type': 'stream-blob', 'path': 'bench/log.txt', 'data': line}, channel='')
+
+        self.wait()
+        took = time.time() - start
+
+        return {
+            'lines': lines,
+            'seconds': took,
+            'lines_per_second': lines / took,
+            'bytes_per_second': total / took,
+            'wire_bytes': self.server.bytes_received - bytes_before,
+        }
+
+    def big_pack(self, size):
+        """
+        One git-unpack-objects message, like Git.push of a big file.
+        """
+        pack = os.urandom(size // 2)
+        if hasattr(pack, 'hex'):
+            pack = pack.hex()
+        else:
+            pack = pack.encode('hex')
+
+        self.expect(lambda m: m.get('type') == 'git-unpack-objects')
+
+        start = time.time()
+        self.client.send({'type': 'git-unpack-objects', 'objects': {}, 'pack': pack}, channel='files')
+        self.wait()
+        took = time.time() - start
+
+        return {
+            'bytes': size,
+            'seconds': took,
+            'bytes_per_second': size / took,
+        }
+
+    def latency(self, count, interval):
+        """
+        Time from JobClient.send() until the server read the message, one message every interval seconds.
+        """
+        latencies = []
+
+        def done(message):
+            if message.get('type') == 'store-blob' and message.get('path', '').startswith('bench/latency/'):
+                latencies.append(time.time() - float(message['data']))
+                return True
+
+        for i in range(count):
+            self.expect(done)
+            self.client.send({'type': 'store-blob', 'path': 'bench/latency/%d' % i, 'data': repr(time.time())})
+            self.received.wait(60)
+            time.sleep(interval)
+
+        self.condition = None
+
+        return {
+            'messages': len(latencies),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        }
+
+    def reconnect(self, tries, interval=0.02):
+        """
+        Time from dropping all connections on the server until messages arrive again. Without acks, messages
+        written into the dying connection are lost, so a probe is sent every interval seconds until one arrives.
+        """
+        recoveries = []
+
+        def done(message):
+            return message.get('type') == 'store-blob' and message.get('path', '').startswith('bench/reconnect/')
+
+        for i in range(tries):
+            self.expect(done)
+
+            start = time.time()
+            self.server.disconnect()
+
+            while not self.received.wait(interval):
+                if time.time() - start > 300:
+                    raise Exception('Timeout while waiting for the stand-in server')
+
+                self.client.send({'type': 'store-blob', 'path': 'bench/reconnect/%d' % i, 'data': 'x'})
+
+            self.condition = None
+            recoveries.append(time.time() - start)
+
+            # let queued probes drain before the next disconnect
+            self.client.wait_until_queue_empty([''], report=False)
+
+        return {
+            'tries': tries,
+            'p50': percentile(recoveries, 50),
+            'max': max(recoveries),
+            'reconnects': self.client.reconnect.metrics()['reconnects'],
+        }
+
+    def write_log(self, message):
+        # job_backend interface of GeneralLogger
+        self.client.send({'type': 'stream-blob', 'path': 'bench/idle.txt', 'data': message}, channel='')
+
+        return True
+
+    def idle(self, seconds, interval=0.1):
+        """
+        CPU time the process spends in a job that prints one line every interval seconds, like a training
+        waiting for its GPU. Lines go through a GeneralLogger as sys.stdout of a job does.
+        """
+        devnull = open(os.devnull, 'w')
+        log = GeneralLogger(redirect_to=devnull, job_backend=self)
+        cpu_start = sum(os.times()[:2])
+        start = time.time()
+
+        while time.time() - start < seconds:
+            log.write('epoch\n')
+            time.sleep(interval)
+
+        took = time.time() - start
+        cpu = sum(os.times()[:2]) - cpu_start
+        log.flush()
+        devnull.close()
+
+        return {
+            'seconds': took,
+            'cpu_seconds': cpu,
+            'cpu_percent': cpu / took * 100,
+            'threads': threading.active_count(),
+        }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m aetros.benchmarks.transport',
+                                     description='Measures JobClient against a local stand-in stream server.')
+    parser.add_argument('--latency', type=float, default=0, help="Delay of server replies in seconds")
+    parser.add_argument('--bandwidth', type=int, default=0, help="Server read limit in bytes per second, 0=unlimited")
+    parser.add_argument('--messages', type=int, default=5000, help="Number of small messages")
+    parser.add_argument('--message-size', type=int, default=200, help="Size of small messages in bytes")
+    parser.add_argument('--lines', type=int, default=50000, help="Number of log lines")
+    parser.add_argument('--pack-size', type=int, default=50 * 1024 * 1024, help="Size of the git pack in bytes")
+    parser.add_argument('--latency-messages', type=int, default=200, help="Number of latency samples")
+    parser.add_argument('--reconnects', type=int, default=5, help="Number of forced disconnects")
+    parser.add_argument('--compression', default='transport', help="message|transport|none")
+    parser.add_argument('--io-core', default='threads', help="threads|asyncio")
+    parser.add_argument('--idle', type=float, default=5, help="Seconds of the idle job")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    parsed_args = parser.parse_args(args)
+
+    benchmark = TransportBenchmark(latency=parsed_args.latency, bandwidth=parsed_args.bandwidth,
+                                   config={'compression': parsed_args.compression, 'io_core': parsed_args.io_core})
+    results = {}
+
+    try:
+        benchmark.start()
+        results['small_messages'] = benchmark.small_messages(parsed_args.messages, parsed_args.message_size)
+        results['log_stream'] = benchmark.log_stream(parsed_args.lines, 80)
+        results['big_pack'] = benchmark.big_pack(parsed_args.pack_size)
+        results['latency'] = benchmark.latency(parsed_args.latency_messages, 0.01)
+        results['reconnect'] = benchmark.reconnect(parsed_args.reconnects)
+        results['idle'] = benchmark.idle(parsed_args.idle)
+    finally:
+        benchmark.stop()
+
+    if parsed_args.json:
+        print(simplejson.dumps(results, indent=2))
+        return
+
+    for name, values in six.iteritems(results):
+        print(name)
+        for key, value in sorted(six.iteritems(values)):
+            if isinstance(value, float):
+                value = '%.4f' % value
+            print('    %-22s %s' % (key, value))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import gzip
+import time
+import zlib
+from collections import deque
+from threading import Lock
+
+import msgpack
+
+
+class CaptureWriter(object):
+    """
+    Records every message a BackendClient queues, to reproduce the load of a job later with `aetros replay`.
+
+    The file is a gzip compressed stream of msgpack arrays:
+
+        ['capture', version, {'model', 'job', 'start'}]              header, once
+        [time, channel, important, meta, chunk, data]                one per queued message
+
+    time is in seconds since start, meta holds type, path and objects as seen by the queue, chunk the raw
+    stream-blob chunk (or None) and data the packed message exactly as it is handed to the write thread.
+    """
+
+    version = 1
+
+    def __init__(self, path, info=None, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        # guards pending and closed, held only briefly since add() is called with a queue lock held
+        self.lock = Lock()
+        # serializes compressing and writing, records leave pending in the order they were added
+        self.write_lock = Lock()
+        self.pending = deque()
+        self.start = time.time()
+        self.last_flush = self.start
+        self.messages = 0
+        self.closed = False
+
+        # level 1: capturing must not cost the job noticeable cpu time
+        self.handle = gzip.open(path, 'wb', 1)
+
+        header = dict(info or {})
+        header['start'] = self.start
+        self.write_record(['capture', self.version, header])
+
+    def write_record(self, record):
+        self.handle.write(msgpack.packb(record, use_bin_type=True))
+
+    def add(self, channel, important, message):
+        """
+        Takes the record of message, a queue entry as created by BackendClient.send(). Cheap enough to be called
+        while the queue is locked, the record is compressed and written by the next write_pending().
+        """
+        meta = dict((k, v) for k, v in message.items() if not k.startswith('_'))
+        chunk = message['_chunks'][0] if message.get('_chunks') else None
+
+        with self.lock:
+            if self.closed:
+                return
+
+            self.pending.append([time.time() - self.start, channel, important, meta, chunk, message['_data']])
+
+    def write_pending(self):
+        with self.write_lock:
+            while True:
+                with self.lock:
+                    if self.closed or not self.pending:
+                        return
+
+                    record = self.pending.popleft()
+
+                self.write_record(record)
+                self.messages += 1
+
+                now = time.time()
+                if now - self.last_flush >= self.flush_interval:
+                    self.handle.flush()
+                    self.last_flush = now
+
+    def write(self, channel, important, message):
+        self.add(channel, important, message)
+        self.write_pending()
+
+    def close(self):
+        self.write_pending()
+
+        with self.write_lock:
+            with self.lock:
+                if self.closed:
+                    return
+
+                self.closed = True
+
+            self.handle.close()
+
+
+def read_records(path, chunk_size=64 * 1024):
+    """
+    Yields all records of a capture file. A record cut off by a crash ends it.
+    """
+    # not gzip.open(), it throws away everything decompressed so far when the gzip trailer is missing
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    unpacker = msgpack.Unpacker(encoding='utf-8', max_buffer_size=2 ** 31 - 1)
+
+    with open(path, 'rb') as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                return
+
+            try:
+                unpacker.feed(decompressor.decompress(chunk))
+            except zlib.error:
+                return
+
+            for record in unpacker:
+                yield record
+
+
+def read_capture(path):
+    """
+    Returns (header, records) of a capture file. records is a generator of
+    (time, channel, important, meta, chunk, data).
+    """
+    records = read_records(path)
+
+    try:
+        header = next(records)
+    except (StopIteration, msgpack.exceptions.UnpackException, ValueError):
+        header = None
+
+    if not isinstance(header, list) or len(header) != 3 or header[0] != 'capture':
+        records.close()
+        raise Exception('%s is not a capture file' % (path, ))
+
+    return header[2], (tuple(record) for record in records)
@@ -3,9 +3,12 @@ from __future__ import print_function
 from __future__ import division
 
 import collections
+import os
+import select
 import signal
 import socket
 import time
+import uuid
 
 import msgpack
 import requests
@@ -15,10 +18,18 @@ import sys
 import six
 from paramiko.ssh_exception import NoValidConnectionsError
 
-from aetros.utils import invalid_json_values, prepend_signal_handler, create_ssh_stream, is_debug, is_debug2, \
+from aetros.utils import invalid_json_values, prepend_signal_handler, open_ssh_session, close_ssh_transport, \
+    is_debug, is_debug2, \
     thread_join_non_blocking
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, Event
 from aetros.const import __version__
+from aetros.message_queue import MessageQueue
+from aetros.bandwidth import TokenBucket, HostFairShare, process_bucket, host_fair_share
+from aetros.capture import CaptureWriter
+from aetros.io_loop import get_io_loop
+from aetros.outbox import Outbox
+from aetros.reconnect import ReconnectScheduler
+from aetros.utils.compression import MessageCompressor
 
 
 class ApiClient:
@@ -84,6 +95,8 @@ class BackendClient:
         self.thread_write_instances = {}
         self.stop_on_empty_queue = {}
         self.channel_closed = {}
+        # channel -> Event set once the server closed the ssh channel, see recv() and wait_for_close()
+        self.close_events = {}
 
         self.bytes_sent = 0
         self.bytes_total = 0
@@ -92,11 +105,66 @@ class BackendClient:
         self.lock = Lock()
         self.channel_lock = {}
         self.queue_lock = {}
+
+        # notified when a channel queue or the connection state changes. Uses queue_lock.
+        self.queue_condition = {}
         self.connection_errors = 0
         self.connection_tries = 0
+
+        # shared by all channels, decides when a channel may try to connect again
+        self.reconnect = ReconnectScheduler()
         self.in_connecting = {}
-        self.write_speeds = []
-        self.read_speeds = []
+        # last speed samples in bytes per second
+        self.write_speeds = collections.deque(maxlen=10)
+        self.read_speeds = collections.deque(maxlen=10)
+
+        # the write thread drains all ready messages of a channel into one buffer and sends it in one go.
+        # write_batch_size limits the bytes per batch (a single bigger message is always sent alone),
+        # write_batch_latency is the time in seconds a partial batch may wait for more messages to join.
+        self.write_batch_size = 256 * 1024
+        self.write_batch_latency = 0.0
+
+        # bytes handed to paramiko per send() call. A batch is a memoryview sliced into such chunks, so
+        # sending big messages copies nothing. paramiko itself sends at most one packet (32KB) per call.
+        self.write_chunk_size = 64 * 1024
+
+        # seconds an idle write thread sleeps at most before it checks the channel state again
+        self.write_idle_timeout = 1.0
+
+        # `transport` compresses the whole ssh connection. `compression: message` compresses each message in the
+        # write thread instead, if the server accepted a codec during registration.
+        self.compression = self.config.get('compression', 'transport')
+        self.compressor = MessageCompressor()
+        self.compression_codecs = {}
+
+        # channel -> upload rate limiters, see create_limiters()
+        self.limiters = {}
+
+        # optional on-disk copy of the queues, see Outbox. Enabled with `outbox: true` in the home config,
+        # the path is set by the subclass, e.g. JobClient.configure().
+        self.outbox_path = None
+        self.outboxes = {}
+
+        # channel -> whether the server acknowledges messages, negotiated during registration. See handle_ack().
+        self.acks = {}
+        # channel -> whether the server unpacks thin git packs, negotiated during registration. See Git.pack_bases().
+        self.thin = {}
+        # channel -> whether the server reassembles git packs sent in parts, negotiated during registration.
+        # See Git.send_pack().
+        self.parts = {}
+        # channel -> last assigned sequence number. Kept over reconnects, the server identifies us by session.
+        self.sequence = {}
+        self.session = uuid.uuid4().hex
+        # channel -> session sent in register_job_worker, the one of a previous process when its outbox is replayed
+        self.sessions = {}
+        # bytes written but not yet acknowledged per channel, before the write thread waits for acks
+        self.ack_window = 8 * 1024 * 1024
+
+        # optional CaptureWriter recording all queued messages, see JobClient.configure() and `aetros replay`
+        self.capture = None
+
+        # with `io_core: asyncio` channels are read by the shared IOLoop instead of one read thread each
+        self.io_loop = get_io_loop(config, logger)
 
         # indicates whether we are offline or not, means not connected to the internet and
         # should not establish a connection to Aetros.
@@ -115,7 +183,14 @@ class BackendClient:
 
         self.was_connected_once = {}
         self.connected_since = {}
-        self.read_unpacker = msgpack.Unpacker(encoding='utf-8')
+
+        # per channel, recreated for every new connection so no half-read message is carried over
+        self.read_unpacker = {}
+
+        # per channel recv() size, adapted between read_size_min and read_size_max depending on how much is waiting
+        self.read_size = {}
+        self.read_size_min = 4 * 1024
+        self.read_size_max = 64 * 1024
 
     def on_sigint(self, sig, frame):
         # when connections breaks, we do not reconnect
@@ -139,15 +214,16 @@ class BackendClient:
         self.was_connected_once = {}
 
         self.start_channel('')
-        registered = False
 
-        while True:
-            # check if registered has been set
-            if self.registered[''] is not None:
-                registered = self.registered['']
-                break
+        # wait until registered has been set
+        self.queue_condition[''].acquire()
+        try:
+            while self.registered.get('') is None and self.active:
+                self.queue_condition[''].wait()
 
-            time.sleep(0.1)
+            registered = self.registered.get('') or False
+        finally:
+            self.queue_condition[''].release()
 
         if not channels:
             channels = ['']
@@ -161,7 +237,7 @@ class BackendClient:
         return registered
 
     def start_channel(self, channel):
-        self.queues[channel] = []
+        self.queues[channel] = MessageQueue()
 
         self.ssh_stream[channel] = None
         self.ssh_channel[channel] = None
@@ -171,13 +247,25 @@ class BackendClient:
         self.was_connected_once[channel] = False
         self.stop_on_empty_queue[channel] = False
         self.channel_lock[channel] = Lock()
-        self.queue_lock[channel] = Lock()
+        self.queue_lock[channel] = self.queues[channel].lock
+        self.queue_condition[channel] = Condition(self.queue_lock[channel])
         self.in_connecting[channel] = False
         self.channel_closed[channel] = False
+        self.close_events[channel] = Event()
 
-        self.thread_read_instances[channel] = Thread(target=self.thread_read, args=[channel])
-        self.thread_read_instances[channel].daemon = True
-        self.thread_read_instances[channel].start()
+        self.limiters[channel] = self.create_limiters(channel)
+        self.acks[channel] = False
+        self.thin[channel] = False
+        self.parts[channel] = False
+        self.sequence.setdefault(channel, 0)
+
+        if self.outbox_path:
+            self.start_outbox(channel)
+
+        if not self.io_loop:
+            self.thread_read_instances[channel] = Thread(target=self.thread_read, args=[channel])
+            self.thread_read_instances[channel].daemon = True
+            self.thread_read_instances[channel].start()
 
         self.thread_write_instances[channel] = Thread(target=self.thread_write, args=[channel])
         self.thread_write_instances[channel].daemon = True
@@ -192,22 +280,39 @@ class BackendClient:
 
         self.event_listener.fire('offline')
         self.online = False
+        self.notify()
+
+    def notify(self, channel=None):
+        """
+        Wakes up all threads waiting for a queue or connection change of the channel, or of all channels.
+        Must not be called while holding a queue_lock.
+        """
+        channels = [channel] if channel is not None else list(self.queue_condition.keys())
+
+        # write threads waiting for their next connection attempt
+        self.reconnect.wake()
+
+        for channel in channels:
+            condition = self.queue_condition[channel]
+            condition.acquire()
+            try:
+                condition.notify_all()
+            finally:
+                condition.release()
 
     def connect(self, channel):
         """
         In the write-thread we detect that no connection is living anymore and try always again.
         Up to the 3 connection try, we report to user. We keep trying but in silence.
-        Also, when more than 10 connection tries are detected, we delay extra 15 seconds.
+        When to try is decided by self.reconnect, which gets the result of each attempt.
         """
-        if self.connection_tries > 10:
-            time.sleep(10)
-
         if self.in_connecting[channel]:
             return False
 
         self.in_connecting[channel] = True
 
         self.logger.debug('[%s] Wanna connect ...' % (channel, ))
+        handshake_start = None
 
         try:
             if self.is_connected(channel) or self.online is False:
@@ -219,22 +324,24 @@ class BackendClient:
                 return True
 
             self.channel_lock[channel].acquire()
+            handshake_start = time.time()
 
             self.connected[channel] = None
             self.registered[channel] = None
             self.ssh_stream[channel] = False
             self.ssh_channel[channel] = False
+            self.close_events[channel].clear()
+            self.read_unpacker[channel] = msgpack.Unpacker(encoding='utf-8')
+            self.read_size[channel] = self.read_size_min
             messages = None
             stderrdata = ''
 
             try:
-                if not self.ssh_stream[channel]:
-                    self.logger.debug('[%s] Open ssh connection' % (channel, ))
-                    self.ssh_stream[channel] = create_ssh_stream(self.config, exit_on_failure=False)
-
                 self.logger.debug('[%s] open channel' % (channel, ))
 
-                self.ssh_channel[channel] = self.ssh_stream[channel].get_transport().open_session()
+                # all channels share one ssh connection, which is established only if not yet done
+                self.ssh_channel[channel] = open_ssh_session(self.config, exit_on_failure=False)
+                self.ssh_stream[channel] = self.ssh_channel[channel].get_transport()
                 self.ssh_channel[channel].exec_command('stream')
             except (KeyboardInterrupt, SystemExit):
                 raise
@@ -263,26 +370,16 @@ class BackendClient:
                     self.logger.info("Successfully reconnected.")
 
             if not self.registered[channel]:
-                # make sure to close channel and connection first
+                # make sure to close channel first, the connection is shared with other channels
                 try:
                     self.ssh_channel[channel] and self.ssh_channel[channel].close()
                 except: pass
 
-                try:
-                    self.ssh_stream[channel] and self.ssh_stream[channel].close()
-                except: pass
-
                 self.logger.debug("[%s] Client: registration failed. stderrdata: %s" % (channel, stderrdata))
                 self.connected[channel] = False
 
-                try:
-                    self.logger.debug('[%s] Client: ssh_tream close due to registration failure' % (channel, ))
-                    self.ssh_stream[channel].close()
-                except (KeyboardInterrupt, SystemExit):
-                    raise
-
                 self.connection_tries += 1
-                if not self.was_connected_once[channel] and self.go_offline_on_first_failed_attempt:
+                if not any(six.itervalues(self.was_connected_once)) and self.go_offline_on_first_failed_attempt:
                     # initial try needs to be online, otherwise we go offline
                     self.go_offline()
 
@@ -302,11 +399,24 @@ class BackendClient:
             else:
                 self.was_connected_once[channel] = True
 
+                if self.io_loop:
+                    ssh_channel = self.ssh_channel[channel]
+                    # handle_messages() may take locks and do I/O, so it runs in the worker pool
+                    self.io_loop.add_reader(ssh_channel, self.on_readable, channel, ssh_channel, blocking=True)
+
         except Exception as error:
             self.connection_error(channel, error)
         finally:
             self.in_connecting[channel] = False
 
+            if handshake_start is not None:
+                if self.is_registered(channel):
+                    self.reconnect.record_success(channel, time.time() - handshake_start)
+                else:
+                    self.reconnect.record_failure(channel)
+
+            self.notify(channel)
+
         return self.is_connected(channel)
 
     # def debug(self):
@@ -328,20 +438,22 @@ class BackendClient:
             # we don't care when we're not active
             return
 
-        # give it some free time
-        time.sleep(0.1)
-
         # make sure ssh connection is closed, so we can recover
         try:
             if self.ssh_channel[channel]:
+                if self.io_loop:
+                    self.io_loop.remove_reader(self.ssh_channel[channel])
+
                 self.ssh_channel[channel].close()
         except (KeyboardInterrupt, SystemExit):
             raise
 
+        # the connection is shared by all channels, so it's only dropped when it died. A new one is
+        # established with the next connect().
         try:
-            if self.ssh_stream[channel]:
+            if self.ssh_stream[channel] and not self.ssh_stream[channel].is_active():
                 self.logger.debug('[%s] Client: ssh_stream close due to connection error' % (channel,))
-                self.ssh_stream[channel].close()
+                close_ssh_transport(self.ssh_stream[channel])
         except (KeyboardInterrupt, SystemExit):
             raise
 
@@ -353,6 +465,9 @@ class BackendClient:
         self.connected[channel] = False
         self.registered[channel] = False
 
+        self.notify(channel)
+        self.reconnect.record_failure(channel)
+
         if socket is None:
             # python interpreter is already dying, so quit
             return
@@ -389,36 +504,36 @@ class BackendClient:
     def thread_write(self, channel):
         while self.active:
             if self.online is not False:
-                if self.is_connected(channel) and self.is_registered(channel) and self.queues[channel]:
-                    message = self.queues[channel][0]
-
+                if self.is_connected(channel) and self.is_registered(channel) and self.has_work(channel):
                     try:
-                        sent = []
-
-                        if message['_sending'] and not message['_sent']:
-                            message['_sending'] = False
-
                         if not self.is_connected(channel) or not self.is_registered(channel):
                             # additional check to make sure there's no race condition
                             self.logger.debug('[%s] break while sending' % (channel,))
                             break
 
-                        if not message['_sending'] and not message['_sent']:
-                            self.send_message(message, channel)
-                            sent.append(message)
+                        messages = self.collect_batch(channel)
 
-                        self.queue_lock[channel].acquire()
-                        if message in self.queues[channel]:
-                            if message['_sent']:
-                                self.queues[channel].remove(message)
-                        self.queue_lock[channel].release()
+                        if messages:
+                            self.send_batch(messages, channel)
+
+                            if channel in self.outboxes:
+                                self.outboxes[channel].ack([m for m in messages if m['_sent']])
+
+                        self.queue_condition[channel].acquire()
+                        try:
+                            self.queues[channel].written(messages)
+                            self.queues[channel].remove_sent()
+                            # wakes up wait_until_queue_empty
+                            self.queue_condition[channel].notify_all()
+                        finally:
+                            self.queue_condition[channel].release()
 
                     except Exception as e:
                         self.logger.debug('[%s] Closed write thread: exception. %d messages left'
                                           % (channel, len(self.queues[channel]), ))
                         self.connection_error(channel, e)
                 else:
-                    time.sleep(0.1)
+                    self.wait_for_work(channel)
 
                 if self.stop_on_empty_queue[channel]:
                     if len(self.queues[channel]) == 0 or not self.is_connected(channel) or \
@@ -428,38 +543,185 @@ class BackendClient:
                         return
 
                 if self.active and not self.is_connected(channel) and not self.expect_close:
-                    if not self.connect(channel):
-                        time.sleep(1)
+                    # blocks until the backoff delay passed, or we are the probe after an outage
+                    if self.reconnect.wait_for_attempt(channel, lambda: self.active and self.online is not False):
+                        self.connect(channel)
+            else:
+                self.wait_for_work(channel)
 
         self.logger.debug('[%s] Closed write thread: disconnect. %d messages left' % (channel, len(self.queues[channel]), ))
 
+    def has_work(self, channel):
+        """
+        Whether the channel has messages to write and, with acks, the ack window is not full.
+        """
+        queue = self.queues[channel]
+
+        if not queue.pending():
+            return False
+
+        return not self.acks.get(channel) or queue.unacked_bytes < self.ack_window
+
+    def wait_for_work(self, channel):
+        """
+        Blocks the write thread until there is something to do for it: a new message, an ack, a stop
+        request or a connection state change.
+        """
+        def idle():
+            if self.online is False:
+                return True
+
+            if not self.is_connected(channel):
+                # the write thread reconnects, unless the client is closing. Then there is nothing to do until
+                # it stops, or the channel is asked to stop.
+                return self.expect_close and not self.stop_on_empty_queue[channel]
+
+            if not self.is_registered(channel):
+                # registration still in progress
+                return not self.stop_on_empty_queue[channel]
+
+            if self.has_work(channel):
+                return False
+
+            # a stop request ends the thread once all messages are sent, with acks also acknowledged
+            return not self.stop_on_empty_queue[channel] or len(self.queues[channel]) > 0
+
+        self.queue_condition[channel].acquire()
+        try:
+            while self.active and idle():
+                # notify() wakes us up on every change, the timeout only guards against a missed one
+                self.queue_condition[channel].wait(self.write_idle_timeout)
+        finally:
+            self.queue_condition[channel].release()
+
+    def collect_batch(self, channel):
+        """
+        Takes all unsent messages from the head of the channel queue until write_batch_size is reached.
+        The first message is always taken, even if it is bigger than write_batch_size.
+        """
+        deadline = time.time() + self.write_batch_latency
+
+        while True:
+            self.queue_lock[channel].acquire()
+            try:
+                max_bytes = self.write_batch_size
+                if self.acks.get(channel):
+                    max_bytes = min(max_bytes, self.ack_window - self.queues[channel].unacked_bytes)
+
+                messages = self.queues[channel].take(max_bytes)
+            finally:
+                self.queue_lock[channel].release()
+
+            size = sum(m['_total'] for m in messages)
+
+            remaining = deadline - time.time()
+            if not messages or size >= self.write_batch_size or remaining <= 0:
+                self.prepare_batch(messages, channel)
+                return messages
+
+            time.sleep(remaining)
+
+    def prepare_batch(self, messages, channel):
+        """
+        Loads the data of spilled messages and compresses them for the current connection.
+        """
+        codecs = self.compression_codecs.get(channel) or []
+        diff = 0
+
+        for message in messages:
+            if message['_data'] is None:
+                # spilled to the outbox
+                self.outboxes[channel].load(message)
+
+            if 'zlib' in codecs:
+                diff += self.compressor.compress(message)
+            else:
+                diff += self.compressor.decompress(message)
+
+            message['_total'] = len(message['_data'])
+
+        if diff:
+            self.queue_lock[channel].acquire()
+            try:
+                self.queues[channel].bytes += diff
+                self.bytes_total += diff
+            finally:
+                self.queue_lock[channel].release()
+
     def thread_read(self, channel):
         while self.active:
-            if self.online is not False:
-                if self.is_connected(channel) and self.is_registered(channel):
-                    try:
-                        # this blocks if we have data
-                        messages = self.read(channel)
+            if self.online is not False and self.is_connected(channel) and self.is_registered(channel):
+                try:
+                    # this blocks until we have data or the channel got closed
+                    messages = self.read(channel)
+
+                    if messages is not None:
+                        self.logger.debug("[%s] Client: handle message: %s" % (channel, str(messages)))
+                        self.handle_messages(channel, messages)
+
+                    if self.stop_on_empty_queue[channel]:
+                        break
+                except Exception as e:
+                    self.logger.debug('[%s] Closed read thread: exception' % (channel, ))
+                    self.connection_error(channel, e)
+            else:
+                self.wait_for_connection(channel)
 
-                        if messages is not None:
-                            self.logger.debug("[%s] Client: handle message: %s" % (channel, str(messages)))
-                            self.handle_messages(channel, messages)
+        # the server closes the channel after our `end`, keep reading until then so wait_for_close sees it
+        while (self.stop_on_empty_queue[channel] or self.expect_close) and self.is_connected(channel) \
+                and not self.close_events[channel].is_set():
+            try:
+                messages = self.read(channel)
+                if messages is not None:
+                    self.handle_messages(channel, messages)
+            except Exception:
+                break
 
-                        if self.stop_on_empty_queue[channel]:
-                            return
-                    except Exception as e:
-                        self.logger.debug('[%s] Closed read thread: exception' % (channel, ))
-                        self.connection_error(channel, e)
+        self.logger.debug('[%s] Closed read thread: ended' % (channel, ))
 
-            time.sleep(0.01)
+    def on_readable(self, channel, ssh_channel):
+        """
+        Replaces thread_read with `io_core: asyncio`, called in the IOLoop worker pool when ssh_channel has data.
+        recv() does not block then.
+        """
+        if (not self.active and not self.expect_close) or self.ssh_channel.get(channel) is not ssh_channel \
+                or not self.is_registered(channel):
+            # a reconnect replaced the channel meanwhile
+            self.io_loop.remove_reader(ssh_channel)
+            return
 
-        self.logger.debug('[%s] Closed read thread: ended' % (channel, ))
+        try:
+            messages = self.read(channel)
+
+            if messages is not None:
+                self.logger.debug("[%s] Client: handle message: %s" % (channel, str(messages)))
+                self.handle_messages(channel, messages)
+        except Exception as e:
+            self.logger.debug('[%s] Closed reader: exception' % (channel, ))
+            self.connection_error(channel, e)
+
+        if self.close_events[channel].is_set():
+            # a closed channel stays readable
+            self.io_loop.remove_reader(ssh_channel)
+
+    def wait_for_connection(self, channel):
+        """
+        Blocks the read thread until the channel is connected and registered, or the client stops.
+        """
+        self.queue_condition[channel].acquire()
+        try:
+            while self.active and (self.online is False or not self.is_connected(channel)
+                                   or not self.is_registered(channel)):
+                self.queue_condition[channel].wait()
+        finally:
+            self.queue_condition[channel].release()
 
     def _end_channel(self, channel):
         """
         Soft end of ssh channel. End the writing thread as soon as the message queue is empty.
         """
         self.stop_on_empty_queue[channel] = True
+        self.notify(channel)
 
         # by joining the we wait until its loop finishes.
         # it won't loop forever since we've set self.stop_on_empty_queue=True
@@ -476,8 +738,12 @@ class BackendClient:
                               % ([str(i) + ':' + str(len(x)) for i, x in six.iteritems(self.queues)],))
 
             for channel, messages in six.iteritems(self.queues):
-                for idx, message in enumerate(messages):
-                    self.logger.debug("[%s] %d: %s" % (channel, idx, str(message)[0:120]))
+                self.queue_lock[channel].acquire()
+                try:
+                    for idx, message in enumerate(messages):
+                        self.logger.debug("[%s] %d: %s" % (channel, idx, str(message)[0:120]))
+                finally:
+                    self.queue_lock[channel].release()
 
             # send all missing messages
 
@@ -501,9 +767,14 @@ class BackendClient:
 
         self.logger.debug("wait_until_queue_empty: report=%s %s"
                           % (str(report), str([channel+':'+str(len(self.queues[channel])) for channel in channels]), ))
-        queues = []
+        # lanes are sent in order, so when their current tails are sent everything queued until now went out
+        tails = {}
         for channel in channels:
-            queues += self.queues[channel][:]
+            self.queue_lock[channel].acquire()
+            try:
+                tails[channel] = self.queues[channel].tails()
+            finally:
+                self.queue_lock[channel].release()
 
         def print_progress():
             if report:
@@ -519,15 +790,27 @@ class BackendClient:
                 sys.__stderr__.write(state['message'])
                 sys.__stderr__.flush()
 
+        def channel_sent(channel):
+            return all(m['_sent'] for m in tails[channel])
+
         while True:
-            all_empty = all(m['_sent'] for m in queues)
+            all_empty = all(channel_sent(channel) for channel in channels)
 
             print_progress()
 
-            if all_empty:
+            if all_empty or not self.active or self.online is False:
                 break
 
-            time.sleep(0.2)
+            for channel in channels:
+                self.queue_condition[channel].acquire()
+                try:
+                    while not channel_sent(channel) and self.active and self.online is not False:
+                        # when reporting we wake up regularly to update the progress
+                        self.queue_condition[channel].wait(0.2 if report else None)
+                        if report:
+                            break
+                finally:
+                    self.queue_condition[channel].release()
 
         print_progress()
 
@@ -541,16 +824,14 @@ class BackendClient:
             return
 
         self.active = False
+        self.notify()
 
-        i = 0
         try:
             for channel, file in six.iteritems(self.ssh_channel):
-                while file and not file.closed:
-                    i += 1
-                    time.sleep(0.1)
-                    if i % 50 == 0:
-                        self.logger.warning("[%s] We are still waiting for connection closing on server side."
-                                            % (channel, ))
+                # the read thread or reader signals the close of the channel by the server
+                while file and not file.closed and not self.close_events[channel].wait(5):
+                    self.logger.warning("[%s] We are still waiting for connection closing on server side."
+                                        % (channel, ))
         except (SystemExit, KeyboardInterrupt):
             raise
 
@@ -559,13 +840,21 @@ class BackendClient:
     def close(self):
         self.active = False
         self.connected = {}
+
+        for event in six.itervalues(self.close_events):
+            # nothing to wait for anymore
+            event.set()
         self.registered = {}
+        self.notify()
 
-        for channel, stream in six.iteritems(self.ssh_stream):
+        for channel, file in six.iteritems(self.ssh_channel):
             try:
-                if stream:
-                    self.logger.debug('[%s] Client: ssh_tream close due to close call' % (channel, ))
-                    stream.close()
+                if file:
+                    self.logger.debug('[%s] Client: ssh_channel close due to close call' % (channel, ))
+                    if self.io_loop:
+                        self.io_loop.remove_reader(file)
+
+                    file.close()
             except (KeyboardInterrupt, SystemExit):
                 raise
 
@@ -575,6 +864,122 @@ class BackendClient:
         self.ssh_stream = {}
         self.online = False
 
+        for outbox in six.itervalues(self.outboxes):
+            outbox.close()
+
+        if self.capture:
+            self.capture.close()
+
+        for limiters in six.itervalues(self.limiters):
+            for limiter in limiters:
+                if isinstance(limiter, HostFairShare):
+                    limiter.close()
+
+    def create_limiters(self, channel):
+        """
+        Upload rate limits in bytes per second from the home config:
+
+            bandwidth_limit_channels  per channel, e.g. {files: 1000000}. The main channel is '' or main.
+            bandwidth_limit           for all channels of this process together
+            bandwidth_host_limit      for all jobs on this host together, fairly shared by the uploading ones.
+                                      Jobs started by `aetros server` share among themselves.
+        """
+        limiters = []
+
+        channel_limits = self.config.get('bandwidth_limit_channels') or {}
+        rate = channel_limits.get(channel) or channel_limits.get(channel or 'main')
+        if rate:
+            limiters.append(TokenBucket(rate))
+
+        if self.config.get('bandwidth_limit'):
+            limiters.append(process_bucket(self.config['bandwidth_limit']))
+
+        if self.config.get('bandwidth_host_limit') and self.config.get('storage_dir'):
+            group = os.getenv('AETROS_BANDWIDTH_GROUP') or 'default'
+            path = os.path.normpath(self.config['storage_dir'] + '/bandwidth/' + group)
+            limiters.append(host_fair_share(path, self.config['bandwidth_host_limit']))
+
+        return limiters
+
+    def start_outbox(self, channel):
+        """
+        Opens the outbox of the channel and queues again all messages a previous process did not send.
+        """
+        outbox = Outbox(
+            os.path.normpath(self.outbox_path + '/' + (channel or 'main')),
+            fsync=self.config.get('outbox_fsync', 'interval'),
+            fsync_interval=self.config.get('outbox_fsync_interval', 1),
+            memory_window=self.config.get('outbox_memory_window', 32 * 1024 * 1024),
+            logger=self.logger
+        )
+
+        messages = outbox.replay()
+        self.outboxes[channel] = outbox
+
+        if outbox.client_session:
+            # replayed messages are written with their old seq, new ones continue after the last one
+            self.sessions[channel] = outbox.client_session
+            self.sequence[channel] = outbox.last_seq
+
+        outbox.start_session(self.sessions.get(channel, self.session), self.sequence[channel])
+
+        if messages:
+            self.logger.info("[%s] Resend %d messages from outbox %s" % (channel, len(messages), outbox.path))
+
+        self.queue_lock[channel].acquire()
+        try:
+            for message in messages:
+                self.message_id += 1
+                message['_id'] = self.message_id
+                self.enqueue(message, channel, message.pop('_important'))
+        finally:
+            self.queue_lock[channel].release()
+
+        outbox.replayed()
+
+    def enqueue(self, message, channel, important):
+        """
+        Internal. Adds a queue entry to the channel queue and the outbox. Needs queue_lock.
+        Returns the queue entry carrying the message data.
+        """
+        queue = self.queues[channel]
+        outbox = self.outboxes.get(channel)
+
+        spill = outbox is not None and queue.bytes + message['_total'] > outbox.memory_window
+        if spill:
+            # spilled messages live on disk until sent and are never merged
+            message.pop('_chunks', None)
+
+        queued_bytes = queue.bytes
+        # returns an already queued store-blob or stream-blob when this message got merged into it
+        entry = queue.append(message, important)
+        self.bytes_total += queue.bytes - queued_bytes
+
+        if outbox is not None:
+            if entry is not message and entry.get('type') == 'stream-blob':
+                for chunk in message['_chunks']:
+                    outbox.append(entry, chunk)
+            else:
+                outbox.put(entry, important, spill)
+
+        return entry
+
+    def wait_for_queue_space(self, channel, max_bytes):
+        """
+        Blocks while more than max_bytes are queued in the channel, so producers of big data like Git.push keep
+        only a bounded amount in memory. Channels with outbox spill to disk instead and never block.
+        """
+        if channel in self.outboxes or channel not in self.queues:
+            return
+
+        self.queue_condition[channel].acquire()
+        try:
+            while self.queues[channel].bytes > max_bytes and self.active and self.online is not False:
+                # the write thread notifies after each batch, the timeout covers going offline meanwhile
+                self.queue_condition[channel].wait(0.5)
+        finally:
+            self.queue_condition[channel].release()
+
     def is_online(self):
         """
         Whether we are/were able to connect to Aetros server.
@@ -593,57 +998,82 @@ class BackendClient:
             # as we would lose information in git streams.
             return
 
+        if is_debug2():
+            sys.__stderr__.write("JobBackend:send(%s, %s, %s)\n" % (str(data)[0:180], str(channel), str(important)))
+            sys.__stderr__.flush()
+
+        message = {}
+
+        if 'type' in data:
+            message['type'] = data['type']
+
+        if 'path' in data:
+            message['path'] = data['path']
+
+        if 'type' in data and data['type'] == 'git-unpack-objects':
+            # extract to send it to the UI, to display what is currently being uploaded
+            message['objects'] = data['objects']
+            del data['objects']
+
+            if 'upload' in data:
+                # progress of a pack sent in several parts, see Git.push
+                message['_upload'] = data.pop('upload')
+
+        if 'type' in data and data['type'] == 'stream-blob' and sorted(data.keys()) == ['data', 'path', 'type'] \
+                and isinstance(data['data'], (six.binary_type, six.text_type)):
+            # raw chunk, so the queue can merge it into an unsent stream-blob of the same path
+            message['_chunks'] = [data['data']]
+
+        message['_data'] = msgpack.packb(data, default=invalid_json_values)
+
+        return self.send_packed(message, channel, important)
+
+    def send_packed(self, message, channel='', important=False):
+        """
+        Queues a message that is already packed in message['_data'], with type, path, objects and _chunks
+        set like send() does. Used by send() and to replay captured messages.
+        """
+        if not self.active or self.online is False:
+            return
+
         self.queue_lock[channel].acquire()
 
         try:
             if self.channel_closed[channel]:
                 # make sure, we don't add new one
-                self.logger.debug('Warning: channel %s got message although closed: %s' % (channel, str(data)[:150]))
+                self.logger.debug('Warning: channel %s got message although closed: %s'
+                                  % (channel, str(message)[:150]))
                 return
 
             if self.stop_on_empty_queue[channel]:
                 # make sure, we don't add new one
                 self.logger.debug('Warning: channel %s got message although requested to stop: %s'
-                                  % (channel, str(data)[:150]))
+                                  % (channel, str(message)[:150]))
                 return
 
             self.message_id += 1
-
-            if is_debug2():
-                sys.__stderr__.write("JobBackend:send(%s, %s, %s)\n" % (str(data)[0:180], str(channel), str(important)))
-                sys.__stderr__.flush()
-
-            message = {}
             message['_id'] = self.message_id
-
-            if 'type' in data:
-                message['type'] = data['type']
-
-            if 'path' in data:
-                message['path'] = data['path']
-
-            if 'type' in data and data['type'] == 'git-unpack-objects':
-                # extract to send it to the UI, to display what is currently being uploaded
-                message['objects'] = data['objects']
-                del data['objects']
-
-            message['_data'] = msgpack.packb(data, default=invalid_json_values)
             message['_total'] = len(message['_data'])
             message['_bytes_sent'] = 0
             message['_sending'] = False
             message['_sent'] = False
 
-            self.bytes_total += message['_total']
+            if self.capture:
+                # in queue order, compressed and written below without holding the lock
+                self.capture.add(channel, important, message)
 
-            if important:
-                self.queues[channel].insert(0, message)
-            else:
-                self.queues[channel].append(message)
+            message = self.enqueue(message, channel, important)
+
+            # wakes up the write thread
+            self.queue_condition[channel].notify_all()
 
             return message['_total']
         finally:
             self.queue_lock[channel].release()
 
+            if self.capture:
+                self.capture.write_pending()
+
     def send_message(self, message, channel):
         """
         Internal. Sends the actual message from a queue entry.
@@ -651,50 +1081,177 @@ class BackendClient:
         if not self.is_connected(channel):
             return False
 
-        message['_sending'] = True
-
-        if '_data' in message:
-            data = message['_data']
-        else:
+        if '_data' not in message:
             data = msgpack.packb(message, default=invalid_json_values)
             self.bytes_total += len(data)
+            message['_data'] = data
+            message['_total'] = len(data)
             message['_bytes_sent'] = 0
+            message['_sent'] = False
             message['_id'] = -1
 
+        return self.send_batch([message], channel)
+
+    def send_batch(self, messages, channel):
+        """
+        Internal. Sends several queue entries as one contiguous buffer. Every message gets its
+        _bytes_sent/_sent accounting as soon as the bytes covering it went through the channel.
+
+        Messages can't be interleaved on the wire since each one is a single msgpack frame, so priority
+        messages overtake bulk ones at message boundaries: take() starts every batch with the priority lane
+        and a message bigger than write_batch_size is sent alone.
+
+        When the server acknowledges messages (see handle_ack), queued messages are framed as [seq, message]
+        and only marked as _written. seq is assigned once, so a message sent again after a reconnect has the
+        same seq and the server can drop what it already processed.
+        """
+        if not self.is_connected(channel):
+            return False
+
+        acks = self.acks.get(channel)
+        # messages getting their seq now
+        sequenced = []
+        parts = []
+        # wire offset where each message ends
+        ends = []
+        size = 0
+
+        for message in messages:
+            message['_sending'] = True
+            message['_bytes_sent'] = 0
+
+            if acks and message['_id'] > 0:
+                if '_seq' not in message:
+                    self.sequence[channel] += 1
+                    message['_seq'] = self.sequence[channel]
+                    sequenced.append(message)
+
+                # msgpack array of 2 elements, followed by seq and the already packed message
+                header = b'\x92' + msgpack.packb(message['_seq'])
+                parts.append(header)
+                size += len(header)
+
+            parts.append(message['_data'])
+            size += message['_total']
+            ends.append(size)
+
+        if len(parts) == 1 or len(messages) == 1:
+            # a big message is sent from its own buffer, without copying it
+            buffers = [memoryview(part) for part in parts]
+        else:
+            buffers = [memoryview(b''.join(parts))]
+
+        if sequenced and channel in self.outboxes:
+            # a later process must write them with the same seq, they might reach the server now
+            self.outboxes[channel].sequenced(sequenced)
+
         if is_debug2():
-            sys.__stderr__.write("[%s] send message: %s\n" % (channel, str(msgpack.unpackb(data))[0:180]))
+            for message in messages:
+                sys.__stderr__.write("[%s] send message: %s\n"
+                                     % (channel, str(msgpack.unpackb(message['_data']))[0:180]))
+
+        # index of the message the next sent bytes belong to
+        current = 0
+        offset = 0
 
         try:
-            while data:
-                start = time.time()
-                bytes_sent = self.ssh_channel[channel].send(data)
+            for data in buffers:
+                position = 0
 
-                data = data[bytes_sent:]
-                message['_bytes_sent'] += bytes_sent
-                self.bytes_sent += bytes_sent
+                while position < len(data):
+                    start = time.time()
+                    bytes_sent = self.ssh_channel[channel].send(data[position:position + self.write_chunk_size])
 
-                end = time.time()
-                self.write_speeds.append(bytes_sent / (end-start))
+                    position += bytes_sent
+                    offset += bytes_sent
+                    self.bytes_sent += bytes_sent
 
-                speeds_len = len(self.write_speeds)
-                if speeds_len:
-                    self.bytes_speed = sum(self.write_speeds) / speeds_len
-                    if speeds_len > 10:
-                        self.write_speeds = self.write_speeds[5:]
+                    # paramiko sends at most one packet per call, so this paces in small steps
+                    delay = 0
+                    for limiter in self.limiters.get(channel, []):
+                        delay = max(delay, limiter.consume(bytes_sent))
+
+                    while current < len(messages) and ends[current] <= offset:
+                        self.message_written(messages[current], acks)
+                        current += 1
+
+                    if current < len(messages):
+                        message = messages[current]
+                        message['_bytes_sent'] = max(0, message['_total'] - (ends[current] - offset))
+
+                    end = time.time()
+                    self.write_speeds.append(bytes_sent / max(end - start, 1e-6))
+                    self.bytes_speed = sum(self.write_speeds) / len(self.write_speeds)
+
+                    if delay:
+                        time.sleep(delay)
+
+            for message in messages:
+                self.message_written(message, acks)
 
-            message['_sent'] = True
             return True
 
         except (KeyboardInterrupt, SystemExit):
-            if message['_sent']:
-                return message['_bytes_sent']
+            if messages[-1]['_sent']:
+                return messages[-1]['_bytes_sent']
 
             return False
 
         except Exception as error:
+            self.queue_lock[channel].acquire()
+            try:
+                self.queues[channel].release(messages)
+            finally:
+                self.queue_lock[channel].release()
+
             self.connection_error(channel, error)
             return False
 
+    def message_written(self, message, acks):
+        message['_bytes_sent'] = message['_total']
+
+        if acks and message['_id'] > 0:
+            message['_written'] = True
+        else:
+            message['_sent'] = True
+
+    def handle_ack(self, channel, seq):
+        """
+        The server processed all messages up to seq. They are removed from the queue and the outbox.
+        """
+        self.queue_condition[channel].acquire()
+        try:
+            acked = self.queues[channel].ack(seq)
+            self.queues[channel].remove_sent()
+            # wakes up wait_until_queue_empty and the write thread waiting for the ack window
+            self.queue_condition[channel].notify_all()
+        finally:
+            self.queue_condition[channel].release()
+
+        if acked and channel in self.outboxes:
+            self.outboxes[channel].ack(acked)
+
+    def queue_tails(self, channel):
+        """
+        Returns the last queued messages of the channel. Once they are _sent, everything queued until now has been
+        written to the server, with acks also acknowledged by it.
+        """
+        if channel not in self.queues:
+            return []
+
+        self.queue_lock[channel].acquire()
+        try:
+            return self.queues[channel].tails()
+        finally:
+            self.queue_lock[channel].release()
+
+    def is_acknowledged(self):
+        """
+        Whether the server acknowledged every message, which needs acks on all channels.
+        """
+        return bool(self.queues) and all(self.acks.get(channel) and not len(queue)
+                                         for channel, queue in six.iteritems(self.queues))
+
     def handle_messages(self, channel, messages):
         self.lock.acquire()
         try:
@@ -703,6 +1260,9 @@ class BackendClient:
                     continue
 
                 if 'a' in message:
+                    if 'ack' == message['a']:
+                        self.handle_ack(channel, message['seq'])
+
                     if not self.external_stopped and 'stop' == message['a']:
                         self.external_stopped = True
                         self.event_listener.fire('stop', message['force'])
@@ -714,16 +1274,9 @@ class BackendClient:
         Reads until we receive at least one message we can unpack. Return all found messages.
         """
 
-        unpacker = msgpack.Unpacker(encoding='utf-8')
-
         while True:
             try:
-                start = time.time()
-                chunk = self.ssh_channel[channel].recv(1024)
-                end = time.time()
-                self.read_speeds.append( len(chunk) / (end-start) )
-                if len(self.read_speeds) > 20:
-                    self.read_speeds = self.read_speeds[10:]
+                chunk = self.recv(channel)
 
                 if chunk == b'':
                     # happens only when connection broke. If nothing is to be received, it hangs instead.
@@ -733,31 +1286,49 @@ class BackendClient:
                 self.connection_error(channel, error)
                 raise
 
-            unpacker.feed(chunk)
+            self.read_unpacker[channel].feed(chunk)
 
-            messages = [m for m in unpacker]
+            messages = [m for m in self.read_unpacker[channel]]
             if messages:
                 return messages
 
-    def read(self, channel):
+    def recv(self, channel):
         """
-        Reads from the socket and tries to unpack the message. If successful (because msgpack was able to unpack)
-        then we return that message. Else None. Keep calling .read() when new data is available so we try it
-        again.
+        Blocks until data is available and reads it. Read size grows when the buffer comes back full and
+        shrinks again when the channel is quiet.
         """
+        ssh_channel = self.ssh_channel[channel]
 
-        if not self.ssh_channel[channel].recv_ready():
-            return
+        # paramiko channels offer a fileno() that becomes readable with new data and stays readable once closed
+        select.select([ssh_channel], [], [])
 
-        try:
-            start = time.time()
-            chunk = self.ssh_channel[channel].recv(1024)
-            end = time.time()
+        size = self.read_size[channel]
+        start = time.time()
+        chunk = ssh_channel.recv(size)
+        end = time.time()
 
-            self.read_speeds.append(len(chunk) / (end-start))
-            if len(self.read_speeds) > 20:
-                self.read_speeds = self.read_speeds[10:]
+        if chunk == b'':
+            # paramiko returns nothing only once the channel is closed, wakes up wait_for_close
+            self.close_events[channel].set()
+
+        if len(chunk) == size:
+            self.read_size[channel] = min(size * 2, self.read_size_max)
+        elif len(chunk) < size // 4:
+            self.read_size[channel] = max(size // 2, self.read_size_min)
+
+        self.read_speeds.append(len(chunk) / max(end - start, 1e-6))
+
+        return chunk
+
+    def read(self, channel):
+        """
+        Blocks until data is available and tries to unpack the message. If successful (because msgpack was able
+        to unpack) then we return that message. Else None. Keep calling .read() so we try it again when the
+        rest of the message arrived.
+        """
 
+        try:
+            chunk = self.recv(channel)
         except Exception as error:
             self.connection_error(channel, error)
             raise
@@ -767,11 +1338,9 @@ class BackendClient:
             self.connection_error(channel, 'Connection broken')
             return None
 
-        # self.read_buffer.seek(0, 2) #make sure we write at the end
-        self.read_unpacker.feed(chunk)
+        self.read_unpacker[channel].feed(chunk)
 
-        # self.read_buffer.seek(0)
-        messages = [m for m in self.read_unpacker]
+        messages = [m for m in self.read_unpacker[channel]]
 
         return messages if messages else None
 
@@ -787,6 +1356,20 @@ class JobClient(BackendClient):
         self.job_id = job_id
         self.name = name
 
+        if self.config.get('outbox') and self.config.get('storage_dir'):
+            self.outbox_path = os.path.normpath(
+                self.config['storage_dir'] + '/' + model_name + '.git/temp/outbox/' + job_id)
+
+        if self.config.get('capture'):
+            # one file per job in the configured directory, replay it with `aetros replay`
+            capture_dir = os.path.abspath(os.path.expanduser(self.config['capture']))
+            if not os.path.exists(capture_dir):
+                os.makedirs(capture_dir)
+
+            self.capture = CaptureWriter(
+                os.path.join(capture_dir, job_id + '.capture'),
+                info={'model': model_name, 'job': job_id, 'name': name})
+
     def on_connect(self, reconnect, channel):
         self.send_message({
             'type': 'register_job_worker',
@@ -794,7 +1377,12 @@ class JobClient(BackendClient):
             'job': self.job_id,
             'reconnect': reconnect,
             'version': __version__,
-            'name': self.name + channel
+            'name': self.name + channel,
+            'compression': self.compressor.codecs if self.compression == 'message' else [],
+            'acks': True,
+            'thin': True,
+            'parts': True,
+            'session': self.sessions.get(channel, self.session),
         }, channel)
 
         self.logger.debug("[%s] Wait for job client registration for %s" % (channel, self.name))
@@ -824,6 +1412,25 @@ class JobClient(BackendClient):
                 return False
 
             if 'registered' == message['a']:
+                # codecs the server is able to decompress, older servers don't send any
+                self.compression_codecs[channel] = message.get('compression') or []
+
+                # messages not acknowledged on the last connection might not have reached the server.
+                # Servers acknowledging messages tell which ones of our session they already processed.
+                self.queue_lock[channel].acquire()
+                try:
+                    self.queues[channel].rewind()
+                finally:
+                    self.queue_lock[channel].release()
+
+                self.acks[channel] = bool(message.get('acks'))
+                # older servers can't resolve deltas against objects outside of the pack
+                self.thin[channel] = bool(message.get('thin'))
+                # and expect a pack in one message
+                self.parts[channel] = bool(message.get('parts'))
+                if self.acks[channel]:
+                    self.handle_ack(channel, message.get('acked') or 0)
+
                 self.registered[channel] = True
                 if channel == '':
                     self.event_listener.fire('registration')
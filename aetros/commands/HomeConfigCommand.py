@@ -56,7 +56,9 @@ class HomeConfigCommand:
         if not config:
             config = {}
 
-        json = ['ssl_verify', 'http_port', 'https_port', 'ssl', 'ssh_port']
+        json = ['ssl_verify', 'http_port', 'https_port', 'ssl', 'ssh_port',
+                'outbox', 'outbox_fsync_interval', 'outbox_memory_window', 'git_push_debounce',
+                'bandwidth_limit', 'bandwidth_limit_channels', 'bandwidth_host_limit']
 
         if parsed_args.delete:
             if parsed_args.value:
@@ -7,6 +7,8 @@ import sys
 
 import os
 
+from aetros.git_batch import CatFile
+from aetros.git_chunks import read_manifest, write_chunks
 from aetros.utils import read_home_config, setup_git_ssh, read_config, git_has_local_job, git_has_remote_job, \
     find_config
 
@@ -61,5 +63,17 @@ class JobCatCommand:
 
         ref = 'refs/aetros/job/' + id_map[parsed_args.job_id]
 
+        cat_file = CatFile(git_dir)
+        try:
+            manifest = read_manifest(cat_file, ref+':'+parsed_args.path)
+            if manifest:
+                # file stored in chunks
+                out = sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout
+                write_chunks(cat_file, manifest, out)
+                out.flush()
+                return
+        finally:
+            cat_file.close()
+
         args = [home_config['git'], '--bare', '--git-dir', git_dir, 'cat-file', '-p', ref+':'+parsed_args.path]
-        subprocess.call(args)
\ No newline at end of file
+        subprocess.call(args)
@@ -7,6 +7,8 @@ import sys
 
 import os
 
+from aetros.git_batch import CatFile
+from aetros.git_chunks import checkout_chunked
 from aetros.utils import read_home_config, setup_git_ssh, read_config, git_has_local_job, git_has_remote_job, \
     find_config
 
@@ -79,4 +81,11 @@ class JobCheckoutCommand:
 
         subprocess.call(
             [home_config['git'], '--bare', '--git-dir', git_dir, '--work-tree', target, 'checkout', ref, '--'] + paths
-        )
\ No newline at end of file
+        )
+
+        # reassemble files stored in chunks
+        cat_file = CatFile(git_dir)
+        try:
+            checkout_chunked(cat_file, ref, target)
+        finally:
+            cat_file.close()
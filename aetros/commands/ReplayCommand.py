@@ -0,0 +1,110 @@
+from __future__ import absolute_import, print_function, division
+import argparse
+import os
+import sys
+import time
+
+
+class ReplayCommand:
+    def __init__(self, logger):
+        self.logger = logger
+
+    def main(self, args):
+        import aetros.const
+        from aetros.benchmarks.transport import TransportBenchmark
+        from aetros.capture import read_capture
+        from aetros.utils import read_home_config
+
+        parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                         prog=aetros.const.__prog__ + ' replay',
+                                         description="Replays a capture file against a local stand-in server.\n"
+                                                     "Record one with `aetros home-config capture ~/captures`.\n"
+                                                     "Batching, compression and bandwidth settings are taken "
+                                                     "from the home config.")
+        parser.add_argument('path', help="Capture file, like ~/captures/ed4d6a204.capture")
+        parser.add_argument('--speed', default='1',
+                            help="Replay speed: 1 replays with the recorded timing, 10 ten times faster, "
+                                 "max without any pauses. Default 1")
+        parser.add_argument('--latency', type=float, default=0, help="Server reply delay in seconds")
+        parser.add_argument('--bandwidth', type=int, default=0,
+                            help="Server read limit in bytes per second. Default unlimited")
+
+        parsed_args = parser.parse_args(args)
+
+        if not os.path.exists(parsed_args.path):
+            print("Capture file %s not found." % (parsed_args.path, ))
+            sys.exit(1)
+
+        speed = None
+        if parsed_args.speed != 'max':
+            try:
+                speed = float(parsed_args.speed)
+            except ValueError:
+                speed = 0
+
+            if speed <= 0:
+                print("Error: --speed needs to be a positive number or max.")
+                sys.exit(1)
+
+        header, records = read_capture(parsed_args.path)
+
+        config = read_home_config()
+        for key in ['host', 'ssh_port', 'ssh_key_base64', 'storage_dir', 'outbox', 'capture']:
+            config.pop(key, None)
+
+        benchmark = TransportBenchmark(latency=parsed_args.latency, bandwidth=parsed_args.bandwidth,
+                                       config=config, logger=self.logger)
+
+        print("Replay job %s of %s, recorded %s, speed %s" % (
+            header.get('job'), header.get('model'), time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['start'])),
+            parsed_args.speed))
+
+        messages = 0
+        message_bytes = 0
+        behind = 0
+        channels = ['']
+
+        try:
+            benchmark.start([''])
+            client = benchmark.client
+            start = time.time()
+
+            for offset, channel, important, meta, chunk, data in records:
+                if channel not in client.queues:
+                    client.start_channel(channel)
+                    channels.append(channel)
+
+                if speed:
+                    delay = start + offset / speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        behind = max(behind, -delay)
+
+                message = dict(meta)
+                message['_data'] = data
+                if chunk is not None:
+                    message['_chunks'] = [chunk]
+
+                client.send_packed(message, channel, important)
+                messages += 1
+                message_bytes += len(data)
+
+            queued = time.time() - start
+            client.wait_until_queue_empty(channels, report=False)
+            took = time.time() - start
+        finally:
+            benchmark.stop()
+
+        received = sum(1 for entry in benchmark.server.messages if entry[2].get('type') != 'register_job_worker')
+
+        print("Channels:           %s" % (', '.join(channel or 'main' for channel in channels), ))
+        print("Messages queued:    %d (%.2f MB)" % (messages, message_bytes / 1024 / 1024))
+        print("Messages on wire:   %d (%.2f MB)" % (received, benchmark.server.bytes_received / 1024 / 1024))
+        print("Queued in:          %.2fs, max %.3fs behind schedule" % (queued, behind))
+        print("Sent in:            %.2fs (%.2f MB/s)" % (took, message_bytes / 1024 / 1024 / took if took else 0))
+
+        stats = client.compressor.stats
+        print("Compressed:         %d of %d messages, %.2f MB saved in %.2fs" % (
+            stats['compressed'], stats['compressed'] + stats['raw'], stats['bytes_saved'] / 1024 / 1024,
+            stats['time']))
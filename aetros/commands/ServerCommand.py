@@ -365,6 +365,9 @@ class ServerCommand:
             if self.ssh_key_private is not None:
                 my_env['AETROS_SSH_KEY_BASE64'] = self.ssh_key_private
 
+            # jobs of this server share `bandwidth_host_limit` fairly
+            my_env['AETROS_BANDWIDTH_GROUP'] = 'server-' + str(os.getpid())
+
             args = [sys.executable, '-m', 'aetros', 'start']
             if resources_assigned['gpus']:
                 for gpu_id in resources_assigned['gpus']:
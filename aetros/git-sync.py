@@ -1,6 +1,8 @@
 import subprocess
 import sys
 
+from aetros.git_batch import CatFile, parse_commit
+
 
 def update_objects(ref, remote_url):
     commit_sha = subprocess.check_output(['git', 'rev-parse', ref]).decode('utf-8').strip()
@@ -8,32 +10,21 @@ def update_objects(ref, remote_url):
         sys.stderr.write("Error: ref %s is not a commit\n" % (ref,))
         sys.exit(1)
 
-    object_type = subprocess.check_output(['git', 'cat-file', '-t', ref]).decode('utf-8').strip()
+    cat_file = CatFile()
+
+    object_type, object_content = cat_file.read(commit_sha)
     if 'commit' != object_type:
         sys.stderr.write("Error: ref %s is not a commit (but a %s)\n" % (ref, object_type))
         sys.exit(1)
 
-    object_content = subprocess.check_output(['git', 'cat-file', '-p', ref]).decode('utf-8').strip()
-    tree_sha = None
-    for line in object_content.splitlines():
-        if line.startswith('tree '):
-            tree_sha = line[len('tree '):]
+    tree_sha, parents = parse_commit(object_content)
 
     if not tree_sha:
         sys.stderr.write("Error: Could not detect the tree for commit\n")
         sys.exit(1)
 
-    object_content = subprocess.check_output(['git', 'ls-tree', '-r', tree_sha]).decode('utf-8').strip()
-    object_shas = []
-
-    for line in object_content.splitlines():
-        exploded = line.split(' ')
-
-        if len(exploded) != 3:
-            sys.stderr.write("Error: Wrong line format of ls-tree for %s: %s\n" % (tree_sha, line, ))
-            sys.exit(1)
-
-        object_shas.append(str(exploded[2][:40]))
+    object_shas = [sha for mode, sha, path in cat_file.walk_tree(tree_sha, trees=False)]
+    cat_file.close()
 
     shas_to_check = [commit_sha, tree_sha] + object_shas
 
@@ -6,17 +6,101 @@ import shutil
 import subprocess
 
 import six
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
 import time
 import sys
 
-from aetros.utils import invalid_json_values, setup_git_ssh, create_ssh_stream, read_home_config, is_debug2, is_debug3
+from aetros.utils import invalid_json_values, setup_git_ssh, open_ssh_session, read_home_config, is_debug2, is_debug3
+from aetros.git_batch import CatFile
+from aetros.git_chunks import write_chunked, chunks_path
+from aetros.git_fast_import import FastImport
+from aetros.git_ref_watch import RefWatch
+from aetros.git_store import StoreFiles
+from aetros.git_writer import TreeBuilder, write_object, serialize_commit, signature, read_ref, update_ref
+from aetros.io_loop import get_io_loop
 
 
 class GitCommandException(Exception):
     pass
 
 
+class DeltaHeuristic(object):
+    """
+    Decides per push whether git computes deltas for its pack, used with `git_delta: auto`.
+
+    Only blobs between min_blob_size and max_blob_size count, smaller ones win little and bigger ones cost too
+    much CPU and memory. Together they need min_bytes and something to delta against: the objects of the receiver
+    or another version of the same path in the pack.
+
+    Deltas cost several times the CPU of complete objects, and git keeps a delta only when it's at most half of
+    the object. When a deltified pack saved less than min_saving of the blob bytes (e.g. weights that change
+    completely every epoch), the next 2, 4, ... 32 pushes are sent without trying.
+    """
+
+    def __init__(self, min_blob_size=16 * 1024, max_blob_size=256 * 1024 * 1024, min_bytes=256 * 1024,
+                 min_saving=0.1):
+        self.min_blob_size = min_blob_size
+        self.max_blob_size = max_blob_size
+        self.min_bytes = min_bytes
+        self.min_saving = min_saving
+
+        self.misses = 0
+        self.skip = 0
+
+    def use_delta(self, blobs, has_bases):
+        """
+        :param blobs: list of (path, size) of the blobs in the pack
+        :param has_bases: whether the receiver has objects of this ref already
+        """
+        candidates = [(path, size) for path, size in blobs if self.min_blob_size <= size <= self.max_blob_size]
+
+        if sum(size for path, size in candidates) < self.min_bytes:
+            return False
+
+        if self.skip:
+            self.skip -= 1
+            return False
+
+        if has_bases:
+            return True
+
+        paths = [path for path, size in candidates]
+
+        return len(set(paths)) < len(paths)
+
+    def record(self, pack_bytes, blob_bytes):
+        """
+        Result of a deltified pack.
+        """
+        if blob_bytes and pack_bytes > blob_bytes * (1 - self.min_saving):
+            self.misses = min(self.misses + 1, 5)
+            self.skip = 2 ** self.misses
+        else:
+            self.misses = 0
+
+
+def pack_objects_command(git_dir, object_shas, paths=None, bases=None):
+    """
+    Returns (command, input) of `git pack-objects --stdout` for object_shas.
+
+    Without bases all objects are sent complete, which is the cheapest to create. With bases (commits the receiver
+    has, can be empty) git computes deltas, also against the objects of bases. That's a thin pack, the receiver
+    needs those objects to unpack it.
+
+    :param paths: dict sha -> path of blobs, lets git find the other versions of a file as delta base
+    """
+    command = ['git', '--bare', '--git-dir', git_dir, 'pack-objects', '--stdout', '--compression=0']
+
+    if bases is None:
+        return command + ['--no-reuse-delta'], '\n'.join(object_shas)
+
+    paths = paths or {}
+    lines = ['-' + sha for sha in bases]
+    lines += [sha + ' ' + paths[sha] if sha in paths else sha for sha in object_shas]
+
+    return command, '\n'.join(lines)
+
+
 class Git:
     """
     This class is used to store and sync all job data to local git or (if online) stream files directly to AETROS Trainer server.
@@ -65,8 +149,57 @@ class Git:
         self.job_id = None
         self.active_thread = False
         self.thread_push_instance = None
-
-        self.synced_object_shas = {}
+        self.last_synced_head = None
+
+        # commits of this process set head_changed (with `io_core: asyncio` trigger push_debounced of the shared
+        # IOLoop instead), commits of other processes are seen by ref_watch. A push waits push_debounce seconds
+        # to collect a burst of commits. The head is checked again every push_recheck_interval seconds only while
+        # a push failed, packs are not acknowledged by a server with acks or inotify is not available.
+        self.io_loop = get_io_loop(config, logger)
+        self.head_changed = Event()
+        self.ref_watch = None
+        self.push_debounced = None
+        self.push_periodic = None
+        self.push_debounce = config.get('git_push_debounce', 0.5)
+        self.push_recheck_interval = 0.5
+
+        # see get_synced_commits(), synced_commits is ahead of the persisted confirmed_commits while packs are on
+        # their way to the server
+        self.synced_job_id = None
+        self.synced_commits = set()
+        self.confirmed_commits = set()
+        # last queued messages of the files channel after the latest pack, see store_written_commits()
+        self.pack_tails = []
+
+        # packs bigger than pack_chunk_size are streamed in parts, with at most pack_window bytes queued
+        self.pack_chunk_size = 1024 * 1024
+        self.pack_window = 8 * 1024 * 1024
+
+        # `git_delta: auto` lets git compute deltas when DeltaHeuristic finds it worth it, `always` for every push
+        # and `never` sends complete objects only
+        self.delta_mode = config.get('git_delta', 'auto')
+        self.delta_heuristic = DeltaHeuristic()
+
+        # files under aetros/weights/ from chunk_weights_size on and all others from chunk_file_size on are stored
+        # as manifest plus content-defined chunks, see add_chunked_file()
+        self.chunk_weights_size = 1024 * 1024
+        self.chunk_file_size = 10 * 1024 * 1024
+
+        # all object reads go through long-living cat-file processes instead of a fork per read
+        self.cat_file = CatFile(self.git_path)
+
+        # `git_writer: cli` forks git for blobs, trees and commits. Opt-in alternatives: `native` writes them
+        # in-process, `fast-import` streams the commits of the job ref into a long-running git fast-import.
+        self.git_writer = config.get('git_writer', 'cli')
+        self.native_writer = self.git_writer == 'native'
+        self.fast_import = FastImport(self.git_path) if self.git_writer == 'fast-import' else None
+
+        # where add_file() stages until the next commit_index(): 'index' (the index file), 'tree' (self.tree,
+        # native writer) or 'stream' (self.stream_changes for self.fast_import). read_tree() picks tree or stream,
+        # work tree adds still need the index, see add_file_path_in_work_tree().
+        self.staging = 'index'
+        self.tree = TreeBuilder(self.git_path, self.cat_file)
+        self.stream_changes = []
 
         self.git_batch_commit = False
 
@@ -75,7 +208,10 @@ class Git:
         self.keep_stream_files = False
 
         self.streamed_files = {}
-        self.store_files = {}
+
+        # StoreFiles of the job, created on the first store_file()
+        self.store_files = None
+        self.store_files_interval = 5
 
         git_not_found = 'Git binary not available. Please install Git >= 2.3.0 first and make it available in $PATH.'
         try:
@@ -305,6 +441,11 @@ class Git:
             self.logger.error("Could not load job information for " + job_id + '. You need to be online to start pre-configured jobs.')
             raise
 
+        # everything fetched is on the server
+        self.get_synced_commits()
+        self.synced_commits = set([self.get_head_commit()])
+        self.store_synced_commits()
+
         self.read_job(job_id, checkout)
 
     def is_job_fetched(self, job_id):
@@ -325,7 +466,7 @@ class Git:
 
         commit = self.get_head_commit()
         self.logger.debug('Job ref points to ' + commit)
-        self.command_exec(['read-tree', self.ref_head])
+        self.read_tree(self.ref_head)
 
         if checkout:
             self.logger.debug('Working directory in ' + self.work_tree)
@@ -349,7 +490,46 @@ class Git:
         :param ref: the actual git reference
         :return:
         """
+        if self.fast_import and ref == self.ref_head:
+            # the stream knows the tip of the job ref, even before its next checkpoint
+            self.stream_changes = []
+            self.staging = 'stream'
+            return
+
+        self.flush_stream()
+
+        if self.native_writer:
+            commit = read_ref(self.git_path, ref)
+            if commit:
+                self.tree.load(commit)
+                self.staging = 'tree'
+                return
+
         self.command_exec(['read-tree', ref])
+        self.staging = 'index'
+
+    def flush_stream(self):
+        """
+        Makes commits streamed into git fast-import visible on disk. Needed before reading the job ref.
+        """
+        if self.fast_import:
+            self.fast_import.checkpoint()
+
+    def stream_to_index(self):
+        """
+        Moves changes staged for git fast-import into the index, for commands that work on the index.
+        """
+        changes = self.stream_changes
+        self.stream_changes = []
+        self.staging = 'index'
+
+        self.flush_stream()
+        self.command_exec(['read-tree', self.ref_head])
+
+        for change in changes:
+            mode, content, path = change[:3]
+            # (mode, sha, path, True) refers to an existing blob
+            self.add_index(mode, content if len(change) > 3 else self.write_blob(content), path)
 
     # def restart_job(self):
     #     if not self.job_id:
@@ -394,13 +574,24 @@ class Git:
         self.add_file('aetros/job.json', simplejson.dumps(data, indent=4))
         tree_id = self.write_tree()
 
-        self.job_id = self.command_exec(['commit-tree', '-m', "JOB_CREATED", tree_id])[0].decode('utf-8').strip()
+        if self.native_writer:
+            # same as `commit-tree -m`, which completes the message with a newline
+            self.job_id = self.write_commit(tree_id, [], "JOB_CREATED\n")
+
+            if read_ref(self.git_path, self.ref_head):
+                self.logger.warning("Generated job id already exists, because exact same experiment values given. Ref " + self.ref_head)
+
+            update_ref(self.git_path, self.ref_head, self.job_id)
+        else:
+            self.job_id = self.command_exec(['commit-tree', '-m', "JOB_CREATED", tree_id])[0].decode('utf-8').strip()
+
+            out, code, err = self.command_exec(['show-ref', self.ref_head], allowed_to_fail=True)
+            if not code:
+                self.logger.warning("Generated job id already exists, because exact same experiment values given. Ref " + self.ref_head)
 
-        out, code, err = self.command_exec(['show-ref', self.ref_head], allowed_to_fail=True)
-        if not code:
-            self.logger.warning("Generated job id already exists, because exact same experiment values given. Ref " + self.ref_head)
+            self.command_exec(['update-ref', self.ref_head, self.job_id])
 
-        self.command_exec(['update-ref', self.ref_head, self.job_id])
+        self.notify_head_change()
 
         # make sure we have checkedout all files we have added until now. Important for simple models, so we have the
         # actual model.py and dataset scripts.
@@ -421,6 +612,21 @@ class Git:
         self.active_thread = True
         self.active_push = True
 
+        self.last_synced_head = self.get_head_commit()
+
+        self.ref_watch = RefWatch(self.git_path, self.ref_head, self.notify_head_change)
+        if not self.ref_watch.start(self.io_loop):
+            self.logger.debug("Git: inotify not available, checking %s every %s seconds"
+                              % (self.ref_head, self.push_recheck_interval))
+            self.ref_watch = None
+
+        if self.io_loop:
+            self.push_debounced = self.io_loop.debounced(self.push_debounce, self.sync_head_debounced, blocking=True)
+
+            if not self.ref_watch:
+                self.push_periodic = self.io_loop.every(self.push_recheck_interval, self.sync_head, blocking=True)
+            return
+
         self.thread_push_instance = Thread(target=self.thread_push)
         self.thread_push_instance.daemon = True
         self.thread_push_instance.start()
@@ -433,8 +639,21 @@ class Git:
         You can not start the process again.
         """
         self.active_thread = False
+        self.head_changed.set()
+
+        if self.ref_watch:
+            self.ref_watch.close()
+            self.ref_watch = None
 
-        if self.thread_push_instance and self.thread_push_instance.isAlive():
+        if self.push_debounced:
+            self.push_debounced.cancel()
+            self.push_debounced.join()
+
+        if self.push_periodic:
+            self.push_periodic.cancel()
+            self.push_periodic.join()
+
+        if self.thread_push_instance and self.thread_push_instance.is_alive():
             self.thread_push_instance.join()
 
         with self.batch_commit('STREAM_END'):
@@ -460,25 +679,27 @@ class Git:
                 if not self.keep_stream_files:
                     os.unlink(full_path)
 
-        with self.batch_commit('STORE_END'):
-            for path, bar in six.iteritems(self.store_files.copy()):
-                full_path = os.path.normpath(self.temp_path + '/store-blob/' + self.job_id + '/' + path)
-                self.logger.debug('Git store end for file: ' + full_path)
+        if self.store_files:
+            # writes the last changes to the disk
+            self.store_files.close()
 
-                del self.store_files[path]
+            with self.batch_commit('STORE_END'):
+                for path, content in self.store_files.items():
+                    self.logger.debug('Git store end for file: ' + path)
 
-                try:
-                    self.stream_files_lock.acquire()
-                    self.commit_file(path, path, open(full_path, 'r').read())
-                finally:
-                    self.stream_files_lock.release()
+                    self.commit_file(path, path, content)
 
-                if not self.keep_stream_files:
-                    os.unlink(full_path)
+                    if not self.keep_stream_files:
+                        self.store_files.remove(path)
 
     def clean_up(self):
         self.logger.debug("Git: clean up")
 
+        self.cat_file.close()
+
+        if self.fast_import:
+            self.fast_import.close()
+
         if os.path.exists(self.index_path):
             os.remove(self.index_path)
 
@@ -552,17 +773,16 @@ class Git:
         and won't push it again.
         """
 
+        if hasattr(data, 'encode'):
+            data = data.encode("utf-8", 'replace')
+
         self.stream_files_lock.acquire()
         try:
+            if not self.store_files:
+                # the files are written to the disk in batches, see StoreFiles
+                self.store_files = StoreFiles(self.temp_path + '/store-blob/' + self.job_id, self.store_files_interval)
 
-            full_path = os.path.normpath(self.temp_path + '/store-blob/' + self.job_id + '/' + path)
-            if not os.path.exists(os.path.dirname(full_path)):
-                os.makedirs(os.path.dirname(full_path))
-
-            if hasattr(data, 'encode'):
-                data = data.encode("utf-8", 'replace')
-
-            already_set = path in self.store_files and self.store_files[path] == data
+            already_set = not self.store_files.set(path, data)
 
             if is_debug3():
                 sys.__stderr__.write('git:store_file(%s, %s, %s), already_set=%s\n'
@@ -571,9 +791,6 @@ class Git:
             if already_set:
                 return
 
-            open(full_path, 'wb').write(data)
-            self.store_files[path] = data
-
             if self.client.online is not False:
                 self.client.send({'type': 'store-blob', 'path': path, 'data': data}, channel='' if fast_lane else 'files')
         finally:
@@ -651,14 +868,58 @@ class Git:
         return Stream(self)
 
     def write_blob(self, content):
+        if self.native_writer:
+            if not isinstance(content, six.binary_type):
+                content = content.encode('utf-8')
+
+            return write_object(self.git_path, 'blob', content)
+
         return self.command_exec(['hash-object', '-w', "--stdin"], content)[0].decode('utf-8').strip()
 
+    def write_commit(self, tree_id, parents, message):
+        """
+        Writes a commit object in-process, byte-identical to `git commit-tree` with message on stdin.
+        :return: str the commit sha
+        """
+        author, committer = self.signatures()
+
+        return write_object(self.git_path, 'commit', serialize_commit(tree_id, parents, author, committer, message))
+
+    def signatures(self):
+        """
+        Author and committer of a new commit, as `git commit-tree` would take them.
+        """
+        author = signature(os.getenv('GIT_AUTHOR_NAME') or self.git_name,
+                           os.getenv('GIT_AUTHOR_EMAIL') or self.git_email)
+        committer = signature(os.getenv('GIT_COMMITTER_NAME') or self.git_name,
+                              os.getenv('GIT_COMMITTER_EMAIL') or self.git_email)
+
+        return author, committer
+
     def add_index(self, mode, blob_id, path):
         """
         Add new entry to the current index
         :param tree: 
         :return: 
         """
+        if self.staging == 'tree':
+            self.tree.set(path, mode, blob_id)
+            return
+
+        if self.staging == 'stream':
+            self.stream_changes.append((mode, blob_id, path, True))
+            return
+
+        if mode == '40000':
+            # a whole directory, replaces all entries below path. Mode 0 removes an entry.
+            removed = self.command_exec(['ls-files', '-z', '--', path + '/'])[0].decode('utf-8').split('\0')
+            lines = ['0 %s\t%s' % ('0' * 40, name) for name in removed if name]
+            lines += ['%s %s\t%s/%s' % (entry_mode, sha, path, name)
+                      for entry_mode, sha, name in self.cat_file.walk_tree(blob_id, trees=False)]
+
+            self.command_exec(['update-index', '-z', '--index-info'], ''.join(line + '\0' for line in lines))
+            return
+
         self.command_exec(['update-index', '--add', '--cacheinfo', mode, blob_id, path])
 
     def write_tree(self):
@@ -666,6 +927,12 @@ class Git:
         Writes the current index into a new tree
         :return: the tree sha
         """
+        if self.staging == 'tree':
+            return self.tree.write()
+
+        if self.staging == 'stream':
+            self.stream_to_index()
+
         return self.command_exec(['write-tree'])[0].decode('utf-8').strip()
 
     def commit_json_file(self, message, path, content):
@@ -695,17 +962,60 @@ class Git:
         :param git_path: str
         :param content: str
         """
+        if self.is_chunked(git_path, len(content)):
+            if not isinstance(content, six.binary_type):
+                content = content.encode('utf-8')
+
+            self.add_chunked_file(git_path, six.BytesIO(content))
+            return
+
+        if self.staging == 'stream':
+            # git fast-import computes the blob
+            self.stream_changes.append(('100644', content, git_path))
+            return
+
         blob_id = self.write_blob(content)
         self.add_index('100644', blob_id, git_path)
 
     def add_file_path(self, git_path, local_path):
+        if self.is_chunked(git_path, os.path.getsize(local_path)):
+            # read chunk by chunk, big files never need to fit into memory
+            with open(local_path, 'rb') as f:
+                self.add_chunked_file(git_path, f)
+            return
+
         with open(local_path, 'rb') as f:
             self.add_file(git_path, f.read())
 
+    def is_chunked(self, git_path, size):
+        if git_path.startswith('aetros/weights/'):
+            return size >= self.chunk_weights_size
+
+        return size >= self.chunk_file_size
+
+    def add_chunked_file(self, git_path, f):
+        """
+        Adds the content of file object f as manifest blob at git_path and its content-defined chunks as blobs in
+        the directory git_path + '.chunks', see aetros.git_chunks. Unchanged chunks keep their sha, so only changed
+        parts of a file are stored and pushed again.
+        """
+        manifest, tree = write_chunked(self.git_path, f)
+
+        self.add_file(git_path, manifest)
+        self.add_index('40000', tree, chunks_path(git_path))
+
     def add_file_path_in_work_tree(self, path, work_tree, verbose=True):
         """
         Add a new file as blob in the storage and add its tree entry into the index.
         """
+        if self.staging == 'tree':
+            # git add works on the index, so it needs what has been staged in self.tree so far
+            self.command_exec(['read-tree', self.tree.write()])
+            self.staging = 'index'
+
+        if self.staging == 'stream':
+            self.stream_to_index()
+
         args = ['--work-tree', work_tree, 'add', '-f']
         if verbose:
             args.append('--verbose')
@@ -716,6 +1026,22 @@ class Git:
         with open(path, 'r') as f:
             self.add_file(path, f.read())
 
+    def commit_file_path(self, message, path, local_path):
+        """
+        Like commit_file(), with the content read from local_path.
+        """
+        if self.git_batch_commit:
+            self.add_file_path(path, local_path)
+            self.git_batch_commit_messages.append(message)
+        else:
+            with self.lock_write():
+                if self.job_id:
+                    self.read_tree(self.ref_head)
+
+                self.add_file_path(path, local_path)
+
+                return self.commit_index(message)
+
     def commit_file(self, message, path, content):
         """
         Add a new file as blob in the storage, add its tree entry into the index and commit the index.
@@ -737,78 +1063,115 @@ class Git:
 
                 return self.commit_index(message)
 
-    def diff_objects(self, latest_commit_sha):
+    @property
+    def synced_path(self):
+        return self.temp_path + '/synced/' + self.job_id
+
+    def get_synced_commits(self):
         """
-                Push all changes to origin, based on objects, not on commits.
-                Important: Call this push after every new commit, or we lose commits.
-                """
-        base = ['git', '--bare', '--git-dir', self.git_path]
+        The commits of the job ref whose history has been synced or is on its way to the server. Starts with the
+        ones persisted on disk by store_synced_commits(), so a restarted job or another process does not check the
+        whole history again.
+        """
+        if self.synced_job_id != self.job_id:
+            self.synced_job_id = self.job_id
+            self.confirmed_commits = set()
 
-        object_shas = []
-        summary = {'commits': [], 'trees': [], 'files': []}
+            if os.path.exists(self.synced_path):
+                with open(self.synced_path, 'r') as f:
+                    self.confirmed_commits = set(line.strip() for line in f if len(line.strip()) == 40)
 
-        def read_parents_and_tree_from(commit):
-            if commit in self.synced_object_shas or commit in object_shas:
-                # this commit has already been synced or read
-                return None, None
-
-            self.synced_object_shas[commit] = True
-            summary['commits'].append(commit)
-            object_shas.append(commit)
-
-            object_content = subprocess.check_output(base + ['cat-file', '-p', commit]).decode('utf-8').strip()
-            parents = []
-            tree = ''
-            for line in object_content.splitlines():
-                if line.startswith('tree '):
-                    tree = line[len('tree '):]
-                if line.startswith('parent '):
-                    parents.append(line[len('parent '):])
-
-            return parents, tree
-
-        def collect_files_from_tree(tree):
-            if tree in self.synced_object_shas or tree in object_shas:
-                # we have exactly this tree already synced or read, meaning all its objects as well
-                return
+            self.synced_commits = set(self.confirmed_commits)
+
+        return self.synced_commits
+
+    def store_synced_commits(self):
+        """
+        Persists the current synced commits. Call it only once the server has them, see store_written_commits().
+        """
+        commits = set(self.get_synced_commits())
+        if commits == self.confirmed_commits:
+            return
 
-            self.synced_object_shas[tree] = True
-            summary['trees'].append(tree)
-            object_shas.append(tree)
+        directory = os.path.dirname(self.synced_path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
 
-            object_content = subprocess.check_output(base + ['ls-tree', '-r', '-t', tree]).decode('utf-8').strip()
+        temp_path = '%s.%d' % (self.synced_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            f.write(''.join(sha + '\n' for sha in sorted(commits)))
 
-            for line in object_content.splitlines():
-                exploded = line.split(' ')
+        os.rename(temp_path, self.synced_path)
+        self.confirmed_commits = commits
 
-                if len(exploded) < 3:
-                    sys.stderr.write("Error: Wrong line format of ls-tree for %s: %s\n" % (tree, line,))
-                    sys.exit(1)
+    def store_written_commits(self):
+        """
+        Persists the synced commits once the packs of all previous pushes have been written to the server. With acks
+        on the files channel written means acknowledged, without the server can't tell and a written pack is trusted.
+        """
+        if self.synced_commits != self.confirmed_commits and all(m['_sent'] for m in self.pack_tails):
+            self.store_synced_commits()
 
-                object_to_add = str(exploded[2][:40])
-                path = str(exploded[2][41:])
+    def rev_list_objects(self, head, exclude):
+        """
+        Returns [(sha, path)] of all objects reachable from head but not from the commits in exclude, using
+        `git rev-list --objects`. Commits come first and have None as path, root trees have ''.
+        """
+        revisions = [head] + ['^' + sha for sha in exclude]
+
+        p = subprocess.Popen(['git', '--bare', '--git-dir', self.git_path, 'rev-list', '--objects', '--stdin'],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(('\n'.join(revisions) + '\n').encode('ascii'))
 
-                if object_to_add in self.synced_object_shas or object_to_add in object_shas:
-                    # have it already in the list or already synced
-                    continue
+        if p.returncode:
+            raise GitCommandException('git rev-list failed: ' + err.decode('utf-8', 'replace'))
 
-                object_shas.append(object_to_add)
-                self.synced_object_shas[object_to_add] = True
-                summary['files'].append([object_to_add, path])
+        objects = []
+        for line in out.decode('utf-8').split('\n'):
+            if not line:
+                continue
 
-        commits_to_check = [latest_commit_sha]
+            if len(line) == 40:
+                objects.append((line, None))
+            else:
+                objects.append((line[:40], line[41:]))
 
-        while len(commits_to_check):
-            sha = commits_to_check.pop(0)
-            parents, tree = read_parents_and_tree_from(sha)
+        return objects
 
-            if parents:
-                for parent in parents:
-                    if parent not in commits_to_check:
-                        commits_to_check.append(parent)
+    def diff_objects(self, latest_commit_sha):
+        """
+                Push all changes to origin, based on objects, not on commits.
+                Important: Call this push after every new commit, or we lose commits.
+                """
+        summary = {'commits': [], 'trees': [], 'files': []}
+        synced_commits = self.get_synced_commits()
 
-            if tree:
-                collect_files_from_tree(tree)
+        if latest_commit_sha in synced_commits:
+            return [], summary
+
+        try:
+            objects = self.rev_list_objects(latest_commit_sha, synced_commits)
+        except GitCommandException as e:
+            # a synced commit is gone locally, check the whole history again
+            self.logger.debug("Git: synced commits not usable, %s" % (str(e),))
+            objects = self.rev_list_objects(latest_commit_sha, [])
+
+        object_shas = [sha for sha, path in objects]
+
+        # rev-list tells no types of objects with a path, only trees and blobs are left after the commits
+        checks = self.cat_file.check_many([sha for sha, path in objects if path])
+        types = dict((check[0], check[1]) for check in checks if check)
+
+        for sha, path in objects:
+            if path is None:
+                summary['commits'].append(sha)
+            elif path == '' or types.get(sha) == 'tree':
+                summary['trees'].append(sha)
+            else:
+                summary['files'].append([sha, path])
 
         is_debug2() and self.logger.debug("shas_to_check %d: %s " % (len(object_shas), str(object_shas),))
 
@@ -818,8 +1181,7 @@ class Git:
         try:
             is_debug2() and self.logger.debug("Do git-cat-file-check.sh")
 
-            ssh_stream = create_ssh_stream(read_home_config(), exit_on_failure=False)
-            channel = ssh_stream.get_transport().open_session()
+            channel = open_ssh_session(read_home_config(), exit_on_failure=False)
             channel.exec_command('git-cat-file-check.sh "%s"' % (self.model_name + '.git',))
             channel.sendall('\n'.join(object_shas))
             channel.shutdown_write()
@@ -839,32 +1201,147 @@ class Git:
 
             missing_objects = readall(channel).decode('utf-8').splitlines()
             channel.close()
-            ssh_stream.close()
 
             # make sure we have in summary only SHAs we actually will sync
+            missing = set(missing_objects)
             for stype in six.iterkeys(summary):
-                ids = summary[stype][:]
-                for sha in ids:
-                    if stype == 'files':
-                        if sha[0] not in missing_objects:
-                            summary[stype].remove(sha)
-                    else:
-                        if sha not in missing_objects:
-                            summary[stype].remove(sha)
+                if stype == 'files':
+                    summary[stype] = [sha for sha in summary[stype] if sha[0] in missing]
+                else:
+                    summary[stype] = [sha for sha in summary[stype] if sha in missing]
+
+            # latest_commit_sha is now synced or the caller sends the missing objects
+            self.synced_commits = set([latest_commit_sha])
+
+            if not missing_objects:
+                # the server has everything already
+                self.store_synced_commits()
 
             return missing_objects, summary
         except (KeyboardInterrupt, SystemExit):
             raise
         except Exception as e:
             self.logger.error("Failed to generate diff_objects: %s" % (str(e),))
-            for sha in object_shas:
-                if sha in self.synced_object_shas:
-                    del self.synced_object_shas[sha]
             return None, None
 
     def get_head_commit(self):
+        self.flush_stream()
+
+        # reading the ref saves a fork of rev-parse, which is needed only for refs git can not tell without it
+        head = read_ref(self.git_path, self.ref_head)
+        if head:
+            return head
+
         return self.command_exec(['rev-parse', self.ref_head])[0].decode('utf-8').strip()
 
+    def pack_bases(self, summary):
+        """
+        Decides per push whether its pack is deltified, see `git_delta` in the home config. Returns the commits
+        to delta against, None for a pack of complete objects, and the size of all blobs. Servers that did not
+        confirm the thin capability at registration always get complete objects.
+        """
+        if self.delta_mode == 'never' or not summary['files'] or not self.client.thin.get('files'):
+            return None, 0
+
+        checks = self.cat_file.check_many([sha for sha, path in summary['files']])
+        blobs = [(path, check[2]) for (sha, path), check in zip(summary['files'], checks) if check]
+        blob_bytes = sum(size for path, size in blobs)
+
+        # only commits the server confirmed, the unpacking of a thin pack fails without its bases
+        bases = sorted(self.confirmed_commits)
+
+        if self.delta_mode != 'always' and not self.delta_heuristic.use_delta(blobs, bool(bases)):
+            return None, blob_bytes
+
+        is_debug2() and self.logger.debug("Git pack with deltas against %s" % (str(bases),))
+
+        return bases, blob_bytes
+
+    def send_pack(self, commit_sha, object_shas, summary):
+        """
+        Streams the pack of object_shas from `git pack-objects` to the server, with deltas when pack_bases() says
+        so. A pack bigger than pack_chunk_size is sent as several git-unpack-objects messages with increasing
+        `part`, the last one has `last: True`. At most pack_window bytes are queued meanwhile, so memory does not
+        grow with the pack size. Servers that did not confirm the `parts` capability get the whole pack in one
+        message.
+
+        Returns the number of bytes queued, None when pack-objects failed.
+        """
+        paths = dict((sha, path) for sha, path in summary['files'])
+        bases, blob_bytes = self.pack_bases(summary)
+
+        command, pack_input = pack_objects_command(self.git_path, object_shas, paths, bases)
+        pack_process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # pack-objects reads the whole list before it writes anything
+        pack_process.stdin.write(pack_input.encode('utf-8'))
+        pack_process.stdin.close()
+
+        message = {
+            'type': 'git-unpack-objects',
+            'ref': self.ref_head,
+            'commit': commit_sha,
+        }
+
+        if bases:
+            # deltas against objects the server has, unpacking needs them
+            message['thin'] = True
+
+        # shared by all parts, see MonitorThread.network_sync
+        upload = {'objects': summary, 'parts': 0, 'total': 0, 'complete': False}
+
+        # older servers would unpack each part as a pack of its own
+        chunk_size = self.pack_chunk_size if self.client.parts.get('files') else -1
+
+        chunk = pack_process.stdout.read(chunk_size)
+        part = 0
+
+        try:
+            while True:
+                next_chunk = pack_process.stdout.read(chunk_size) if chunk else b''
+
+                if not next_chunk:
+                    stderr = pack_process.stderr.read()
+                    if pack_process.wait():
+                        self.logger.error("Git pack-objects failed: %s" % (stderr.decode('utf-8', 'replace'),))
+
+                        if part:
+                            # the server drops the parts it got so far
+                            self.client.send(dict(message, pack=b'', part=part, last=True, failed=True,
+                                                  objects=None), 'files')
+                        return None
+
+                if part == 0 and not next_chunk:
+                    # fits into one message
+                    upload['total'] = self.client.send(dict(message, pack=chunk, objects=summary), 'files') or 0
+                    break
+
+                self.client.wait_for_queue_space('files', self.pack_window)
+
+                upload['parts'] = part + 1
+                upload['complete'] = not next_chunk
+                upload['total'] += self.client.send(dict(message, pack=chunk, part=part, last=not next_chunk,
+                                                         objects=summary if part == 0 else None, upload=upload),
+                                                    'files') or 0
+
+                is_debug2() and self.logger.debug("Git pack part %d sent, %d bytes queued so far"
+                                                  % (part, upload['total']))
+
+                if not next_chunk:
+                    break
+
+                chunk = next_chunk
+                part += 1
+        finally:
+            if pack_process.poll() is None:
+                pack_process.kill()
+                pack_process.wait()
+
+        if bases is not None and self.delta_mode == 'auto':
+            self.delta_heuristic.record(upload['total'], blob_bytes)
+
+        return upload['total']
+
     def push(self):
         self.push_lock.acquire()
         missing_object_sha = []
@@ -872,7 +1349,6 @@ class Git:
         try:
             commit_sha = self.get_head_commit()
             missing_object_sha, summary = self.diff_objects(commit_sha)
-            base = ['git', '--bare', '--git-dir', self.git_path]
 
             if not missing_object_sha:
                 return False
@@ -883,33 +1359,19 @@ class Git:
             if missing_object_sha:
                 is_debug2() and self.logger.debug("Git push")
                 try:
-                    opts = [
-                        '--no-reuse-delta',
-                        '--compression=0',
-                    ]
-                    pack_process = subprocess.Popen(base + ['pack-objects', '--stdout'] + opts, stderr=subprocess.PIPE,
-                                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-                    pack_content, stderr = pack_process.communicate(('\n'.join(missing_object_sha)).encode())
-
-                    if pack_process.returncode:
-                        self.logger.error("Git pack-objects failed: %s, error: %s" % (pack_content, stderr))
-                        self.synced_object_shas = {}
+                    size = self.send_pack(commit_sha, missing_object_sha, summary)
+
+                    if size is None:
+                        self.synced_commits = set(self.confirmed_commits)
                         return False
 
-                    message = {
-                        'type': 'git-unpack-objects',
-                        'ref': self.ref_head,
-                        'commit': commit_sha,
-                        'pack': pack_content,
-                        'objects': summary,
-                    }
-                    size = self.client.send(message, 'files')
+                    self.pack_tails = self.client.queue_tails('files')
                     is_debug2() and self.logger.debug("Git pack of size %d is on the way" % (size,))
                 except (KeyboardInterrupt, SystemExit):
                     raise
                 except Exception:
-                    # next push we check again all objects in that job history
-                    self.synced_object_shas = {}
+                    # next push we check again all objects since the last confirmed sync
+                    self.synced_commits = set(self.confirmed_commits)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
@@ -921,21 +1383,61 @@ class Git:
 
         return missing_object_sha
 
+    def notify_head_change(self):
+        """
+        Wakes up the push after the job ref moved.
+        """
+        if self.push_debounced:
+            self.push_debounced.trigger()
+        else:
+            self.head_changed.set()
+
+    def sync_head(self):
+        """
+        Pushes when the head moved since the last successful push. Returns True when it needs to be called again
+        without a head change, because the push failed or a server with acks did not acknowledge all packs yet.
+        """
+        head = self.get_head_commit()
+        if self.last_synced_head != head:
+            self.logger.debug("Git head moved from %s to %s" % (self.last_synced_head, head))
+            if self.push() is not False or head in self.synced_commits:
+                self.last_synced_head = head
+
+        with self.push_lock:
+            self.store_written_commits()
+
+            # only servers with acks on the files channel confirm packs later on, without a written pack is synced
+            unconfirmed = self.synced_commits != self.confirmed_commits and self.client.acks.get('files')
+
+            return self.last_synced_head != head or bool(unconfirmed)
+
+    def sync_head_debounced(self):
+        pending = True
+
+        try:
+            pending = self.sync_head()
+        finally:
+            if pending and self.active_thread:
+                self.push_debounced.trigger(self.push_recheck_interval)
+
     def thread_push(self):
-        last_synced_head = self.get_head_commit()
+        pending = True
 
         while self.active_thread:
             try:
-                head = self.get_head_commit()
-                if last_synced_head != head:
-                    self.logger.debug("Git head moved from %s to %s" % (last_synced_head, head))
-                    if self.push() is not False:
-                        last_synced_head = head
-
-                time.sleep(0.5)
+                # an idle job waits here until the head moves, without any wake up when the ref is watched
+                timeout = self.push_recheck_interval if pending or not self.ref_watch else None
+                if self.head_changed.wait(timeout) and self.active_thread:
+                    # one push for a burst of commits
+                    time.sleep(self.push_debounce)
+
+                self.head_changed.clear()
+                if self.active_thread:
+                    pending = self.sync_head()
             except (SystemExit, KeyboardInterrupt):
                 return
             except Exception as e:
+                pending = True
                 time.sleep(5)
 
     def commit_index(self, message):
@@ -944,21 +1446,45 @@ class Git:
         :param message: str
         :return: str the generated commit sha
         """
+        if self.staging == 'stream':
+            author, committer = self.signatures()
+            changes = self.stream_changes
+            self.stream_changes = []
+
+            commit = self.fast_import.commit(self.ref_head, changes, message, author, committer)
+            self.notify_head_change()
+
+            return commit
+
+        # the parent is read from disk
+        self.flush_stream()
         tree_id = self.write_tree()
 
+        if self.native_writer:
+            commit = self.write_commit(tree_id, [read_ref(self.git_path, self.ref_head)], message)
+            update_ref(self.git_path, self.ref_head, commit)
+
+            if self.staging == 'tree':
+                # saves read_tree() from loading the tree again
+                self.tree.commit = commit
+
+            self.notify_head_change()
+
+            return commit
+
         args = ['commit-tree', tree_id, '-p', self.ref_head]
 
         # todo, this can end in a race-condition with other processes adding commits
         commit = self.command_exec(args, message)[0].decode('utf-8').strip()
         self.command_exec(['update-ref', self.ref_head, commit])
+        self.notify_head_change()
 
         return commit
 
     def has_file(self, path):
         try:
-            out, code, err = self.command_exec(['cat-file', '-p', self.ref_head+':'+path])
-
-            return code == 0
+            self.flush_stream()
+            return self.cat_file.check(self.ref_head+':'+path) is not None
         except Exception:
             return False
 
@@ -967,13 +1493,22 @@ class Git:
         Reads the given path of current ref_head and returns its content as utf-8
         """
         try:
-            out, code, err = self.command_exec(['cat-file', '-p', self.ref_head+':'+path])
-            if not code:
-                return out.decode('utf-8')
+            self.flush_stream()
+            object_type, content = self.cat_file.read(self.ref_head+':'+path)
+            if object_type == 'blob':
+                return content.decode('utf-8')
         except Exception:
             pass
 
         return None
 
     def git_read(self, path):
-        return self.command_exec(['cat-file', '-p', self.ref_head+':'+path])
+        """
+        Reads the given path of current ref_head. Returns (content, code, error) like command_exec.
+        """
+        self.flush_stream()
+        object_type, content = self.cat_file.read(self.ref_head+':'+path)
+        if object_type is None:
+            return b'', 128, 'fatal: path %s does not exist in %s' % (path, self.ref_head)
+
+        return content, 0, ''
@@ -0,0 +1,229 @@
+from __future__ import absolute_import
+
+import binascii
+import subprocess
+from threading import Lock
+
+
+def parse_commit(content):
+    """
+    Returns (tree, parents) of a raw commit object.
+    """
+    tree = None
+    parents = []
+
+    for line in content.split(b'\n'):
+        if not line:
+            # end of headers
+            break
+
+        if line.startswith(b'tree '):
+            tree = line[5:].decode('ascii')
+        elif line.startswith(b'parent '):
+            parents.append(line[7:].decode('ascii'))
+
+    return tree, parents
+
+
+def parse_tree(content):
+    """
+    Returns [(mode, name, sha)] of a raw tree object, `<mode> <name>\\0<20 byte sha>` per entry.
+    """
+    entries = []
+    pos = 0
+
+    while pos < len(content):
+        space = content.index(b' ', pos)
+        null = content.index(b'\0', space)
+        mode = content[pos:space].decode('ascii')
+        name = content[space + 1:null].decode('utf-8', 'surrogateescape')
+        sha = binascii.hexlify(content[null + 1:null + 21]).decode('ascii')
+        entries.append((mode, name, sha))
+        pos = null + 21
+
+    return entries
+
+
+class CatFile(object):
+    """
+    Long-living `git cat-file --batch` and `--batch-check` processes, so reading objects costs no fork.
+
+    Requests are serialized by a lock, read_many() writes a window of requests before reading their responses.
+    Both processes are started on first use and again after they died.
+
+        cat_file = CatFile(git_path)
+        object_type, content = cat_file.read('refs/aetros/job/abc:aetros/job.json')
+    """
+
+    # requests written ahead, small enough that they fit into the stdin pipe buffer
+    window = 64
+
+    def __init__(self, git_dir=None, env=None):
+        self.git_dir = git_dir
+        self.env = env
+        self.lock = Lock()
+        self.processes = {}
+
+    def start(self, mode):
+        command = ['git']
+        if self.git_dir:
+            command += ['--bare', '--git-dir', self.git_dir]
+
+        process = self.processes.get(mode)
+        if process and process.poll() is None:
+            return process
+
+        process = subprocess.Popen(command + ['cat-file', mode], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   env=self.env)
+        self.processes[mode] = process
+
+        return process
+
+    def request(self, mode, names):
+        """
+        Sends names to the process of mode, yields per name (sha, type, size, process) or None when missing.
+        """
+        process = self.start(mode)
+
+        for offset in range(0, len(names), self.window):
+            window = names[offset:offset + self.window]
+            process.stdin.write(b''.join(name.encode('utf-8') + b'\n' for name in window))
+            process.stdin.flush()
+
+            for name in window:
+                header = process.stdout.readline()
+                if not header:
+                    raise IOError('git cat-file %s ended unexpectedly' % (mode, ))
+
+                parts = header.rstrip(b'\n').split(b' ')
+                if len(parts) != 3:
+                    # `<name> missing` or `<name> ambiguous`
+                    yield None
+                    continue
+
+                yield parts[0].decode('ascii'), parts[1].decode('ascii'), int(parts[2]), process
+
+    def read_many(self, names):
+        """
+        Returns [(type, content)] in order of names, (None, None) for missing objects.
+        """
+        results = []
+
+        with self.lock:
+            try:
+                for found in self.request('--batch', names):
+                    if found is None:
+                        results.append((None, None))
+                        continue
+
+                    sha, object_type, size, process = found
+                    content = process.stdout.read(size)
+                    # trailing newline after content
+                    process.stdout.read(1)
+                    results.append((object_type, content))
+            except (IOError, OSError, ValueError):
+                # process died, the next request starts a new one
+                self.kill('--batch')
+                raise
+
+        return results
+
+    def read(self, name):
+        """
+        Returns (type, content) of an object name like a sha or `ref:path`, (None, None) if not found.
+        """
+        return self.read_many([name])[0]
+
+    def read_head(self, name, size):
+        """
+        Returns (type, the first size bytes of the content) of an object name, (None, None) if not found. The rest of
+        the content is skipped without keeping it in memory.
+        """
+        with self.lock:
+            try:
+                for found in self.request('--batch', [name]):
+                    if found is None:
+                        return None, None
+
+                    sha, object_type, object_size, process = found
+                    head = process.stdout.read(min(size, object_size))
+
+                    # including the trailing newline after content
+                    remaining = object_size - len(head) + 1
+                    while remaining:
+                        skipped = process.stdout.read(min(remaining, 64 * 1024))
+                        if not skipped:
+                            raise IOError('git cat-file --batch ended unexpectedly')
+                        remaining -= len(skipped)
+
+                    return object_type, head
+            except (IOError, OSError, ValueError):
+                self.kill('--batch')
+                raise
+
+    def check_many(self, names):
+        """
+        Returns [(sha, type, size)] in order of names, None for missing objects.
+        """
+        with self.lock:
+            try:
+                return [found[:3] if found else None for found in self.request('--batch-check', names)]
+            except (IOError, OSError, ValueError):
+                self.kill('--batch-check')
+                raise
+
+    def check(self, name):
+        """
+        Returns (sha, type, size) of an object name, None if not found.
+        """
+        return self.check_many([name])[0]
+
+    def walk_tree(self, tree, trees=True, skip=None):
+        """
+        Yields (mode, sha, path) of all entries below tree, recursively, like `git ls-tree -r [-t]`.
+        Subtrees for which skip(sha) returns True are not descended. Submodule commits are left out.
+        """
+        pending = [(tree, '')]
+
+        while pending:
+            shas = [sha for sha, prefix in pending]
+            prefixes = [prefix for sha, prefix in pending]
+            pending = []
+
+            for (object_type, content), prefix, sha in zip(self.read_many(shas), prefixes, shas):
+                if object_type != 'tree':
+                    raise IOError('Tree %s not found' % (sha, ))
+
+                for mode, name, entry_sha in parse_tree(content):
+                    path = prefix + name
+
+                    if mode == '40000':
+                        if skip and skip(entry_sha):
+                            continue
+
+                        if trees:
+                            yield mode, entry_sha, path
+
+                        pending.append((entry_sha, path + '/'))
+                    elif mode != '160000':
+                        yield mode, entry_sha, path
+
+    def kill(self, mode):
+        process = self.processes.pop(mode, None)
+        if process:
+            try:
+                process.kill()
+                process.wait()
+            except OSError:
+                pass
+
+    def close(self):
+        with self.lock:
+            for mode, process in list(self.processes.items()):
+                try:
+                    process.stdin.close()
+                    process.wait()
+                except (IOError, OSError):
+                    pass
+
+            self.processes = {}
@@ -0,0 +1,194 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+
+import numpy as np
+import simplejson
+
+from aetros.git_writer import write_object, serialize_tree
+
+# first line of a manifest blob, the JSON with size and chunks follows
+MAGIC = b'AETROS-CHUNKED 1\n'
+
+# the chunk blobs of path are stored in the directory path + CHUNKS_SUFFIX, so they are part of the tree
+CHUNKS_SUFFIX = '.chunks'
+
+# bigger blobs are never read to check whether they are a manifest
+MANIFEST_MAX_SIZE = 16 * 1024 * 1024
+
+HASH_SALT = np.uint64(0x9e3779b97f4a7c15)
+HASH_MULTIPLIER = np.uint64(0xff51afd7ed558ccd)
+
+
+def cut_candidates(data, start, end, bits):
+    """
+    Returns the sorted positions p in [start, end) at which data may be cut: where the hash of the 8 bytes before
+    p has its top `bits` bits zero. Needs start >= 8.
+    """
+    shift = np.uint64(64 - bits)
+    found = []
+
+    # the 8 bytes windows of every 8th position are one little-endian uint64 array, no copy of data needed
+    for k in range(8):
+        count = (end - start - k + 7) // 8
+        if count <= 0:
+            continue
+
+        windows = np.frombuffer(data, dtype='<u8', count=count, offset=start - 8 + k)
+        hashed = (windows ^ HASH_SALT) * HASH_MULTIPLIER
+        found.append(np.flatnonzero((hashed >> shift) == 0) * 8 + start + k)
+
+    return np.sort(np.concatenate(found))
+
+
+def content_chunks(f, min_size=256 * 1024, bits=20, max_size=4 * 1024 * 1024, read_size=8 * 1024 * 1024):
+    """
+    Splits the content of file object f into content-defined chunks and yields them as bytes. Chunks are between
+    min_size and max_size bytes, on average min_size + 2 ** bits. Since cuts depend only on the bytes around
+    them, a change in one part of a file changes only the chunks around it, also when it shifts the rest.
+    """
+    buffer = b''
+    offset = 0
+    eof = False
+    step = 256 * 1024
+
+    while True:
+        if not eof and len(buffer) - offset < max_size:
+            buffer = buffer[offset:]
+            offset = 0
+
+            while not eof and len(buffer) < max_size:
+                block = f.read(read_size)
+                if not block:
+                    eof = True
+                buffer += block
+
+        if offset == len(buffer):
+            return
+
+        cut = min(len(buffer), offset + max_size)
+        position = offset + min_size
+
+        while position < cut:
+            end = min(position + step, cut)
+            candidates = cut_candidates(buffer, position, end, bits)
+
+            if len(candidates):
+                cut = int(candidates[0])
+                break
+
+            position = end
+
+        yield buffer[offset:cut]
+        offset = cut
+
+
+def serialize_manifest(size, chunks):
+    """
+    :param chunks: list of (sha, size) of the chunk blobs in order
+    """
+    content = {'size': size, 'chunks': [[sha, chunk_size] for sha, chunk_size in chunks]}
+
+    return MAGIC + simplejson.dumps(content).encode('utf-8')
+
+
+def parse_manifest(content):
+    """
+    Returns {'size', 'chunks'} when content is a manifest, None otherwise.
+    """
+    if not content.startswith(MAGIC):
+        return None
+
+    try:
+        return simplejson.loads(content[len(MAGIC):].decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def chunks_path(path):
+    return path + CHUNKS_SUFFIX
+
+
+def write_chunked(git_dir, f):
+    """
+    Writes the content of file object f as chunk blobs, a tree of them and a manifest blob, as loose objects.
+    Chunks already in the repository are not written again. Returns (manifest content, chunks tree sha).
+    """
+    chunks = []
+    entries = {}
+    size = 0
+
+    for chunk in content_chunks(f):
+        sha = write_object(git_dir, 'blob', chunk)
+        entries['%06d' % (len(chunks), )] = ('100644', sha)
+        chunks.append((sha, len(chunk)))
+        size += len(chunk)
+
+    tree = write_object(git_dir, 'tree', serialize_tree(entries))
+
+    return serialize_manifest(size, chunks), tree
+
+
+def read_manifest(cat_file, name):
+    """
+    Returns the manifest of object name (like `ref:path`), None if it's no manifest.
+    """
+    found = cat_file.check(name)
+    if not found or found[1] != 'blob' or found[2] > MANIFEST_MAX_SIZE:
+        return None
+
+    # most blobs are no manifest, of those only the first bytes are kept
+    object_type, head = cat_file.read_head(found[0], len(MAGIC))
+    if head != MAGIC:
+        return None
+
+    object_type, content = cat_file.read(found[0])
+
+    return parse_manifest(content)
+
+
+def write_chunks(cat_file, manifest, out):
+    """
+    Writes the file described by manifest into the binary file object out, one chunk at a time.
+    """
+    for sha, size in manifest['chunks']:
+        object_type, content = cat_file.read(sha)
+        if object_type != 'blob' or len(content) != size:
+            raise IOError('Chunk %s not found' % (sha, ))
+
+        out.write(content)
+
+
+def checkout_chunked(cat_file, ref, target):
+    """
+    Replaces manifests checked out from ref into target by the files they describe, and removes the checked out
+    chunk directories.
+    """
+    found = cat_file.check(ref + '^{tree}')
+    if not found:
+        return
+
+    for mode, sha, path in cat_file.walk_tree(found[0]):
+        if mode != '40000' or not path.endswith(CHUNKS_SUFFIX):
+            continue
+
+        chunk_dir = os.path.join(target, path)
+        if os.path.isdir(chunk_dir):
+            shutil.rmtree(chunk_dir)
+
+        local_path = os.path.join(target, path[:-len(CHUNKS_SUFFIX)])
+        if not os.path.isfile(local_path) or os.path.getsize(local_path) > MANIFEST_MAX_SIZE:
+            continue
+
+        with open(local_path, 'rb') as f:
+            manifest = parse_manifest(f.read())
+
+        if manifest is None:
+            continue
+
+        temp_path = local_path + '.aetros-tmp'
+        with open(temp_path, 'wb') as f:
+            write_chunks(cat_file, manifest, f)
+
+        os.rename(temp_path, local_path)
@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+import subprocess
+from threading import Lock
+
+import six
+
+from aetros.git_writer import read_ref
+
+
+class FastImport(object):
+    """
+    A long-running `git fast-import` process the commits of a job are streamed into, used with
+    `git_writer: fast-import`. Git computes all objects, no process is forked per commit.
+
+    Commits become visible to other git commands (push, cat-file, other processes) only after checkpoint(),
+    which writes the pending objects as pack and updates the refs. Assumes it is the only writer of its refs
+    while commits are pending.
+
+        fast_import = FastImport(git_dir)
+        sha = fast_import.commit(ref, [('100644', b'{}', 'aetros/job/info.json')], 'INFO', author, committer)
+        fast_import.checkpoint()
+    """
+
+    def __init__(self, git_dir, env=None):
+        self.git_dir = git_dir
+        self.env = env
+        self.lock = Lock()
+        self.process = None
+        self.mark = 0
+
+        # ref -> sha of its last commit in the stream
+        self.heads = {}
+        # ref -> sha the ref had on disk after the last checkpoint
+        self.checkpointed = {}
+        # refs with commits not yet visible on disk
+        self.pending = set()
+
+    def start(self):
+        if self.process and self.process.poll() is None:
+            return
+
+        self.process = subprocess.Popen(
+            # without --done, so the end of input (also when this process dies) finishes pending commits
+            ['git', '--bare', '--git-dir', self.git_dir, 'fast-import', '--quiet'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=self.env
+        )
+        self.heads = {}
+        self.checkpointed = {}
+        self.pending = set()
+
+    def data(self, content):
+        if not isinstance(content, six.binary_type):
+            content = content.encode('utf-8')
+
+        return ('data %d\n' % (len(content), )).encode('ascii') + content + b'\n'
+
+    def commit(self, ref, changes, message, author, committer):
+        """
+        Streams a commit on top of ref. Returns its sha.
+
+        :param changes: list of (mode, content, path), content is the blob as bytes or str. Instead of content a
+                        sha of an existing blob or tree can be given as (mode, sha, path, True).
+        """
+        with self.lock:
+            self.start()
+            self.mark += 1
+
+            commands = [
+                ('commit %s\n' % (ref, )).encode('utf-8'),
+                ('mark :%d\n' % (self.mark, )).encode('ascii'),
+                ('author %s\n' % (author, )).encode('utf-8'),
+                ('committer %s\n' % (committer, )).encode('utf-8'),
+                self.data(message),
+            ]
+
+            if ref not in self.pending:
+                current = read_ref(self.git_dir, ref)
+                if current and (ref not in self.heads or current != self.checkpointed.get(ref)):
+                    # first commit of ref in this stream, or another process committed meanwhile
+                    commands.append(('from %s\n' % (current, )).encode('ascii'))
+
+            for change in changes:
+                mode, content, path = change[:3]
+
+                if len(change) > 3:
+                    # a directory is 40000 in trees, fast-import wants 040000
+                    mode = '040000' if mode == '40000' else mode
+                    commands.append(('M %s %s %s\n' % (mode, content, path)).encode('utf-8'))
+                else:
+                    commands.append(('M %s inline %s\n' % (mode, path)).encode('utf-8'))
+                    commands.append(self.data(content))
+
+            commands.append(b'\n')
+            commands.append(('get-mark :%d\n' % (self.mark, )).encode('ascii'))
+
+            self.process.stdin.write(b''.join(commands))
+            self.process.stdin.flush()
+
+            sha = self.process.stdout.readline().strip().decode('ascii')
+            if len(sha) != 40:
+                self.process = None
+                raise IOError('git fast-import failed to commit on %s' % (ref, ))
+
+            self.heads[ref] = sha
+            self.pending.add(ref)
+
+            return sha
+
+    def checkpoint(self):
+        """
+        Makes all streamed commits visible on disk. Does nothing when no commit is pending.
+        """
+        with self.lock:
+            if not self.pending or not self.process:
+                return
+
+            self.process.stdin.write(b'checkpoint\nprogress checkpoint\n')
+            self.process.stdin.flush()
+
+            # progress is written once the checkpoint is done
+            if not self.process.stdout.readline():
+                self.process = None
+                raise IOError('git fast-import ended unexpectedly')
+
+            for ref in self.pending:
+                self.checkpointed[ref] = self.heads[ref]
+
+            self.pending = set()
+
+    def close(self):
+        self.checkpoint()
+
+        with self.lock:
+            if self.process:
+                try:
+                    self.process.stdin.close()
+                    self.process.wait()
+                except (IOError, OSError):
+                    pass
+
+                self.process = None
@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from threading import Thread
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# wd, mask, cookie, len of the name that follows
+EVENT_HEADER = struct.Struct('iIII')
+
+libc = None
+
+
+def load_libc():
+    """
+    Returns libc with inotify functions, None when not available (no Linux).
+    """
+    global libc
+
+    if libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1
+            libc.inotify_add_watch
+        except (OSError, AttributeError):
+            libc = False
+
+    return libc or None
+
+
+class RefWatch(object):
+    """
+    Calls callback when a git ref is written on disk, by this or any other process sharing the repository,
+    through inotify on the directory of the ref and on packed-refs. Git and update_ref() write refs through a
+    lock file renamed at the end, so one callback per update.
+
+    Linux only, start() returns False elsewhere. Without io_loop a daemon thread waits for events, with io_loop
+    its loop does.
+
+        watch = RefWatch(git_dir, 'refs/aetros/job/' + job_id, callback)
+        if not watch.start():
+            # poll instead
+        watch.close()
+    """
+
+    def __init__(self, git_dir, ref, callback):
+        self.git_dir = git_dir
+        self.ref = ref
+        self.callback = callback
+
+        self.fd = None
+        self.io_loop = None
+        self.thread = None
+        self.wake_read = None
+        self.wake_write = None
+        self.names = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, directory, name):
+        wd = libc.inotify_add_watch(self.fd, directory.encode('utf-8'), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + directory)
+
+        self.names[wd] = name.encode('utf-8')
+
+    def start(self, io_loop=None):
+        if not load_libc():
+            return False
+
+        ref_dir, name = os.path.split(os.path.join(self.git_dir, self.ref))
+
+        try:
+            if not os.path.exists(ref_dir):
+                os.makedirs(ref_dir)
+        except OSError:
+            return False
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self.fd = None
+            return False
+
+        try:
+            self.add_watch(ref_dir, name)
+            self.add_watch(self.git_dir, 'packed-refs')
+        except OSError:
+            self.close()
+            return False
+
+        if io_loop:
+            self.io_loop = io_loop
+            io_loop.add_reader(self, self.read_events)
+        else:
+            self.wake_read, self.wake_write = os.pipe()
+            self.thread = Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+        return True
+
+    def read_events(self):
+        """
+        Reads all pending events and calls callback once when one of them is about the ref.
+        """
+        changed = False
+
+        while self.fd is not None:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW or self.names.get(wd) == name:
+                    changed = True
+
+        if changed:
+            self.callback()
+
+    def run(self):
+        while self.fd is not None:
+            try:
+                readable = select.select([self.fd, self.wake_read], [], [])[0]
+            except (select.error, OSError, ValueError):
+                # EINTR or closed meanwhile
+                continue
+
+            if self.wake_read in readable:
+                break
+
+            try:
+                self.read_events()
+            except OSError:
+                break
+
+    def close(self):
+        if self.io_loop and self.fd is not None:
+            self.io_loop.remove_reader(self)
+
+        if self.wake_write is not None:
+            os.write(self.wake_write, b'x')
+
+            if self.thread:
+                self.thread.join()
+
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+            self.wake_read = self.wake_write = None
+
+        if self.fd is not None:
+            fd = self.fd
+            self.fd = None
+            os.close(fd)
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+
+import os
+from threading import Lock, Timer
+
+from aetros.git_writer import object_id
+from aetros.io_loop import running_io_loop
+
+
+class StoreFiles(object):
+    """
+    The latest content of the files of Git.store_file(), kept in memory with its blob sha, so an unchanged
+    content is detected by the sha instead of comparing the bytes. Changed files are written to directory in
+    batches, at most every interval seconds and at close(), instead of rewriting them on every change.
+
+        store_files = StoreFiles(temp_path + '/store-blob/' + job_id)
+        if store_files.set('aetros/job/info/elapsed.json', b'12'):
+            # changed, send it
+        store_files.close()
+    """
+
+    def __init__(self, directory, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.last_timer = None
+        self.closed = False
+
+        # path -> (sha, content)
+        self.files = {}
+        self.dirty = set()
+        self.created_dirs = set()
+
+    def full_path(self, path):
+        return os.path.normpath(self.directory + '/' + path)
+
+    def set(self, path, content):
+        """
+        Sets the content (bytes) of path. Returns False when it is the same as before.
+        """
+        sha = object_id('blob', content)
+
+        with self.lock:
+            if path in self.files and self.files[path][0] == sha:
+                return False
+
+            self.files[path] = (sha, content)
+            self.dirty.add(path)
+
+            if not self.last_timer and not self.closed:
+                io_loop = running_io_loop()
+                if io_loop:
+                    self.last_timer = io_loop.call_later(self.interval, self.write, blocking=True)
+                else:
+                    self.last_timer = Timer(self.interval, self.write)
+                    self.last_timer.daemon = True
+                    self.last_timer.start()
+
+        return True
+
+    def items(self):
+        """
+        Returns [(path, content)] of all files.
+        """
+        with self.lock:
+            return [(path, content) for path, (sha, content) in self.files.items()]
+
+    def write(self):
+        """
+        Writes all files changed since the last write to the disk.
+        """
+        with self.write_lock:
+            with self.lock:
+                self.last_timer = None
+                files = [(path, self.files[path][1]) for path in self.dirty]
+                self.dirty = set()
+
+            for path, content in files:
+                full_path = self.full_path(path)
+                dir_name = os.path.dirname(full_path)
+
+                if dir_name not in self.created_dirs:
+                    if not os.path.exists(dir_name):
+                        os.makedirs(dir_name)
+                    self.created_dirs.add(dir_name)
+
+                with open(full_path, 'wb') as f:
+                    f.write(content)
+
+    def close(self):
+        """
+        Stops the timer and writes the pending changes.
+        """
+        with self.lock:
+            self.closed = True
+            if self.last_timer:
+                self.last_timer.cancel()
+
+        self.write()
+
+    def remove(self, path):
+        """
+        Forgets path and removes its file.
+        """
+        with self.write_lock:
+            with self.lock:
+                self.files.pop(path, None)
+                self.dirty.discard(path)
+
+            full_path = self.full_path(path)
+            if os.path.exists(full_path):
+                os.unlink(full_path)
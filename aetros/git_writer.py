@@ -0,0 +1,266 @@
+from __future__ import absolute_import
+
+import binascii
+import calendar
+import errno
+import hashlib
+import os
+import time
+import zlib
+
+from aetros.git_batch import parse_commit, parse_tree
+
+
+def object_id(object_type, content):
+    header = ('%s %d\0' % (object_type, len(content))).encode('ascii')
+
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def write_object(git_dir, object_type, content):
+    """
+    Writes content as zlib compressed loose object, like `git hash-object -w`. Returns the sha.
+    """
+    header = ('%s %d\0' % (object_type, len(content))).encode('ascii')
+    sha = hashlib.sha1(header + content).hexdigest()
+    path = os.path.join(git_dir, 'objects', sha[:2], sha[2:])
+
+    if os.path.exists(path):
+        return sha
+
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another process meanwhile
+            pass
+
+    # level 1 is git's default core.loosecompression
+    compressor = zlib.compressobj(1)
+    temp_path = '%s/tmp_obj_%d_%s' % (directory, os.getpid(), sha[2:])
+
+    with open(temp_path, 'wb') as f:
+        f.write(compressor.compress(header))
+        f.write(compressor.compress(content))
+        f.write(compressor.flush())
+
+    # loose objects are read-only, as git creates them
+    os.chmod(temp_path, 0o444)
+    os.rename(temp_path, path)
+
+    return sha
+
+
+def tree_entry_key(entry):
+    name, mode = entry
+    name = name.encode('utf-8', 'surrogateescape') if hasattr(name, 'encode') else name
+
+    # git sorts directories as if their name ends with a slash
+    return name + b'/' if mode == '40000' else name
+
+
+def serialize_tree(entries):
+    """
+    :param entries: dict name -> (mode, sha)
+    """
+    content = []
+
+    for name, mode in sorted(((name, entry[0]) for name, entry in entries.items()), key=tree_entry_key):
+        sha = entries[name][1]
+        encoded = name.encode('utf-8', 'surrogateescape') if hasattr(name, 'encode') else name
+        content.append(mode.encode('ascii') + b' ' + encoded + b'\0' + binascii.unhexlify(sha))
+
+    return b''.join(content)
+
+
+def timezone_offset(timestamp):
+    offset = calendar.timegm(time.localtime(timestamp)) - int(timestamp)
+    sign = '+' if offset >= 0 else '-'
+    minutes = abs(offset) // 60
+
+    return '%s%02d%02d' % (sign, minutes // 60, minutes % 60)
+
+
+def signature(name, email, timestamp=None):
+    if timestamp is None:
+        timestamp = int(time.time())
+
+    return '%s <%s> %d %s' % (name, email, timestamp, timezone_offset(timestamp))
+
+
+def serialize_commit(tree, parents, author, committer, message):
+    """
+    The message is taken verbatim, like `git commit-tree` does when it's given on stdin.
+    """
+    lines = ['tree ' + tree]
+    lines += ['parent ' + parent for parent in parents]
+    lines += ['author ' + author, 'committer ' + committer]
+
+    if not isinstance(message, bytes):
+        message = message.encode('utf-8')
+
+    return ('\n'.join(lines) + '\n\n').encode('utf-8') + message
+
+
+def read_ref(git_dir, ref):
+    """
+    Returns the sha ref points to, None if it doesn't exist. Symbolic refs are not supported.
+    """
+    try:
+        with open(os.path.join(git_dir, ref), 'rb') as f:
+            sha = f.read().strip().decode('ascii')
+            if sha:
+                return sha
+    except (IOError, OSError):
+        pass
+
+    try:
+        with open(os.path.join(git_dir, 'packed-refs'), 'rb') as f:
+            for line in f:
+                line = line.strip().decode('utf-8')
+                if line.endswith(' ' + ref):
+                    return line.split(' ')[0]
+    except (IOError, OSError):
+        pass
+
+    return None
+
+
+def update_ref(git_dir, ref, sha, timeout=10):
+    """
+    Points ref to sha, atomically through a lock file like `git update-ref`. Waits up to timeout seconds when
+    another process holds the lock.
+    """
+    path = os.path.join(git_dir, ref)
+    lock_path = path + '.lock'
+
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+
+    start = time.time()
+
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST or time.time() - start > timeout:
+                raise
+
+            time.sleep(0.01)
+
+    try:
+        os.write(fd, (sha + '\n').encode('ascii'))
+    finally:
+        os.close(fd)
+
+    os.rename(lock_path, path)
+
+
+class TreeNode(object):
+    """
+    A directory of TreeBuilder. entries maps name -> (mode, sha) or TreeNode, and is read on first access.
+    sha is None while the directory has unwritten changes.
+    """
+
+    def __init__(self, sha=None):
+        self.sha = sha
+        self.entries = None if sha else {}
+
+
+class TreeBuilder(object):
+    """
+    Keeps the tree of a job in memory and writes blobs, trees and commits as loose objects, byte-identical to
+    what `hash-object`, `update-index`, `write-tree` and `commit-tree` would write, without forking git.
+
+    Only directories on the path of a change are read (through CatFile) and written again.
+
+        builder = TreeBuilder(git_dir, cat_file)
+        builder.load(commit)
+        builder.set('aetros/job/info.json', '100644', write_object(git_dir, 'blob', data))
+        tree = builder.write()
+    """
+
+    def __init__(self, git_dir, cat_file):
+        self.git_dir = git_dir
+        self.cat_file = cat_file
+        self.root = TreeNode()
+
+        # the commit the current tree belongs to, None when it has changes or was not loaded from a commit
+        self.commit = None
+
+    def load(self, commit):
+        """
+        Replaces the tree by the one of commit. Nothing happens when it's already the current one.
+        """
+        if commit and commit == self.commit:
+            return
+
+        object_type, content = self.cat_file.read(commit)
+        if object_type != 'commit':
+            raise Exception('Commit %s not found' % (commit, ))
+
+        tree, parents = parse_commit(content)
+        self.root = TreeNode(tree)
+        self.commit = commit
+
+    def load_tree(self, tree):
+        self.root = TreeNode(tree)
+        self.commit = None
+
+    def entries(self, node):
+        if node.entries is None:
+            object_type, content = self.cat_file.read(node.sha)
+            if object_type != 'tree':
+                raise Exception('Tree %s not found' % (node.sha, ))
+
+            node.entries = {}
+            for mode, name, sha in parse_tree(content):
+                node.entries[name] = TreeNode(sha) if mode == '40000' else (mode, sha)
+
+        return node.entries
+
+    def set(self, path, mode, sha):
+        names = path.strip('/').split('/')
+        node = self.root
+        self.commit = None
+
+        for name in names[:-1]:
+            entries = self.entries(node)
+            node.sha = None
+
+            child = entries.get(name)
+            if not isinstance(child, TreeNode):
+                # new directory, or a file replaced by a directory
+                child = entries[name] = TreeNode()
+
+            node = child
+
+        self.entries(node)[names[-1]] = TreeNode(sha) if mode == '40000' else (mode, sha)
+        node.sha = None
+
+    def write(self):
+        """
+        Writes all changed directories and returns the sha of the root tree.
+        """
+        return self.write_node(self.root)
+
+    def write_node(self, node):
+        if node.sha:
+            return node.sha
+
+        entries = {}
+        for name, entry in self.entries(node).items():
+            if isinstance(entry, TreeNode):
+                entries[name] = ('40000', self.write_node(entry))
+            else:
+                entries[name] = entry
+
+        node.sha = write_object(self.git_dir, 'tree', serialize_tree(entries))
+
+        return node.sha
@@ -0,0 +1,266 @@
+from __future__ import absolute_import
+
+import logging
+import traceback
+from threading import Thread, Lock, Event, current_thread
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2, only the thread based core is available
+    asyncio = None
+
+
+class Call(object):
+    """
+    A callback scheduled on the IOLoop. cancel() can be called from any thread. With blocking=True it runs in the
+    worker pool of the IOLoop instead of the loop thread.
+    """
+
+    def __init__(self, io_loop, callback, args, blocking=False):
+        self.io_loop = io_loop
+        self.callback = callback
+        self.args = args
+        self.blocking = blocking
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __call__(self):
+        if self.blocking:
+            self.io_loop.loop.run_in_executor(self.io_loop.executor, self.run)
+        else:
+            self.run()
+
+    def run(self):
+        if not self.cancelled:
+            self.io_loop.run_guarded(self.callback, *self.args)
+
+
+class Periodic(Call):
+    """
+    Calls callback every interval seconds, measured from the end of the previous call, until cancelled.
+    With blocking=True each call runs in the worker pool of the IOLoop, so subprocesses, disk and network
+    calls do not stall the channel I/O. join() waits for a running call to finish.
+    """
+
+    def __init__(self, io_loop, interval, callback, args, blocking=False):
+        Call.__init__(self, io_loop, callback, args, blocking)
+        self.interval = interval
+        self.idle = Event()
+        self.idle.set()
+
+    def __call__(self):
+        if self.cancelled:
+            return
+
+        if self.blocking:
+            self.idle.clear()
+            future = self.io_loop.loop.run_in_executor(self.io_loop.executor, self.run_blocking)
+            future.add_done_callback(lambda future: self.schedule())
+        else:
+            Call.__call__(self)
+            self.schedule()
+
+    def run_blocking(self):
+        try:
+            Call.run(self)
+        finally:
+            self.idle.set()
+
+    def schedule(self):
+        if not self.cancelled:
+            self.io_loop.loop.call_later(self.interval, self)
+
+    def join(self, timeout=None):
+        return self.idle.wait(timeout)
+
+
+class Debounced(Call):
+    """
+    Calls callback delay seconds after trigger(), once for all triggers until then, so a burst of triggers results
+    in one call. Triggers during the call schedule the next one. With blocking=True the call runs in the worker pool
+    of the IOLoop like Periodic. trigger() can be called from any thread.
+    """
+
+    def __init__(self, io_loop, delay, callback, args, blocking=False):
+        Call.__init__(self, io_loop, callback, args, blocking)
+        self.delay = delay
+        self.lock = Lock()
+        self.scheduled = False
+        self.idle = Event()
+        self.idle.set()
+
+    def trigger(self, delay=None):
+        with self.lock:
+            if self.scheduled or self.cancelled:
+                return
+
+            self.scheduled = True
+
+        delay = self.delay if delay is None else delay
+        self.io_loop.loop.call_soon_threadsafe(self.io_loop.loop.call_later, delay, self)
+
+    def __call__(self):
+        with self.lock:
+            self.scheduled = False
+
+        if self.cancelled:
+            return
+
+        self.idle.clear()
+        if self.blocking:
+            self.io_loop.loop.run_in_executor(self.io_loop.executor, self.run_blocking)
+        else:
+            self.run_blocking()
+
+    def run_blocking(self):
+        try:
+            Call.run(self)
+        finally:
+            self.idle.set()
+
+    def join(self, timeout=None):
+        return self.idle.wait(timeout)
+
+
+class IOLoop(object):
+    """
+    One thread running an asyncio event loop, shared by everything of a process that reads channels or wakes
+    up regularly: BackendClient channel reads, Git push scheduling, monitoring ticks and log flushing.
+    Without it each of those has its own thread sleeping or blocking in a loop.
+
+    Enabled with `io_core: asyncio` in the home config, Python 3 only. All methods are thread-safe, callbacks
+    are executed in the loop thread and must not block. Disk I/O, subprocesses and user callbacks are scheduled
+    with blocking=True, which runs them in the worker pool.
+    """
+
+    def __init__(self, logger=None, workers=2):
+        self.logger = logger or logging.getLogger('aetros-io-loop')
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.readers = {}
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self):
+        return current_thread() is self.thread
+
+    def run_guarded(self, callback, *args):
+        try:
+            callback(*args)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            # one broken callback must not stop the loop for all others
+            self.logger.debug(traceback.format_exc())
+
+    def call_soon(self, callback, *args):
+        call = Call(self, callback, args)
+        self.loop.call_soon_threadsafe(call)
+
+        return call
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        call = Call(self, callback, args, blocking=kwargs.get('blocking', False))
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, call)
+
+        return call
+
+    def every(self, interval, callback, *args, **kwargs):
+        """
+        Calls callback now and then every interval seconds. Returns a Periodic, cancel() it to stop.
+        """
+        periodic = Periodic(self, interval, callback, args, blocking=kwargs.get('blocking', False))
+        self.loop.call_soon_threadsafe(periodic)
+
+        return periodic
+
+    def debounced(self, delay, callback, *args, **kwargs):
+        """
+        Returns a Debounced, its trigger() calls callback after delay seconds. cancel() it to stop.
+        """
+        return Debounced(self, delay, callback, args, blocking=kwargs.get('blocking', False))
+
+    def add_reader(self, fileobj, callback, *args, **kwargs):
+        """
+        Calls callback whenever fileobj is readable, until remove_reader(fileobj). fileobj needs a fileno().
+        With blocking=True the callback runs in the worker pool and fileobj is not watched meanwhile.
+        """
+        blocking = kwargs.get('blocking', False)
+
+        if self.in_loop():
+            self._add_reader(fileobj, callback, args, blocking)
+        else:
+            self.loop.call_soon_threadsafe(self._add_reader, fileobj, callback, args, blocking)
+
+    def remove_reader(self, fileobj):
+        if self.in_loop():
+            self._remove_reader(fileobj)
+        else:
+            self.loop.call_soon_threadsafe(self._remove_reader, fileobj)
+
+    def _add_reader(self, fileobj, callback, args, blocking=False):
+        fd = fileobj.fileno()
+        self.readers[id(fileobj)] = fd
+
+        if blocking:
+            self.loop.add_reader(fd, self._read_blocking, fileobj, fd, callback, args)
+        else:
+            self.loop.add_reader(fd, self.run_guarded, callback, *args)
+
+    def _read_blocking(self, fileobj, fd, callback, args):
+        # fd stays readable until the callback read it, so it's watched again only after the callback
+        self.loop.remove_reader(fd)
+
+        future = self.loop.run_in_executor(self.executor, self.run_guarded, callback, *args)
+        future.add_done_callback(lambda future: self._resume_reader(fileobj, fd, callback, args))
+
+    def _resume_reader(self, fileobj, fd, callback, args):
+        if self.readers.get(id(fileobj)) == fd:
+            self.loop.add_reader(fd, self._read_blocking, fileobj, fd, callback, args)
+
+    def _remove_reader(self, fileobj):
+        fd = self.readers.pop(id(fileobj), None)
+        if fd is not None:
+            self.loop.remove_reader(fd)
+
+
+shared_io_loop = None
+shared_io_loop_lock = Lock()
+
+
+def get_io_loop(config, logger=None):
+    """
+    Returns the IOLoop of this process when the home config asks for `io_core: asyncio`, otherwise None,
+    which means the thread based core is used.
+    """
+    global shared_io_loop
+
+    if config.get('io_core') != 'asyncio':
+        return None
+
+    with shared_io_loop_lock:
+        if shared_io_loop is None:
+            if asyncio is None:
+                logger and logger.warning('io_core asyncio needs Python 3, falling back to threads.')
+                return None
+
+            shared_io_loop = IOLoop(logger)
+
+        return shared_io_loop
+
+
+def running_io_loop():
+    """
+    The IOLoop of this process if one was started, e.g. by BackendClient, otherwise None.
+    """
+    return shared_io_loop
@@ -1,11 +1,13 @@
 from __future__ import absolute_import
 
+import os
 import sys
 import traceback
 
 import six
-from threading import Timer, Thread, Lock
+from threading import Timer, Thread, Lock, Event
 
+from aetros.io_loop import running_io_loop
 from aetros.utils import thread_join_non_blocking
 
 
@@ -78,59 +80,100 @@ class GeneralLogger(object):
         bid = id(buffer)
         self.attach_last_messages[bid] = b''
 
-        def reader():
-            current_line = b''
+        state = {'line': b''}
+
+        def handle_line(buf):
+            if buf == b'':
+                return
+
+            if read_line and callable(read_line):
+                res = read_line(buf)
+                if res is False:
+                    return False
+
+                elif res is not None:
+                    buf = res
+                    if hasattr(buf, 'encode'):
+                        buf = buf.encode('utf-8')
+
+            self.attach_last_messages[bid] += buf
 
-            def handle_line(buf):
+            if len(self.attach_last_messages[bid]) > 21 * 1024:
+                self.attach_last_messages[bid] = self.attach_last_messages[bid][-20 * 1024:]
+
+            self.write(buf)
+
+        flush_char = b'\n'
+
+        def feed(chunk):
+            """
+            Handles read data, returns False at the end of buffer.
+            """
+            try:
                 if chunk == b'':
-                    return
+                    if state['line']:
+                        handle_line(state['line'])
+                    return False
 
-                if read_line and callable(read_line):
-                    res = read_line(buf)
-                    if res is False:
-                        return False
+                state['line'] += chunk
 
-                    elif res is not None:
-                        buf = res
-                        if hasattr(buf, 'encode'):
-                            buf = buf.encode('utf-8')
+                while flush_char in state['line']:
+                    pos = state['line'].find(flush_char)
+                    line = state['line'][:pos+1]
+                    state['line'] = state['line'][pos+1:]
+                    handle_line(line)
 
-                self.attach_last_messages[bid] += buf
+                # todo, periodically flush by '\r' only (progress bars for example)
+                # and make sure only necessary data is sent (by applying \r and \b control characters)
 
-                if len(self.attach_last_messages[bid]) > 21 * 1024:
-                    self.attach_last_messages[bid] = self.attach_last_messages[bid][-20 * 1024:]
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                # we need to make sure, we continue to read otherwise the process of this buffer
+                # will block and we have a stuck process.
+                sys.__stderr__.write(traceback.format_exc() + '\n')
+                sys.__stderr__.flush()
 
-                self.write(buf)
+        io_loop = running_io_loop()
 
-            flush_char = b'\n'
+        if io_loop:
+            ended = Event()
 
-            while True:
+            def on_readable():
                 try:
-                    # needs to be 1 so we fetch data in near real-time
-                    chunk = buffer.read(1)
-                    if chunk == b'':
-                        if current_line:
-                            handle_line(current_line)
-                        return
+                    chunk = os.read(buffer.fileno(), 4096)
+                except OSError:
+                    chunk = b''
+
+                if feed(chunk) is False:
+                    io_loop.remove_reader(buffer)
+                    ended.set()
 
-                    current_line += chunk
+            # feed() writes to the disk and calls the user callbacks
+            io_loop.add_reader(buffer, on_readable, blocking=True)
 
-                    while flush_char in current_line:
-                        pos = current_line.find(flush_char)
-                        line = current_line[:pos+1]
-                        current_line = current_line[pos+1:]
-                        handle_line(line)
+            def wait():
+                # with a timeout, like thread_join_non_blocking, to stay responsive to signals
+                while not ended.wait(0.5):
+                    pass
+                self.send_buffer()
 
-                    # todo, periodically flush by '\r' only (progress bars for example)
-                    # and make sure only necessary data is sent (by applying \r and \b control characters)
+            return wait
 
+        def reader():
+            while True:
+                try:
+                    # needs to be 1 so we fetch data in near real-time
+                    chunk = buffer.read(1)
                 except (KeyboardInterrupt, SystemExit):
                     raise
                 except Exception:
-                    # we need to make sure, we continue to read otherwise the process of this buffer
-                    # will block and we have a stuck process.
                     sys.__stderr__.write(traceback.format_exc() + '\n')
                     sys.__stderr__.flush()
+                    continue
+
+                if feed(chunk) is False:
+                    return
 
         thread = Thread(target=reader)
         thread.daemon = True
@@ -169,8 +212,12 @@ class GeneralLogger(object):
                         self.buffer += char
 
                 if not self.last_timer:
-                    self.last_timer = Timer(1.0, self.send_buffer)
-                    self.last_timer.start()
+                    io_loop = running_io_loop()
+                    if io_loop:
+                        self.last_timer = io_loop.call_later(1.0, self.send_buffer, blocking=True)
+                    else:
+                        self.last_timer = Timer(1.0, self.send_buffer)
+                        self.last_timer.start()
 
         except (KeyboardInterrupt, SystemExit):
             raise
@@ -0,0 +1,267 @@
+from __future__ import absolute_import
+
+import collections
+import itertools
+from threading import Lock
+
+import msgpack
+import six
+
+
+class MessageQueue(object):
+    """
+    Send queue of one BackendClient channel.
+
+    Messages live in two FIFO lanes: the priority lane (BackendClient.send(important=True)) is always sent
+    before the bulk lane. The write thread takes unsent messages from the lane heads and since messages are sent
+    in order, already sent messages are always a prefix of each lane, which makes removing them O(1).
+
+    Size and byte counters are kept up to date on every change, so monitoring does not need to walk
+    or copy the queue. Messages the UI shows progress for (store-blob, git-unpack-objects) are additionally
+    tracked in a small ordered index.
+
+    Unsent stream-blobs of the same path in the same lane are merged into one message until stream_blob_max_size
+    is reached. Their chunks are kept raw and only packed once the write thread takes the message.
+
+    When the server acknowledges messages, a written message is marked _written and stays queued until its
+    sequence number got acknowledged (then _sent), so it can be sent again after a reconnect. Written messages
+    are never superseded or merged into again, since the server may already have processed them. The same holds
+    for every message that got a sequence number, e.g. one replayed from the outbox of a previous process.
+
+    All methods need to be called while holding MessageQueue.lock.
+    """
+
+    tracked_types = ('store-blob', 'git-unpack-objects')
+
+    stream_blob_max_size = 64 * 1024
+
+    def __init__(self):
+        self.lock = Lock()
+
+        self.priority = collections.deque()
+        self.bulk = collections.deque()
+
+        # path -> unsent store-blob message, so a newer store-blob supersedes the queued one
+        self.store_blobs = {}
+
+        # (important, path) -> unsent stream-blob message new chunks are appended to
+        self.stream_blobs = {}
+
+        # _id -> message of tracked_types, used by MonitoringThread.network_sync
+        self.tracked = collections.OrderedDict()
+
+        # number of queued messages and sum of their _total
+        self.count = 0
+        self.bytes = 0
+
+        # written but not yet acknowledged messages and sum of their _total
+        self.unacked = 0
+        self.unacked_bytes = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return itertools.chain(self.priority, self.bulk)
+
+    def append(self, message, important=False):
+        """
+        Queues the message and returns the queue entry that carries its data. For a store-blob with an unsent
+        entry of the same path, that entry gets the new data (last write wins) and is returned instead.
+        """
+        if message.get('type') == 'store-blob':
+            queued = self.store_blobs.get(message['path'])
+
+            if queued is not None and not queued['_sending'] and '_seq' not in queued:
+                # keeps its queue position
+                self.bytes += message['_total'] - queued['_total']
+                queued['_data'] = message['_data']
+                queued['_total'] = message['_total']
+
+                return queued
+
+            self.store_blobs[message['path']] = message
+
+        elif message.get('type') == 'stream-blob':
+            key = (important, message['path'])
+            queued = self.stream_blobs.pop(key, None)
+
+            # a message without _chunks is never merged and also ends merging into earlier ones, to keep the order
+            if '_chunks' in message:
+                # more than one chunk when replayed from the outbox
+                size = sum(len(chunk) for chunk in message['_chunks'])
+
+                if queued is not None and not queued['_sending'] and '_seq' not in queued \
+                        and queued['_total'] + size <= self.stream_blob_max_size:
+                    queued['_chunks'].extend(message['_chunks'])
+                    # packed lazily in take(), the real size differs only by a few header bytes
+                    queued['_data'] = None
+                    queued['_total'] += size
+                    self.bytes += size
+                    self.stream_blobs[key] = queued
+
+                    return queued
+
+                self.stream_blobs[key] = message
+
+        elif message.get('type') == 'sync-blob':
+            # newer blobs must not be merged into messages in front of this barrier
+            self.store_blobs.clear()
+            self.stream_blobs.clear()
+
+        if message.get('type') in self.tracked_types:
+            self.tracked[message['_id']] = message
+
+        if important:
+            self.priority.append(message)
+        else:
+            self.bulk.append(message)
+
+        self.count += 1
+        self.bytes += message['_total']
+
+        return message
+
+    def take(self, max_bytes):
+        """
+        Returns unsent messages in send order until max_bytes is reached, but at least one message.
+        Taken messages are marked as _sending and can't be superseded anymore.
+        """
+        messages = []
+        size = 0
+
+        for message in self:
+            if message['_sent'] or message.get('_written'):
+                continue
+
+            if messages and size + message['_total'] > max_bytes:
+                break
+
+            message['_sending'] = True
+            if message.get('type') == 'store-blob' and self.store_blobs.get(message['path']) is message:
+                del self.store_blobs[message['path']]
+
+            if message.get('type') == 'stream-blob' and '_chunks' in message:
+                for key in [(True, message['path']), (False, message['path'])]:
+                    if self.stream_blobs.get(key) is message:
+                        del self.stream_blobs[key]
+
+                if message['_data'] is None:
+                    self.pack_stream_blob(message)
+
+            messages.append(message)
+            size += message['_total']
+
+        return messages
+
+    def pack_stream_blob(self, message):
+        message['_data'] = pack_stream_blob(message['path'], message['_chunks'])
+        self.bytes += len(message['_data']) - message['_total']
+        message['_total'] = len(message['_data'])
+
+    def release(self, messages):
+        """
+        Gives messages that could not be sent back to the queue, so they can be superseded again.
+        """
+        for message in messages:
+            if not message['_sent'] and not message.get('_written'):
+                message['_sending'] = False
+                if message.get('type') == 'store-blob':
+                    self.store_blobs.setdefault(message['path'], message)
+
+    def pending(self):
+        """
+        Number of messages waiting to be written.
+        """
+        return self.count - self.unacked
+
+    def written(self, messages):
+        """
+        Counts messages the write thread marked as _written.
+        """
+        for message in messages:
+            if message.get('_written') and not message['_sent']:
+                message['_unacked'] = True
+                self.unacked += 1
+                self.unacked_bytes += message['_total']
+
+    def ack(self, seq):
+        """
+        Marks all messages with a sequence number up to seq as sent and returns them.
+        """
+        acked = []
+
+        for lane in (self.priority, self.bulk):
+            for message in lane:
+                if message['_sent']:
+                    continue
+
+                # sequence numbers grow within a lane. The ack can arrive before the write thread
+                # counted the message as written.
+                if '_seq' not in message or message['_seq'] > seq:
+                    break
+
+                message['_sent'] = True
+                if message.pop('_unacked', False):
+                    self.unacked -= 1
+                    self.unacked_bytes -= message['_total']
+
+                acked.append(message)
+
+        return acked
+
+    def rewind(self):
+        """
+        Written but not acknowledged messages are written again, e.g. after a reconnect.
+        """
+        for lane in (self.priority, self.bulk):
+            for message in lane:
+                if message['_sent']:
+                    continue
+
+                if not message.get('_written'):
+                    break
+
+                message['_written'] = False
+                message.pop('_unacked', None)
+
+        self.unacked = 0
+        self.unacked_bytes = 0
+
+    def remove_sent(self):
+        """
+        Removes all sent messages from the lane heads.
+        """
+        for lane in (self.priority, self.bulk):
+            while lane and lane[0]['_sent']:
+                message = lane.popleft()
+                self.count -= 1
+                self.bytes -= message['_total']
+
+                if message.get('type') in self.tracked_types:
+                    self.tracked.pop(message['_id'], None)
+
+    def tails(self):
+        """
+        Returns the last message of each lane. When they are sent, everything queued until now has been sent.
+        """
+        return [lane[-1] for lane in (self.priority, self.bulk) if lane]
+
+    def tracked_messages(self):
+        with self.lock:
+            return list(self.tracked.values())
+
+
+def pack_stream_blob(path, chunks):
+    """
+    Packs a stream-blob message of the raw chunks, which are either str or bytes.
+    """
+    if all(isinstance(chunk, six.binary_type) for chunk in chunks):
+        data = b''.join(chunks)
+    elif all(isinstance(chunk, six.text_type) for chunk in chunks):
+        data = u''.join(chunks)
+    else:
+        data = b''.join(chunk.encode('utf-8', 'replace') if isinstance(chunk, six.text_type) else chunk
+                        for chunk in chunks)
+
+    return msgpack.packb({'type': 'stream-blob', 'path': path, 'data': data})
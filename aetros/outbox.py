@@ -0,0 +1,359 @@
+from __future__ import absolute_import
+
+import collections
+import os
+import time
+import uuid
+from threading import Lock
+
+import msgpack
+
+from aetros.message_queue import pack_stream_blob
+
+
+class Outbox(object):
+    """
+    Append-only on-disk copy of a BackendClient channel queue, so queued messages survive a crash and
+    do not need to stay in memory during long outages.
+
+    Records are msgpack arrays written to numbered segment files:
+
+        ['session', session, seq]                                                       client session and its last seq
+        ['put', id, {'type', 'path', 'important', 'data', 'chunks', 'objects', 'seq'}]  message queued or superseded
+        ['append', id, chunk]                                                           chunk merged into a stream-blob
+        ['seq', [[id, seq], ...]]                                                       messages about to be written
+        ['ack', id]                                                                     message sent
+        ['replayed', index]                                                             segments up to index put again
+
+    Record ids are the message ids prefixed with a session id, because message ids start over in every process.
+
+    With acks, the client session sent in register_job_worker and the sequence numbers of written messages are
+    kept as well. A later process registers with the same session and writes replayed messages with the same
+    seq again, so the server can drop those it already processed.
+
+    A segment is deleted as soon as all messages with records in it are acknowledged, so the directory only
+    grows while the connection is down. Once more than memory_window bytes are queued, messages are spilled:
+    their data is dropped from memory and read back from the segment when the write thread takes them.
+
+    Every record is flushed to the operating system when written. fsync: 'always' syncs every record,
+    'interval' at most every fsync_interval seconds and 'never' leaves it to the operating system.
+    """
+
+    def __init__(self, path, fsync='interval', fsync_interval=1.0, segment_size=16 * 1024 * 1024,
+                 memory_window=32 * 1024 * 1024, logger=None):
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.memory_window = memory_window
+        self.logger = logger
+
+        self.lock = Lock()
+
+        # segment index -> set of message ids having records in it
+        self.segments = collections.OrderedDict()
+        self.handle = None
+        self.segment = None
+        self.last_sync = time.time()
+        self.dirty = False
+        self.closed = False
+
+        self.session = uuid.uuid4().hex[:12]
+        # session of the client and the last seq assigned in it, see start_session()
+        self.client_session = None
+        self.last_seq = 0
+        # segment indices read by replay(), removed by replayed()
+        self.replayed_segments = []
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def segment_path(self, index):
+        return os.path.join(self.path, '%012d.outbox' % index)
+
+    def record_id(self, message):
+        return '%s-%d' % (self.session, message['_id'])
+
+    def segment_indices(self):
+        indices = []
+        for name in os.listdir(self.path):
+            if name.endswith('.outbox'):
+                try:
+                    indices.append(int(name[:-len('.outbox')]))
+                except ValueError:
+                    pass
+
+        return sorted(indices)
+
+    def replay(self):
+        """
+        Reads all existing segments and returns the not acknowledged messages in queue order, as
+        queue entries without _id and with _important. A record cut off by a crash ends its segment.
+        """
+        messages = collections.OrderedDict()
+        # id -> segment index of the put record
+        origins = {}
+
+        with self.lock:
+            for index in self.segment_indices():
+                self.segments[index] = set()
+                self.replayed_segments.append(index)
+
+                with open(self.segment_path(index), 'rb') as f:
+                    unpacker = msgpack.Unpacker(f, encoding='utf-8', max_buffer_size=2 ** 31 - 1)
+
+                    try:
+                        for record in unpacker:
+                            op, id = record[0], record[1]
+                            if op == 'session':
+                                self.client_session = id
+                                self.last_seq = max(self.last_seq, record[2])
+                            elif op == 'put':
+                                messages[id] = record[2]
+                                origins[id] = index
+                            elif op == 'append' and id in messages:
+                                messages[id].setdefault('appended', []).append(record[2])
+                            elif op == 'seq':
+                                for seq_id, seq in id:
+                                    if seq_id in messages:
+                                        messages[seq_id]['seq'] = seq
+                                    self.last_seq = max(self.last_seq, seq)
+                            elif op == 'ack':
+                                messages.pop(id, None)
+                            elif op == 'replayed':
+                                # a previous process put these again, but died before removing them
+                                for replayed_id in [i for i in messages if origins[i] <= id]:
+                                    del messages[replayed_id]
+                    except Exception as e:
+                        if self.logger:
+                            self.logger.warning('Outbox segment %s is damaged, ignoring the rest: %s'
+                                                % (self.segment_path(index), str(e)))
+
+            # the caller puts everything pending again into a new segment and then calls replayed().
+            # The old segments stay until then, so a crash in between loses nothing.
+            if self.segments:
+                self.segment = list(self.segments.keys())[-1]
+
+        result = []
+        for record in messages.values():
+            message = {
+                'type': record.get('type'),
+                'path': record.get('path'),
+                '_important': record.get('important', False),
+                '_data': record['data'],
+                '_total': len(record['data']),
+                '_bytes_sent': 0,
+                '_sending': False,
+                '_sent': False,
+            }
+
+            if message['path'] is None:
+                del message['path']
+
+            if message['type'] is None:
+                del message['type']
+
+            if 'objects' in record:
+                message['objects'] = record['objects']
+
+            if 'seq' in record:
+                # might have reached the server already
+                message['_seq'] = record['seq']
+
+            if 'chunks' in record:
+                message['_chunks'] = record['chunks'] + record.get('appended', [])
+                if record.get('appended'):
+                    message['_data'] = pack_stream_blob(message['path'], message['_chunks'])
+                    message['_total'] = len(message['_data'])
+
+            result.append(message)
+
+        return result
+
+    def replayed(self):
+        """
+        Removes the segments read by replay(), once the caller has put all their pending messages again.
+        """
+        with self.lock:
+            if self.closed or not self.replayed_segments:
+                return
+
+            # the marker tells a later replay to ignore the old segments, should we die before removing them
+            self.write(['replayed', self.replayed_segments[-1]])
+            self.sync(force=True)
+
+            for index in self.replayed_segments:
+                os.remove(self.segment_path(index))
+                del self.segments[index]
+
+            self.replayed_segments = []
+
+    def put(self, message, important, spill=False):
+        """
+        Writes the current state of a queue entry. With spill=True the data is dropped from memory,
+        it's then loaded again with load().
+        """
+        record = {'data': message['_data'], 'important': important}
+
+        for key in ['type', 'path', 'objects']:
+            if key in message:
+                record[key] = message[key]
+
+        if '_chunks' in message:
+            record['chunks'] = list(message['_chunks'])
+
+        if '_seq' in message:
+            record['seq'] = message['_seq']
+
+        with self.lock:
+            if self.closed:
+                return
+
+            id = self.record_id(message)
+            message['_outbox'] = self.write(['put', id, record], id)
+
+        if spill:
+            message['_data'] = None
+            message.pop('_chunks', None)
+
+    def append(self, message, chunk):
+        with self.lock:
+            if not self.closed:
+                id = self.record_id(message)
+                self.write(['append', id, chunk], id)
+
+    def start_session(self, session, seq):
+        """
+        Sets the client session the next records belong to, and the last seq assigned in it so far.
+        """
+        with self.lock:
+            self.client_session = session
+            self.last_seq = seq
+
+            if self.handle is not None:
+                self.write(['session', session, seq])
+
+    def sequenced(self, messages):
+        """
+        Records the seq of messages before they are written for the first time.
+        """
+        with self.lock:
+            if self.closed:
+                return
+
+            ids = [self.record_id(message) for message in messages]
+            self.write(['seq', [[id, message['_seq']] for id, message in zip(ids, messages)]])
+
+            # keeps the segment until the messages are acknowledged
+            self.segments[self.segment].update(ids)
+            self.last_seq = max([self.last_seq] + [message['_seq'] for message in messages])
+
+    def ack(self, messages):
+        with self.lock:
+            if self.closed:
+                return
+
+            for message in messages:
+                id = self.record_id(message)
+                self.write(['ack', id])
+
+                for index, ids in list(self.segments.items()):
+                    ids.discard(id)
+
+            # the current segment is kept open, all older ones go away once fully acknowledged.
+            # Replayed segments are removed by replayed().
+            for index, ids in list(self.segments.items()):
+                if index != self.segment and not ids and index not in self.replayed_segments:
+                    os.remove(self.segment_path(index))
+                    del self.segments[index]
+
+            self.sync()
+
+    def load(self, message):
+        """
+        Loads the data of a spilled message from its segment.
+        """
+        index, offset = message['_outbox']
+
+        with self.lock:
+            if index == self.segment:
+                self.handle.flush()
+
+            with open(self.segment_path(index), 'rb') as f:
+                f.seek(offset)
+                unpacker = msgpack.Unpacker(f, encoding='utf-8', max_buffer_size=2 ** 31 - 1)
+                record = next(unpacker)
+
+        message['_data'] = record[2]['data']
+
+    def write(self, record, id=None):
+        if self.handle is None or self.handle.tell() >= self.segment_size:
+            self.next_segment()
+
+        offset = self.handle.tell()
+        self.handle.write(msgpack.packb(record, use_bin_type=True))
+        # hand every record to the operating system right away, so a crashed process loses nothing even
+        # when no acknowledgment comes in during an outage
+        self.handle.flush()
+        self.dirty = True
+
+        if id is not None:
+            self.segments[self.segment].add(id)
+
+        self.sync(force=self.fsync == 'always')
+
+        return self.segment, offset
+
+    def sync(self, force=False):
+        if not self.dirty or self.fsync == 'never':
+            return
+
+        if force or time.time() - self.last_sync >= self.fsync_interval:
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.last_sync = time.time()
+            self.dirty = False
+
+    def next_segment(self):
+        if self.handle is not None:
+            self.handle.flush()
+            if self.fsync != 'never':
+                os.fsync(self.handle.fileno())
+            self.handle.close()
+
+            if not self.segments[self.segment]:
+                os.remove(self.segment_path(self.segment))
+                del self.segments[self.segment]
+
+        self.segment = (self.segment + 1) if self.segment is not None else 0
+        self.segments[self.segment] = set()
+        self.handle = open(self.segment_path(self.segment), 'ab')
+        self.dirty = False
+
+        if self.client_session is not None:
+            # older segments and their seq records may go away before this one
+            self.handle.write(msgpack.packb(['session', self.client_session, self.last_seq], use_bin_type=True))
+
+    def close(self):
+        """
+        Closes the current segment and removes the outbox directory when nothing is pending anymore.
+        """
+        with self.lock:
+            self.closed = True
+
+            if self.handle is not None:
+                self.handle.flush()
+                if self.fsync != 'never':
+                    os.fsync(self.handle.fileno())
+                self.handle.close()
+                self.handle = None
+
+            if all(not ids for ids in self.segments.values()):
+                for index in list(self.segments.keys()):
+                    os.remove(self.segment_path(index))
+                self.segments.clear()
+
+                try:
+                    os.rmdir(self.path)
+                except OSError:
+                    pass
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import random
+import time
+from threading import Lock, Condition
+
+
+class ReconnectScheduler(object):
+    """
+    Decides when the channels of a BackendClient may try to connect again, so a server restart is not
+    answered by all channels of all jobs reconnecting at the same time and in a tight loop.
+
+    Works as a circuit breaker shared by all channels:
+
+        closed      connected, a channel may connect right away
+        open        a connection broke or an attempt failed. Nobody tries until the backoff delay passed.
+                    The delay grows exponentially with consecutive failures up to max_delay, with full jitter.
+        half-open   the delay passed and exactly one channel (the probe) tries. All others wait for
+                    its result: on success everybody connects, on failure it's open again with a longer delay.
+
+    Also keeps connection metrics, see metrics().
+    """
+
+    def __init__(self, base_delay=0.5, max_delay=60.0, random_func=random.random):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.random = random_func
+
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+
+        self.state = 'closed'
+        self.failures = 0
+        self.next_attempt = 0
+        self.probe = None
+        self.probe_since = 0
+
+        self.disconnected_since = None
+        self.disconnected_time = 0.0
+        self.reconnects = 0
+        self.attempts = 0
+        self.handshakes = collections.deque(maxlen=50)
+
+    def delay(self):
+        """
+        Backoff delay after self.failures consecutive failures, with full jitter.
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** min(self.failures - 1, 30)))
+
+        return self.random() * delay
+
+    def wait_for_attempt(self, channel, is_active):
+        """
+        Blocks until channel may try to connect. Returns False when is_active() turned False meanwhile.
+        """
+        self.condition.acquire()
+        try:
+            while is_active():
+                if self.state == 'closed' or self.probe == channel:
+                    self.attempts += 1
+                    return True
+
+                now = time.time()
+                # a probe that did not report within max_delay is replaced, e.g. when its thread ended
+                if (self.state == 'open' and now >= self.next_attempt) \
+                        or (self.state == 'half-open' and now - self.probe_since > self.max_delay):
+                    self.state = 'half-open'
+                    self.probe = channel
+                    self.probe_since = now
+                    self.attempts += 1
+                    return True
+
+                if self.state == 'open':
+                    timeout = self.next_attempt - now
+                else:
+                    timeout = self.probe_since + self.max_delay - now
+
+                # wake() is called when the client stops
+                self.condition.wait(max(timeout, 0.01))
+
+            return False
+        finally:
+            self.condition.release()
+
+    def record_success(self, channel, handshake_time):
+        self.condition.acquire()
+        try:
+            self.handshakes.append(handshake_time)
+
+            if self.state != 'closed':
+                self.reconnects += 1
+
+            if self.disconnected_since is not None:
+                self.disconnected_time += time.time() - self.disconnected_since
+                self.disconnected_since = None
+
+            self.state = 'closed'
+            self.failures = 0
+            self.probe = None
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+    def record_failure(self, channel):
+        """
+        A connection broke or a connection attempt failed.
+        """
+        self.condition.acquire()
+        try:
+            # several channels notice the same outage, only the first one and failed probes count
+            if self.state == 'open' or (self.state == 'half-open' and self.probe != channel):
+                return
+
+            if self.disconnected_since is None:
+                self.disconnected_since = time.time()
+
+            self.failures += 1
+            self.state = 'open'
+            self.probe = None
+            self.next_attempt = time.time() + self.delay()
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+    def wake(self):
+        self.condition.acquire()
+        try:
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+    def metrics(self):
+        self.condition.acquire()
+        try:
+            disconnected_time = self.disconnected_time
+            if self.disconnected_since is not None:
+                disconnected_time += time.time() - self.disconnected_since
+
+            handshakes = sorted(self.handshakes)
+
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'attempts': self.attempts,
+                'reconnects': self.reconnects,
+                'disconnected_time': disconnected_time,
+                'next_attempt': max(0, self.next_attempt - time.time()) if self.state == 'open' else 0,
+                'handshake_last': self.handshakes[-1] if handshakes else None,
+                'handshake_median': handshakes[len(handshakes) // 2] if handshakes else None,
+            }
+        finally:
+            self.condition.release()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from aetros.bandwidth import TokenBucket, HostFairShare
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def testBurstIsFree(self):
+        bucket = TokenBucket(1000)
+        self.assertEqual(0, bucket.consume(1000))
+
+    def testDebtIsPaidBack(self):
+        bucket = TokenBucket(1000)
+        bucket.consume(1000)
+
+        delay = bucket.consume(500)
+        self.assertTrue(0.45 < delay <= 0.5)
+
+    def testRefillIsCapped(self):
+        bucket = TokenBucket(1000, burst=100)
+        bucket.last -= 10
+        bucket.refill()
+        self.assertEqual(100, bucket.tokens)
+
+
+class TestHostFairShare(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def testSharedBetweenActiveProcesses(self):
+        # two other uploading processes and an idle one
+        for name, age in [('1', 0), ('2', 1), ('3', 60)]:
+            open(os.path.join(self.path, name), 'w').close()
+            os.utime(os.path.join(self.path, name), (time.time() - age, time.time() - age))
+
+        share = HostFairShare(self.path, 3000)
+        share.consume(0)
+        self.assertEqual(3, share.shares)
+        self.assertEqual(1000, share.bucket.rate)
+
+        share.close()
+        self.assertFalse(os.path.exists(share.heartbeat))
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from aetros.capture import CaptureWriter, read_capture
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'job.capture')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTrip(self):
+        writer = CaptureWriter(self.path, info={'job': 'abc'})
+        writer.write('', False, {'type': 'stream-blob', 'path': 'log', '_chunks': ['a\n'], '_data': b'\x01', '_id': 1})
+        writer.write('files', True, {'type': 'git-unpack-objects', 'objects': {'x': 1}, '_data': b'\x02\xff'})
+        writer.close()
+
+        header, records = read_capture(self.path)
+        self.assertEqual('abc', header['job'])
+
+        records = list(records)
+        self.assertEqual(2, len(records))
+
+        offset, channel, important, meta, chunk, data = records[0]
+        self.assertEqual('', channel)
+        self.assertFalse(important)
+        self.assertEqual({'type': 'stream-blob', 'path': 'log'}, meta)
+        self.assertEqual('a\n', chunk)
+        self.assertEqual(b'\x01', data)
+
+        offset, channel, important, meta, chunk, data = records[1]
+        self.assertEqual('files', channel)
+        self.assertTrue(important)
+        self.assertEqual({'x': 1}, meta['objects'])
+        self.assertIsNone(chunk)
+        self.assertEqual(b'\x02\xff', data)
+
+    def testAddDefersWriting(self):
+        writer = CaptureWriter(self.path)
+        message = {'type': 'store-blob', 'path': 'a', '_data': b'first'}
+        writer.add('', False, message)
+        writer.add('', False, {'type': 'store-blob', 'path': 'b', '_data': b'second'})
+
+        # the record is taken when added, later changes of the queue entry don't matter
+        message['_data'] = b'merged'
+        self.assertEqual(0, writer.messages)
+
+        writer.write_pending()
+        self.assertEqual(2, writer.messages)
+        writer.close()
+
+        header, records = read_capture(self.path)
+        self.assertEqual([('a', b'first'), ('b', b'second')], [(r[3]['path'], r[5]) for r in records])
+
+    def testCutOff(self):
+        writer = CaptureWriter(self.path)
+        for i in range(100):
+            writer.write('', False, {'type': 'store-blob', 'path': str(i), '_data': b'x' * 100})
+        writer.close()
+
+        # simulates a crash while writing
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(content[:-20])
+
+        header, records = read_capture(self.path)
+        self.assertTrue(len(list(records)) < 100)
+
+    def testNoCapture(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'nope')
+
+        self.assertRaises(Exception, read_capture, self.path)
@@ -0,0 +1,219 @@
+import logging
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+from threading import Thread, Event, Condition
+
+import msgpack
+import six
+
+from aetros.client import BackendClient
+from aetros.message_queue import MessageQueue
+
+
+class FakeChannel(object):
+    """
+    Stands in for a paramiko channel, backed by one end of a socket pair.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.closed = False
+        # sizes of all send() calls
+        self.sends = []
+        # like paramiko, which sends at most one packet per call
+        self.max_send = None
+        self.buffers = []
+
+    def send(self, data):
+        self.buffers.append(data)
+        data = data[:self.max_send] if self.max_send else data
+        self.sends.append(len(data))
+        return self.sock.send(data)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size):
+        chunk = self.sock.recv(size)
+        if chunk == b'':
+            self.closed = True
+
+        return chunk
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+
+class TestBackendClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = BackendClient({'host': 'localhost'}, None, logging.getLogger('aetros-test'))
+        self.server, sock = socket.socketpair()
+        self.channel = FakeChannel(sock)
+        self.sockets = [self.server, sock]
+
+        # what start_channel() sets up, without read and write threads
+        self.client.active = True
+        self.client.online = True
+        self.client.connected[''] = True
+        self.client.channel_closed[''] = False
+        self.client.stop_on_empty_queue[''] = False
+        self.client.queues[''] = MessageQueue()
+        self.client.queue_lock[''] = self.client.queues[''].lock
+        self.client.queue_condition[''] = Condition(self.client.queue_lock[''])
+        self.client.ssh_channel[''] = self.channel
+        self.client.close_events[''] = Event()
+        self.client.read_size[''] = self.client.read_size_min
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def received(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.server.recv(size - len(data))
+
+        return list(msgpack.Unpacker(six.BytesIO(data), encoding='utf-8'))
+
+    def testOneSendForAllReadyMessages(self):
+        for i in range(5):
+            self.client.send({'type': 'log', 'data': str(i)})
+
+        messages = self.client.collect_batch('')
+        self.assertEqual(5, len(messages))
+
+        self.assertTrue(self.client.send_batch(messages, ''))
+        self.assertEqual(1, len(self.channel.sends))
+        self.assertTrue(all(m['_sent'] and m['_bytes_sent'] == m['_total'] for m in messages))
+        self.assertEqual([str(i) for i in range(5)], [m['data'] for m in self.received(self.channel.sends[0])])
+
+    def testBatchSize(self):
+        self.client.write_batch_size = 100
+        self.client.send({'type': 'log', 'data': 'x' * 200})
+        for i in range(5):
+            self.client.send({'type': 'log', 'data': 'y' * 30})
+
+        # a bigger message goes alone, the others up to write_batch_size
+        for count in [1, 2, 2, 1]:
+            messages = self.client.collect_batch('')
+            self.assertEqual(count, len(messages))
+            self.client.send_batch(messages, '')
+
+        self.assertEqual(['x' * 200] + ['y' * 30] * 5, [m['data'] for m in self.received(sum(self.channel.sends))])
+
+    def testChunkedSend(self):
+        self.client.write_chunk_size = 1000
+        self.channel.max_send = 300
+        self.client.send({'type': 'log', 'data': 'x' * 2500})
+
+        messages = self.client.collect_batch('')
+        self.assertTrue(self.client.send_batch(messages, ''))
+
+        # no chunk bigger than write_chunk_size, partial sends are continued where they stopped
+        total = messages[0]['_total']
+        self.assertEqual([300] * (total // 300) + [total % 300], self.channel.sends)
+        self.assertEqual(['x' * 2500], [m['data'] for m in self.received(total)])
+
+        # a single message is sent from its own data, without copying it
+        self.assertTrue(all(isinstance(data, memoryview) and data.obj is messages[0]['_data']
+                            for data in self.channel.buffers))
+        self.assertTrue(all(len(data) <= 1000 for data in self.channel.buffers))
+
+    def testRecvBlocksUntilData(self):
+        chunks = []
+        reader = Thread(target=lambda: chunks.append(self.client.recv('')))
+        reader.start()
+
+        time.sleep(0.05)
+        self.assertEqual([], chunks)
+
+        self.server.sendall(b'data')
+        reader.join(5)
+        self.assertEqual([b'data'], chunks)
+
+    def testRecvSizeAdapts(self):
+        # what four reads growing from read_size_min take
+        self.server.sendall(b'x' * 61440)
+
+        sizes = []
+        received = 0
+        while received < 61440:
+            sizes.append(self.client.read_size[''])
+            received += len(self.client.recv(''))
+
+        # grows while the buffer comes back full
+        self.assertEqual([4096, 8192, 16384, 32768], sizes[:4])
+        self.assertEqual(self.client.read_size_max, self.client.read_size[''])
+
+        # and shrinks again once only little arrives
+        for i in range(3):
+            self.server.sendall(b'x')
+            self.client.recv('')
+
+        self.assertEqual(8192, self.client.read_size[''])
+
+    def testWaitForCloseWakesUpOnClose(self):
+        reader = Thread(target=self.client.recv, args=[''])
+        reader.start()
+
+        def close():
+            time.sleep(0.1)
+            self.server.close()
+
+        Thread(target=close).start()
+
+        start = time.time()
+        self.client.wait_for_close()
+        reader.join()
+
+        self.assertTrue(self.channel.closed)
+        self.assertLess(time.time() - start, 2)
+        self.assertFalse(self.client.online)
+
+    def testWriteThreadSleepsWhileClosing(self):
+        # disconnected while the client closes, no reconnect will happen
+        self.client.connected[''] = False
+        self.client.expect_close = True
+
+        checks = []
+        is_connected = self.client.is_connected
+        self.client.is_connected = lambda channel: checks.append(channel) or is_connected(channel)
+
+        writer = Thread(target=self.client.thread_write, args=[''])
+        writer.start()
+        time.sleep(0.2)
+
+        self.client.active = False
+        self.client.notify('')
+        writer.join(5)
+
+        self.assertFalse(writer.is_alive())
+        self.assertLess(len(checks), 10)
+
+    def testOutboxKeepsSessionAndSeq(self):
+        self.client.outbox_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.client.outbox_path)
+        self.client.acks[''] = True
+        self.client.sequence[''] = 0
+
+        self.client.start_outbox('')
+        self.client.send({'type': 'log', 'data': 'written'})
+        self.client.send({'type': 'log', 'data': 'queued'})
+        self.client.send_batch(self.client.queues[''].take(1), '')
+
+        # a new process, the server did not acknowledge anything
+        client = BackendClient({'host': 'localhost'}, None, logging.getLogger('aetros-test'))
+        client.outbox_path = self.client.outbox_path
+        client.queues[''] = MessageQueue()
+        client.queue_lock[''] = client.queues[''].lock
+        client.sequence[''] = 0
+        client.start_outbox('')
+
+        self.assertEqual(self.client.session, client.sessions[''])
+        self.assertEqual(1, client.sequence[''])
+        self.assertEqual([1, None], [m.get('_seq') for m in client.queues['']])
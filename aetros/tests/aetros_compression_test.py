@@ -0,0 +1,59 @@
+import os
+import unittest
+import zlib
+
+import msgpack
+
+from aetros.utils.compression import MessageCompressor
+
+
+def create_message(data, type='stream-blob', path='aetros/job/log.txt'):
+    packed = msgpack.packb({'type': type, 'path': path, 'data': data}, use_bin_type=True)
+
+    return {
+        '_id': 1,
+        'type': type,
+        'path': path,
+        '_data': packed,
+        '_total': len(packed),
+    }
+
+
+class TestMessageCompressor(unittest.TestCase):
+
+    def testCompressible(self):
+        compressor = MessageCompressor()
+        message = create_message(b'epoch,loss,accuracy\n' * 1000)
+        original = message['_data']
+
+        diff = compressor.compress(message)
+        self.assertTrue(diff < 0)
+        self.assertEqual('zlib', message['_compression'])
+
+        envelope = msgpack.unpackb(message['_data'], raw=False)
+        self.assertEqual('compressed', envelope['type'])
+        self.assertEqual(original, zlib.decompress(envelope['data']))
+
+        self.assertEqual(-diff, compressor.decompress(message))
+        self.assertEqual(original, message['_data'])
+
+    def testIncompressibleExtension(self):
+        compressor = MessageCompressor()
+        message = create_message(b'a' * 10000, type='store-blob', path='aetros/job/insights/x.jpg')
+
+        self.assertEqual(0, compressor.compress(message))
+        self.assertNotIn('_compression', message)
+        self.assertEqual(1, compressor.stats['raw'])
+
+    def testRandomDataStaysRaw(self):
+        compressor = MessageCompressor()
+        compressor.resample_interval = 3
+
+        for i in range(5):
+            message = create_message(os.urandom(20000), type='store-blob', path='weights.h5')
+            self.assertEqual(0, compressor.compress(message))
+
+        # measured on the first and fourth message, the others are skipped
+        self.assertEqual(5, compressor.stats['raw'])
+        self.assertEqual(1, compressor.skipped[('store-blob', '.h5')])
+        self.assertEqual(0, compressor.stats['bytes_saved'])
@@ -0,0 +1,96 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from aetros.git_batch import CatFile, parse_commit
+
+
+class TestGitBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git(['init', '-q', '--bare'])
+        self.cat_file = CatFile(self.dir)
+
+    def tearDown(self):
+        self.cat_file.close()
+        shutil.rmtree(self.dir)
+
+    def git(self, args, data=None):
+        env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b', GIT_COMMITTER_NAME='a',
+                   GIT_COMMITTER_EMAIL='a@b', GIT_INDEX_FILE=self.dir + '/index')
+        p = subprocess.Popen(['git', '--bare', '--git-dir', self.dir] + args, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, env=env)
+        out, err = p.communicate(data)
+
+        return out.decode('utf-8').strip()
+
+    def commit(self, files, parent=None):
+        for path, content in files.items():
+            blob = self.git(['hash-object', '-w', '--stdin'], content)
+            self.git(['update-index', '--add', '--cacheinfo', '100644', blob, path])
+
+        tree = self.git(['write-tree'])
+        args = ['commit-tree', tree, '-m', 'test']
+        if parent:
+            args += ['-p', parent]
+
+        commit = self.git(args)
+        self.git(['update-ref', 'refs/heads/job', commit])
+
+        return commit
+
+    def testReadAndCheck(self):
+        first = self.commit({'a.txt': b'hello'})
+        self.assertEqual(('blob', b'hello'), self.cat_file.read('refs/heads/job:a.txt'))
+        self.assertEqual((None, None), self.cat_file.read('refs/heads/job:missing.txt'))
+        self.assertIsNone(self.cat_file.check('refs/heads/job:missing.txt'))
+
+        # objects and refs written after the process started are visible
+        second = self.commit({'b.txt': b'world\n'}, first)
+        sha, object_type, size = self.cat_file.check('refs/heads/job:b.txt')
+        self.assertEqual(('blob', 6), (object_type, size))
+
+        checks = self.cat_file.check_many([second, 'refs/heads/job:nope', 'refs/heads/job:a.txt'])
+        self.assertEqual([second, 'commit'], list(checks[0][:2]))
+        self.assertIsNone(checks[1])
+        self.assertEqual(('blob', 5), checks[2][1:])
+
+        object_type, content = self.cat_file.read(second)
+        tree, parents = parse_commit(content)
+        self.assertEqual('commit', object_type)
+        self.assertEqual([first], parents)
+        self.assertEqual(self.git(['rev-parse', second + '^{tree}']), tree)
+
+    def testReadHead(self):
+        self.commit({'a.txt': b'x' * 100000, 'b.txt': b'short'})
+
+        self.assertEqual(('blob', b'xxxx'), self.cat_file.read_head('refs/heads/job:a.txt', 4))
+        self.assertEqual(('blob', b'short'), self.cat_file.read_head('refs/heads/job:b.txt', 100))
+        self.assertEqual((None, None), self.cat_file.read_head('refs/heads/job:missing.txt', 4))
+
+        # the skipped rest does not end up in the next response
+        self.assertEqual(('blob', b'short'), self.cat_file.read('refs/heads/job:b.txt'))
+
+    def testWalkTreeLikeLsTree(self):
+        files = dict(('dir%d/sub/file %d.txt' % (i % 3, i), str(i).encode('utf-8')) for i in range(200))
+        files['top.txt'] = b''
+        commit = self.commit(files)
+        tree = self.git(['rev-parse', commit + '^{tree}'])
+
+        expected = set()
+        for line in self.git(['ls-tree', '-r', '-t', tree]).splitlines():
+            meta, path = line.split('\t')
+            expected.add((meta.split(' ')[2], path))
+
+        walked = set((sha, path) for mode, sha, path in self.cat_file.walk_tree(tree))
+        self.assertEqual(expected, walked)
+
+        blobs = list(self.cat_file.walk_tree(tree, trees=False))
+        self.assertEqual(201, len(blobs))
+
+        skipped = self.git(['rev-parse', commit + ':dir0'])
+        paths = [path for mode, sha, path in self.cat_file.walk_tree(tree, skip=lambda sha: sha == skipped)]
+        self.assertFalse([path for path in paths if path.startswith('dir0')])
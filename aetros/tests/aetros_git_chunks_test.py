@@ -0,0 +1,74 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+import six
+
+from aetros.git_batch import CatFile
+from aetros.git_chunks import content_chunks, write_chunked, read_manifest, write_chunks, checkout_chunked, \
+    parse_manifest
+from aetros.git_writer import TreeBuilder, write_object, serialize_commit, signature
+
+
+class TestGitChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git_dir = os.path.join(self.dir, 'job.git')
+        subprocess.check_call(['git', 'init', '-q', '--bare', self.git_dir])
+        self.cat_file = CatFile(self.git_dir)
+
+    def tearDown(self):
+        self.cat_file.close()
+        shutil.rmtree(self.dir)
+
+    def chunks(self, data):
+        return list(content_chunks(six.BytesIO(data), min_size=16 * 1024, bits=14, max_size=64 * 1024,
+                                   read_size=100 * 1024))
+
+    def testContentDefined(self):
+        # fixed data, with some random ones an insertion changes a third chunk before the cuts resynchronize
+        data = np.random.RandomState(0).bytes(2 * 1024 * 1024)
+        chunks = self.chunks(data)
+
+        self.assertEqual(data, b''.join(chunks))
+        self.assertTrue(all(16 * 1024 <= len(chunk) <= 64 * 1024 for chunk in chunks[:-1]))
+
+        # an insertion shifts everything behind it, but changes only the chunk around it
+        changed = self.chunks(data[:1000000] + b'inserted' + data[1000000:])
+        self.assertLessEqual(len(set(changed) - set(chunks)), 2)
+
+        # no cut points at all, cut at max_size
+        self.assertEqual([64 * 1024] * 4, [len(chunk) for chunk in self.chunks(b'\0' * 256 * 1024)])
+
+    def testStoreAndCheckout(self):
+        data = os.urandom(3 * 1024 * 1024)
+        manifest, tree = write_chunked(self.git_dir, six.BytesIO(data))
+        self.assertEqual(len(data), parse_manifest(manifest)['size'])
+
+        builder = TreeBuilder(self.git_dir, self.cat_file)
+        builder.set('aetros/weights/latest.hdf5', '100644', write_object(self.git_dir, 'blob', manifest))
+        builder.set('aetros/weights/latest.hdf5.chunks', '40000', tree)
+        builder.set('aetros/job.json', '100644', write_object(self.git_dir, 'blob', b'{}'))
+
+        author = signature('a', 'a@b')
+        commit = write_object(self.git_dir, 'commit', serialize_commit(builder.write(), [], author, author, 'test'))
+
+        out = six.BytesIO()
+        write_chunks(self.cat_file, read_manifest(self.cat_file, commit + ':aetros/weights/latest.hdf5'), out)
+        self.assertEqual(data, out.getvalue())
+        self.assertIsNone(read_manifest(self.cat_file, commit + ':aetros/job.json'))
+
+        target = os.path.join(self.dir, 'checkout')
+        os.makedirs(target)
+        subprocess.check_call(['git', '--bare', '--git-dir', self.git_dir, '--work-tree', target, 'checkout', commit,
+                               '--', '.'])
+        checkout_chunked(self.cat_file, commit, target)
+
+        with open(os.path.join(target, 'aetros/weights/latest.hdf5'), 'rb') as f:
+            self.assertEqual(data, f.read())
+
+        self.assertEqual(['latest.hdf5'], os.listdir(os.path.join(target, 'aetros/weights')))
@@ -0,0 +1,92 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from aetros.git import DeltaHeuristic, pack_objects_command
+
+
+class TestGitDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git(['init', '-q', '--bare', 'job.git'])
+        self.git(['init', '-q', '--bare', 'server.git'])
+        self.job = os.path.join(self.dir, 'job.git')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def git(self, args, data=None):
+        env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b', GIT_COMMITTER_NAME='a',
+                   GIT_COMMITTER_EMAIL='a@b', GIT_INDEX_FILE=self.dir + '/index')
+        p = subprocess.Popen(['git'] + args, cwd=self.dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, env=env)
+        out, err = p.communicate(data)
+        self.assertEqual(0, p.returncode, err)
+
+        return out
+
+    def commit(self, content, parent=None):
+        blob = self.git(['--git-dir', 'job.git', 'hash-object', '-w', '--stdin'], content).decode('utf-8').strip()
+        self.git(['--git-dir', 'job.git', 'update-index', '--add', '--cacheinfo', '100644', blob, 'weights.hdf5'])
+        tree = self.git(['--git-dir', 'job.git', 'write-tree']).decode('utf-8').strip()
+
+        args = ['--git-dir', 'job.git', 'commit-tree', tree, '-m', 'epoch']
+        if parent:
+            args += ['-p', parent]
+
+        return self.git(args).decode('utf-8').strip(), blob
+
+    def pack(self, head, parent, bases):
+        revisions = head + ('\n^' + parent if parent else '')
+        lines = self.git(['--git-dir', 'job.git', 'rev-list', '--objects', '--stdin'], revisions.encode('ascii'))
+
+        shas = []
+        paths = {}
+        for line in lines.decode('utf-8').splitlines():
+            shas.append(line[:40])
+            if line[41:] == 'weights.hdf5':
+                paths[line[:40]] = line[41:]
+
+        command, pack_input = pack_objects_command(self.job, shas, paths, bases)
+
+        return self.git(command[1:], pack_input.encode('utf-8'))
+
+    def testThinPack(self):
+        frozen = os.urandom(300 * 1024)
+        first, first_blob = self.commit(frozen + os.urandom(50 * 1024))
+        second, second_blob = self.commit(frozen + os.urandom(50 * 1024), first)
+
+        self.git(['--git-dir', 'server.git', 'unpack-objects', '-q'], self.pack(first, None, None))
+
+        full = self.pack(second, first, None)
+        thin = self.pack(second, first, [first])
+        self.assertLess(len(thin), len(full) / 2)
+
+        self.git(['--git-dir', 'server.git', 'unpack-objects', '-q'], thin)
+        self.assertEqual(b'blob\n', self.git(['--git-dir', 'server.git', 'cat-file', '-t', second_blob]))
+
+    def testHeuristic(self):
+        heuristic = DeltaHeuristic()
+
+        self.assertFalse(heuristic.use_delta([('a.json', 1024)], True))
+        self.assertFalse(heuristic.use_delta([('weights.hdf5', 1024 * 1024)], False))
+        self.assertTrue(heuristic.use_delta([('weights.hdf5', 1024 * 1024)], True))
+        self.assertFalse(heuristic.use_delta([('weights.hdf5', 1024 * 1024 * 1024)], True))
+
+        # several versions of one file in the pack
+        self.assertTrue(heuristic.use_delta([('weights.hdf5', 1024 * 1024), ('weights.hdf5', 1024 * 1024)], False))
+
+        # no saving: skips the next 2 pushes, then tries again
+        heuristic.record(1024 * 1024, 1024 * 1024)
+        self.assertFalse(heuristic.use_delta([('weights.hdf5', 1024 * 1024)], True))
+        self.assertFalse(heuristic.use_delta([('weights.hdf5', 1024 * 1024)], True))
+        self.assertTrue(heuristic.use_delta([('weights.hdf5', 1024 * 1024)], True))
+
+        heuristic.record(1024 * 1024, 1024 * 1024)
+        self.assertEqual(4, heuristic.skip)
+
+        heuristic.record(100 * 1024, 1024 * 1024)
+        self.assertEqual(0, heuristic.misses)
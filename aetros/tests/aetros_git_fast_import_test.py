@@ -0,0 +1,66 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from aetros.git_fast_import import FastImport
+from aetros.git_writer import read_ref, signature
+
+
+class TestGitFastImport(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git(['init', '-q', '--bare'])
+        self.fast_import = FastImport(self.dir)
+        self.author = signature('a', 'a@b')
+
+    def tearDown(self):
+        self.fast_import.close()
+        shutil.rmtree(self.dir)
+
+    def git(self, args, data=None):
+        env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b', GIT_COMMITTER_NAME='a',
+                   GIT_COMMITTER_EMAIL='a@b')
+        p = subprocess.Popen(['git', '--bare', '--git-dir', self.dir] + args, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, env=env)
+        out, err = p.communicate(data)
+
+        return out.decode('utf-8').strip()
+
+    def commit(self, changes, message='test'):
+        return self.fast_import.commit('refs/aetros/job/abc', changes, message, self.author, self.author)
+
+    def testCommitAndCheckpoint(self):
+        first = self.commit([('100644', b'{}', 'aetros/job.json')], 'JOB_CREATED\n')
+        second = self.commit([('100644', 'a\nb', 'aetros/job/log.txt')])
+
+        # not visible before the checkpoint
+        self.assertIsNone(read_ref(self.dir, 'refs/aetros/job/abc'))
+
+        self.fast_import.checkpoint()
+        self.assertEqual(second, read_ref(self.dir, 'refs/aetros/job/abc'))
+        self.assertEqual(first, self.git(['rev-parse', second + '^']))
+        self.assertEqual('a\nb', self.git(['cat-file', '-p', second + ':aetros/job/log.txt']))
+        self.assertEqual('{}', self.git(['cat-file', '-p', second + ':aetros/job.json']))
+        self.assertEqual('JOB_CREATED', self.git(['log', '-1', '--format=%B', first]))
+
+        blob = self.git(['hash-object', '-w', '--stdin'], b'weights')
+        third = self.commit([('100644', blob, 'aetros/weights/latest.hdf5', True)])
+        self.fast_import.checkpoint()
+        self.assertEqual('weights', self.git(['cat-file', '-p', third + ':aetros/weights/latest.hdf5']))
+
+    def testContinuesOnCommitsOfOthers(self):
+        first = self.commit([('100644', b'1', 'a.txt')])
+        self.fast_import.checkpoint()
+
+        tree = self.git(['rev-parse', first + '^{tree}'])
+        other = self.git(['commit-tree', tree, '-p', first, '-m', 'other process'])
+        self.git(['update-ref', 'refs/aetros/job/abc', other])
+
+        mine = self.commit([('100644', b'2', 'b.txt')])
+        self.fast_import.checkpoint()
+
+        self.assertEqual(mine, read_ref(self.dir, 'refs/aetros/job/abc'))
+        self.assertEqual(other, self.git(['rev-parse', mine + '^']))
@@ -0,0 +1,179 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import aetros.git
+from aetros.git import Git
+from aetros.git_writer import update_ref, write_object
+
+
+class FakeClient(object):
+    """
+    Stands in for the BackendClient of Git.push, sent messages stay queued until marked as sent.
+    """
+
+    def __init__(self, acks=False, thin=False, parts=True):
+        self.online = True
+        self.acks = {'files': acks}
+        self.thin = {'files': thin}
+        self.parts = {'files': parts}
+        self.messages = []
+        self.queue_space_waits = 0
+
+    def send(self, message, channel='', important=False):
+        message = dict(message, _channel=channel, _sent=False)
+        self.messages.append(message)
+
+        return len(message.get('pack') or b'')
+
+    def wait_for_queue_space(self, channel, max_bytes):
+        self.queue_space_waits += 1
+
+    def queue_tails(self, channel):
+        return [m for m in self.messages if m['_channel'] == channel][-1:]
+
+    def sent(self):
+        for message in self.messages:
+            message['_sent'] = True
+
+
+class TestGitPush(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.client = FakeClient()
+
+        config = {'host': 'localhost', 'storage_dir': self.dir, 'ssh': 'ssh', 'ssh_port': 22, 'ssh_key_base64': None}
+        self.git = Git(logging.getLogger('aetros-test'), self.client, config, 'model', True)
+        self.git.job_id = 'job'
+
+    def tearDown(self):
+        self.git.cat_file.close()
+        self.git.delete_git_ssh()
+        shutil.rmtree(self.dir)
+
+    def commit(self):
+        tree = write_object(self.git.git_path, 'tree', b'')
+        commit = self.git.write_commit(tree, [], 'test')
+        update_ref(self.git.git_path, self.git.ref_head, commit)
+
+        return commit
+
+    def testFrontierStoredOnceWritten(self):
+        self.git.get_synced_commits()
+        self.git.synced_commits = set(['a' * 40])
+        self.client.send({'type': 'git-unpack-objects', 'pack': b'pack'}, 'files')
+        self.git.pack_tails = self.client.queue_tails('files')
+
+        self.git.store_written_commits()
+        self.assertFalse(os.path.exists(self.git.synced_path))
+
+        self.client.sent()
+        self.git.store_written_commits()
+        with open(self.git.synced_path) as f:
+            self.assertEqual('a' * 40 + '\n', f.read())
+
+    def testUnconfirmedPendingOnlyWithAcks(self):
+        self.git.last_synced_head = self.commit()
+        self.git.get_synced_commits()
+        self.git.synced_commits = set([self.git.last_synced_head])
+        self.client.send({'type': 'git-unpack-objects', 'pack': b'pack'}, 'files')
+        self.git.pack_tails = self.client.queue_tails('files')
+
+        # a server without acks never confirms anything, so there is nothing to check again
+        self.assertFalse(self.git.sync_head())
+
+        self.client.acks['files'] = True
+        self.assertTrue(self.git.sync_head())
+
+        self.client.sent()
+        self.assertFalse(self.git.sync_head())
+
+    def testCompleteObjectsWithoutThinCapability(self):
+        self.git.delta_mode = 'always'
+        self.git.confirmed_commits = set([self.commit()])
+        blob = write_object(self.git.git_path, 'blob', b'content')
+        summary = {'commits': [], 'trees': [], 'files': [[blob, 'a.txt']]}
+
+        self.assertEqual((None, 0), self.git.pack_bases(summary))
+
+        self.client.thin['files'] = True
+        bases, blob_bytes = self.git.pack_bases(summary)
+        self.assertEqual(sorted(self.git.confirmed_commits), bases)
+        self.assertEqual(7, blob_bytes)
+
+    def pack_summary(self, count, size):
+        blobs = [write_object(self.git.git_path, 'blob', os.urandom(size)) for i in range(count)]
+
+        return blobs, {'commits': [], 'trees': [], 'files': [[blob, 'f%d' % i] for i, blob in enumerate(blobs)]}
+
+    def testPackSentInParts(self):
+        self.git.pack_chunk_size = 1000
+        blobs, summary = self.pack_summary(3, 1000)
+
+        total = self.git.send_pack('c' * 40, blobs, summary)
+
+        parts = self.client.messages
+        self.assertGreater(len(parts), 3)
+        self.assertEqual(list(range(len(parts))), [m['part'] for m in parts])
+        self.assertEqual([False] * (len(parts) - 1) + [True], [m['last'] for m in parts])
+        self.assertEqual([summary] + [None] * (len(parts) - 1), [m['objects'] for m in parts])
+        self.assertTrue(all(len(m['pack']) == 1000 for m in parts[:-1]))
+        self.assertEqual(len(parts), self.client.queue_space_waits)
+
+        # all parts share the upload progress
+        upload = parts[0]['upload']
+        self.assertTrue(all(m['upload'] is upload for m in parts))
+        self.assertEqual(len(parts), upload['parts'])
+        self.assertEqual(total, upload['total'])
+        self.assertTrue(upload['complete'])
+
+        # the parts together are the pack
+        pack = b''.join(m['pack'] for m in parts)
+        self.assertEqual(len(pack), total)
+        server = os.path.join(self.dir, 'server.git')
+        subprocess.check_call(['git', 'init', '-q', '--bare', server])
+        p = subprocess.Popen(['git', '--git-dir', server, 'unpack-objects', '-q'], stdin=subprocess.PIPE)
+        p.communicate(pack)
+        self.assertEqual(0, p.returncode)
+
+    def testSmallPackInOneMessage(self):
+        blobs, summary = self.pack_summary(1, 100)
+
+        self.git.send_pack('c' * 40, blobs, summary)
+
+        self.assertEqual(1, len(self.client.messages))
+        self.assertNotIn('part', self.client.messages[0])
+        self.assertEqual(summary, self.client.messages[0]['objects'])
+
+    def testWholePackWithoutPartsCapability(self):
+        self.client.parts['files'] = False
+        self.git.pack_chunk_size = 1000
+        blobs, summary = self.pack_summary(3, 1000)
+
+        total = self.git.send_pack('c' * 40, blobs, summary)
+
+        self.assertEqual(1, len(self.client.messages))
+        self.assertNotIn('part', self.client.messages[0])
+        self.assertEqual(total, len(self.client.messages[0]['pack']))
+
+    def testFailedPackObjects(self):
+        self.git.pack_chunk_size = 100
+        blobs, summary = self.pack_summary(1, 100)
+
+        pack_objects_command = aetros.git.pack_objects_command
+        # writes a few parts before it fails
+        aetros.git.pack_objects_command = lambda *args: (['sh', '-c', 'head -c 350 /dev/zero; exit 1'], '')
+        try:
+            self.assertIsNone(self.git.send_pack('c' * 40, blobs, summary))
+        finally:
+            aetros.git.pack_objects_command = pack_objects_command
+
+        parts = self.client.messages
+        self.assertEqual([0, 1, 2], [m['part'] for m in parts[:-1]])
+        self.assertFalse(any(m['last'] for m in parts[:-1]))
+        self.assertEqual({'part': 3, 'last': True, 'failed': True, 'pack': b''},
+                         dict((key, parts[-1][key]) for key in ['part', 'last', 'failed', 'pack']))
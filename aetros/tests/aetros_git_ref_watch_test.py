@@ -0,0 +1,37 @@
+import shutil
+import subprocess
+import tempfile
+import unittest
+from threading import Event
+
+from aetros.git_ref_watch import RefWatch, load_libc
+from aetros.git_writer import write_object, update_ref
+
+
+@unittest.skipUnless(load_libc(), 'inotify not available')
+class TestGitRefWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        subprocess.check_call(['git', 'init', '-q', '--bare', self.dir])
+        self.changed = Event()
+        self.watch = RefWatch(self.dir, 'refs/aetros/job/abc', self.changed.set)
+        self.assertTrue(self.watch.start())
+
+    def tearDown(self):
+        self.watch.close()
+        shutil.rmtree(self.dir)
+
+    def testRefUpdates(self):
+        blob = write_object(self.dir, 'blob', b'a')
+
+        update_ref(self.dir, 'refs/aetros/job/other', blob)
+        self.assertFalse(self.changed.wait(0.2))
+
+        update_ref(self.dir, 'refs/aetros/job/abc', blob)
+        self.assertTrue(self.changed.wait(5))
+
+        # writes of other processes
+        self.changed.clear()
+        subprocess.check_call(['git', '--git-dir', self.dir, 'pack-refs', '--all'])
+        self.assertTrue(self.changed.wait(5))
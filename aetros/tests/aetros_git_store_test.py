@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from aetros.git_store import StoreFiles
+
+
+class TestGitStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store_files = StoreFiles(self.dir, interval=60)
+
+    def tearDown(self):
+        self.store_files.close()
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        with open(os.path.join(self.dir, path), 'rb') as f:
+            return f.read()
+
+    def testBatchedWrites(self):
+        self.assertTrue(self.store_files.set('aetros/job/info/elapsed.json', b'1'))
+        self.assertFalse(self.store_files.set('aetros/job/info/elapsed.json', b'1'))
+        self.assertTrue(self.store_files.set('aetros/job/info/elapsed.json', b'2'))
+
+        # nothing written before the timer or close()
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'aetros')))
+
+        self.store_files.write()
+        self.assertEqual(b'2', self.read('aetros/job/info/elapsed.json'))
+
+        self.store_files.set('aetros/job/info/elapsed.json', b'3')
+        self.store_files.set('aetros/job/channel/loss/last.csv', b'1,0.5\n')
+        self.store_files.close()
+        self.assertEqual(b'3', self.read('aetros/job/info/elapsed.json'))
+        self.assertEqual(b'1,0.5\n', self.read('aetros/job/channel/loss/last.csv'))
+
+        self.assertEqual([('aetros/job/channel/loss/last.csv', b'1,0.5\n'), ('aetros/job/info/elapsed.json', b'3')],
+                         sorted(self.store_files.items()))
+
+        self.store_files.remove('aetros/job/info/elapsed.json')
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'aetros/job/info/elapsed.json')))
+        self.assertEqual(1, len(self.store_files.items()))
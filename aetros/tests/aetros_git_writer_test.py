@@ -0,0 +1,93 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from aetros.git_batch import CatFile
+from aetros.git_writer import TreeBuilder, write_object, serialize_commit, signature, read_ref, update_ref
+
+
+class TestGitWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git(['init', '-q', '--bare'])
+        self.cat_file = CatFile(self.dir)
+
+    def tearDown(self):
+        self.cat_file.close()
+        shutil.rmtree(self.dir)
+
+    def git(self, args, data=None, env=None):
+        full_env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b', GIT_COMMITTER_NAME='a',
+                        GIT_COMMITTER_EMAIL='a@b', GIT_INDEX_FILE=self.dir + '/index')
+        full_env.update(env or {})
+        p = subprocess.Popen(['git', '--bare', '--git-dir', self.dir] + args, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, env=full_env)
+        out, err = p.communicate(data)
+
+        return out.decode('utf-8').strip()
+
+    def testBlobAndTreeLikeGit(self):
+        files = {
+            'a.b': b'1',
+            'a/x.txt': b'2',
+            'a-b/y': b'3',
+            'aetros/job/info.json': b'{}',
+            'aetros/job.json': b'{"a": 1}',
+            'empty': b'',
+        }
+
+        builder = TreeBuilder(self.dir, self.cat_file)
+        for path, content in files.items():
+            sha = write_object(self.dir, 'blob', content)
+            self.assertEqual(self.git(['hash-object', '--stdin'], content), sha)
+            self.git(['update-index', '--add', '--cacheinfo', '100644', sha, path])
+            builder.set(path, '100644', sha)
+
+        tree = builder.write()
+        self.assertEqual(self.git(['write-tree']), tree)
+        self.assertEqual('', self.git(['fsck', '--strict', '--no-dangling']))
+
+        # changing one file rewrites only the trees on its path
+        commit = self.git(['commit-tree', tree, '-m', 'first'])
+        builder = TreeBuilder(self.dir, self.cat_file)
+        builder.load(commit)
+        sha = write_object(self.dir, 'blob', b'changed')
+        builder.set('aetros/job/info.json', '100644', sha)
+        self.git(['update-index', '--cacheinfo', '100644', sha, 'aetros/job/info.json'])
+
+        self.assertEqual(self.git(['write-tree']), builder.write())
+        self.assertIsNone(builder.root.entries['a'].entries)
+
+    def testCommitLikeGit(self):
+        tree = write_object(self.dir, 'tree', b'')
+        timestamp = int(time.time())
+        identity = {
+            'GIT_AUTHOR_NAME': 'peter', 'GIT_AUTHOR_EMAIL': 'peter@example.com',
+            'GIT_COMMITTER_NAME': 'peter', 'GIT_COMMITTER_EMAIL': 'peter@example.com',
+            'GIT_AUTHOR_DATE': '@%d' % timestamp, 'GIT_COMMITTER_DATE': '@%d' % timestamp,
+        }
+
+        first = self.git(['commit-tree', tree], b'JOB_CREATED\n', env=identity)
+        second = self.git(['commit-tree', tree, '-p', first], b'STATUS 1\n\nno newline', env=identity)
+
+        author = signature('peter', 'peter@example.com', timestamp)
+        self.assertEqual(first, write_object(self.dir, 'commit', serialize_commit(tree, [], author, author,
+                                                                                  'JOB_CREATED\n')))
+        self.assertEqual(second, write_object(self.dir, 'commit', serialize_commit(tree, [first], author, author,
+                                                                                   'STATUS 1\n\nno newline')))
+
+    def testRefs(self):
+        tree = write_object(self.dir, 'tree', b'')
+        commit = self.git(['commit-tree', tree, '-m', 'x'])
+        self.assertIsNone(read_ref(self.dir, 'refs/aetros/job/abc'))
+
+        update_ref(self.dir, 'refs/aetros/job/abc', commit)
+        self.assertEqual(commit, read_ref(self.dir, 'refs/aetros/job/abc'))
+        self.assertEqual(commit, self.git(['rev-parse', 'refs/aetros/job/abc']))
+
+        self.git(['pack-refs', '--all'])
+        self.assertEqual(commit, read_ref(self.dir, 'refs/aetros/job/abc'))
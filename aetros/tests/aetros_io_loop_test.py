@@ -0,0 +1,121 @@
+import os
+import time
+import unittest
+from threading import Event
+
+from aetros.io_loop import IOLoop, get_io_loop
+
+
+class TestIOLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+
+    def testCallLaterAndCancel(self):
+        called = Event()
+        cancelled = []
+
+        self.io_loop.call_later(0.01, called.set)
+        call = self.io_loop.call_later(0.01, cancelled.append, 1)
+        call.cancel()
+
+        self.assertTrue(called.wait(5))
+        time.sleep(0.05)
+        self.assertEqual([], cancelled)
+
+    def testEveryBlocking(self):
+        calls = []
+
+        def tick():
+            calls.append(self.io_loop.in_loop())
+            if len(calls) == 2:
+                raise Exception('a failing call does not stop the next ones')
+
+        periodic = self.io_loop.every(0.01, tick, blocking=True)
+        start = time.time()
+        while len(calls) < 4 and time.time() - start < 5:
+            time.sleep(0.01)
+
+        periodic.cancel()
+        self.assertTrue(periodic.join(5))
+        count = len(calls)
+        time.sleep(0.05)
+
+        self.assertGreaterEqual(count, 4)
+        self.assertEqual(count, len(calls))
+        # blocking calls run in the worker pool, not in the loop thread
+        self.assertFalse(any(calls))
+
+    def testReader(self):
+        read, write = os.pipe()
+        received = []
+        done = Event()
+
+        class Pipe(object):
+            def fileno(self):
+                return read
+
+        pipe = Pipe()
+
+        def on_readable():
+            chunk = os.read(read, 1024)
+            received.append(chunk)
+            if chunk == b'':
+                self.io_loop.remove_reader(pipe)
+                done.set()
+
+        self.io_loop.add_reader(pipe, on_readable)
+        os.write(write, b'hello')
+        os.close(write)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(b'hello', b''.join(received))
+        os.close(read)
+
+    def testBlockingCallLater(self):
+        calls = []
+        called = Event()
+
+        def call():
+            calls.append(self.io_loop.in_loop())
+            called.set()
+
+        self.io_loop.call_later(0.01, call, blocking=True)
+
+        self.assertTrue(called.wait(5))
+        self.assertEqual([False], calls)
+
+    def testBlockingReader(self):
+        read, write = os.pipe()
+        received = []
+        in_loop = []
+        done = Event()
+
+        class Pipe(object):
+            def fileno(self):
+                return read
+
+        pipe = Pipe()
+
+        def on_readable():
+            in_loop.append(self.io_loop.in_loop())
+            # a slow callback is not called again for the same data meanwhile
+            time.sleep(0.01)
+            chunk = os.read(read, 2)
+            received.append(chunk)
+            if chunk == b'':
+                self.io_loop.remove_reader(pipe)
+                done.set()
+
+        self.io_loop.add_reader(pipe, on_readable, blocking=True)
+        os.write(write, b'hello')
+        os.close(write)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([b'he', b'll', b'o', b''], received)
+        self.assertFalse(any(in_loop))
+        os.close(read)
+
+    def testConfig(self):
+        self.assertIsNone(get_io_loop({'io_core': 'threads'}))
+        self.assertIs(get_io_loop({'io_core': 'asyncio'}), get_io_loop({'io_core': 'asyncio'}))
@@ -0,0 +1,208 @@
+import unittest
+
+import msgpack
+
+from aetros.message_queue import MessageQueue
+
+
+def create_message(id, type='stream-blob', path='aetros/job/log.txt', total=10):
+    return {
+        '_id': id,
+        'type': type,
+        'path': path,
+        '_data': b'x' * total,
+        '_total': total,
+        '_bytes_sent': 0,
+        '_sending': False,
+        '_sent': False,
+    }
+
+
+def create_stream_blob(id, data, path='aetros/job/log.txt'):
+    packed = msgpack.packb({'type': 'stream-blob', 'path': path, 'data': data})
+
+    return {
+        '_id': id,
+        'type': 'stream-blob',
+        'path': path,
+        '_chunks': [data],
+        '_data': packed,
+        '_total': len(packed),
+        '_bytes_sent': 0,
+        '_sending': False,
+        '_sent': False,
+    }
+
+
+class TestMessageQueue(unittest.TestCase):
+
+    def testPriorityLane(self):
+        queue = MessageQueue()
+        queue.append(create_message(1))
+        queue.append(create_message(2), important=True)
+        queue.append(create_message(3))
+        queue.append(create_message(4), important=True)
+
+        self.assertEqual([2, 4, 1, 3], [m['_id'] for m in queue])
+        self.assertEqual(4, len(queue))
+        self.assertEqual(40, queue.bytes)
+
+    def testTakeAndRemoveSent(self):
+        queue = MessageQueue()
+        for i in range(5):
+            queue.append(create_message(i, total=10))
+
+        messages = queue.take(25)
+        self.assertEqual([0, 1], [m['_id'] for m in messages])
+        self.assertTrue(all(m['_sending'] for m in messages))
+
+        # first message is always taken
+        queue.append(create_message(5, total=100), important=True)
+        messages[0]['_sent'] = True
+        messages[1]['_sent'] = True
+        queue.remove_sent()
+
+        self.assertEqual([5, 2, 3, 4], [m['_id'] for m in queue])
+        self.assertEqual([5], [m['_id'] for m in queue.take(25)])
+        self.assertEqual(130, queue.bytes)
+
+    def testStoreBlobLastWriteWins(self):
+        queue = MessageQueue()
+        first = create_message(1, type='store-blob', path='aetros/job/times/elapsed.json', total=5)
+        queue.append(first)
+        queue.append(create_message(2))
+
+        newer = create_message(3, type='store-blob', path='aetros/job/times/elapsed.json', total=8)
+        self.assertIs(first, queue.append(newer))
+        self.assertEqual(2, len(queue))
+        self.assertEqual(18, queue.bytes)
+        self.assertEqual(b'x' * 8, first['_data'])
+
+        # once taken, it can't be superseded anymore
+        queue.take(100)
+        newest = create_message(4, type='store-blob', path='aetros/job/times/elapsed.json', total=3)
+        self.assertIs(newest, queue.append(newest))
+        self.assertEqual(3, len(queue))
+
+    def testNeverSupersededWithSeq(self):
+        queue = MessageQueue()
+        replayed = create_message(1, type='store-blob', path='aetros/job/times/elapsed.json', total=5)
+        # written by a previous process, the server might have processed it
+        replayed['_seq'] = 7
+        queue.append(replayed)
+
+        newer = create_message(2, type='store-blob', path='aetros/job/times/elapsed.json', total=8)
+        self.assertIs(newer, queue.append(newer))
+        self.assertEqual(b'x' * 5, replayed['_data'])
+
+        stream = create_stream_blob(3, b'line 1\n')
+        stream['_seq'] = 8
+        queue.append(stream)
+        self.assertIsNot(stream, queue.append(create_stream_blob(4, b'line 2\n')))
+        self.assertEqual([b'line 1\n'], stream['_chunks'])
+
+    def testStoreBlobBarrier(self):
+        queue = MessageQueue()
+        first = create_message(1, type='store-blob', path='a')
+        queue.append(first)
+        queue.append(create_message(2, type='sync-blob'))
+
+        second = create_message(3, type='store-blob', path='a')
+        self.assertIs(second, queue.append(second))
+
+    def testTracked(self):
+        queue = MessageQueue()
+        queue.append(create_message(1, type='store-blob', path='a'))
+        queue.append(create_message(2))
+        queue.append(create_message(3, type='git-unpack-objects'))
+
+        self.assertEqual([1, 3], [m['_id'] for m in queue.tracked_messages()])
+
+        for message in queue.take(100):
+            message['_sent'] = True
+        queue.remove_sent()
+
+        self.assertEqual([], queue.tracked_messages())
+        self.assertEqual(0, len(queue))
+        self.assertEqual(0, queue.bytes)
+
+    def testTails(self):
+        queue = MessageQueue()
+        self.assertEqual([], queue.tails())
+
+        queue.append(create_message(1))
+        queue.append(create_message(2), important=True)
+        queue.append(create_message(3))
+
+        self.assertEqual([2, 3], [m['_id'] for m in queue.tails()])
+
+    def testStreamBlobMerge(self):
+        queue = MessageQueue()
+        first = queue.append(create_stream_blob(1, b'line 1\n'))
+        queue.append(create_stream_blob(2, b'other\n', path='aetros/job/other.txt'))
+        self.assertIs(first, queue.append(create_stream_blob(3, b'line 2\n')))
+
+        # replayed from the outbox with several chunks
+        replayed = create_stream_blob(5, b'line 3\n')
+        replayed['_chunks'].append(b'line 4\n')
+        self.assertIs(first, queue.append(replayed))
+
+        # not merged into a message that is already being sent
+        messages = queue.take(1024)
+        self.assertEqual([1, 2], [m['_id'] for m in messages])
+        queue.append(create_stream_blob(4, b'line 5\n'))
+        self.assertEqual(3, len(queue))
+
+        data = msgpack.unpackb(first['_data'], raw=True)
+        self.assertEqual(b'line 1\nline 2\nline 3\nline 4\n', data[b'data'])
+        self.assertEqual(len(first['_data']), first['_total'])
+        self.assertEqual(sum(m['_total'] for m in queue), queue.bytes)
+
+    def testStreamBlobMaxSize(self):
+        queue = MessageQueue()
+        queue.stream_blob_max_size = 150
+        for i in range(10):
+            queue.append(create_stream_blob(i, b'x' * 30))
+
+        self.assertEqual(4, len(queue))
+        messages = queue.take(1024 * 1024)
+        self.assertEqual(300, sum(len(msgpack.unpackb(m['_data'], raw=True)[b'data']) for m in messages))
+        self.assertEqual(sum(m['_total'] for m in queue), queue.bytes)
+
+    def testAckAndRewind(self):
+        queue = MessageQueue()
+        for i in range(4):
+            queue.append(create_message(i, type='store-blob', path=str(i)))
+
+        messages = queue.take(25)
+        for seq, message in enumerate(messages, 1):
+            message['_seq'] = seq
+            message['_written'] = True
+        queue.written(messages)
+
+        self.assertEqual(2, queue.unacked)
+        self.assertEqual(2, queue.pending())
+        self.assertEqual([2, 3], [m['_id'] for m in queue.take(25)])
+
+        # written messages are not superseded anymore, the server might have processed them
+        queue.append(create_message(10, type='store-blob', path='1', total=20))
+        self.assertEqual(5, len(queue))
+
+        self.assertEqual([0], [m['_id'] for m in queue.ack(1)])
+        queue.remove_sent()
+        self.assertEqual(1, queue.unacked)
+
+        # connection broke, message 1 needs to be written again with the same seq
+        queue.rewind()
+        self.assertEqual(0, queue.unacked)
+        messages = queue.take(10)
+        self.assertEqual([1], [m['_id'] for m in messages])
+        self.assertEqual(2, messages[0]['_seq'])
+
+        # the ack can be faster than the write thread
+        messages[0]['_written'] = True
+        self.assertEqual([1], [m['_id'] for m in queue.ack(2)])
+        queue.written(messages)
+        queue.remove_sent()
+        self.assertEqual(0, queue.unacked)
+        self.assertEqual([2, 3, 10], [m['_id'] for m in queue])
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import msgpack
+
+from aetros.outbox import Outbox
+
+
+def create_message(id, data=b'payload', type='store-blob', path='aetros/job/status.json'):
+    return {
+        '_id': id,
+        'type': type,
+        'path': path,
+        '_data': data,
+        '_total': len(data),
+        '_bytes_sent': 0,
+        '_sending': False,
+        '_sent': False,
+    }
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def testReplay(self):
+        outbox = Outbox(self.path, fsync='always')
+        outbox.put(create_message(1, b'one'), False)
+        outbox.put(create_message(2, b'two'), True)
+        outbox.put(create_message(3, b'three'), False)
+        outbox.ack([create_message(2)])
+
+        stream = create_message(4, b'packed', type='stream-blob', path='log.txt')
+        stream['_chunks'] = [b'line 1\n']
+        outbox.put(stream, False)
+        outbox.append(stream, b'line 2\n')
+
+        # superseded
+        outbox.put(create_message(1, b'one again'), False)
+
+        messages = Outbox(self.path).replay()
+        self.assertEqual([b'one again', b'three'], [m['_data'] for m in messages[:2]])
+        self.assertEqual([b'line 1\n', b'line 2\n'], messages[2]['_chunks'])
+        self.assertEqual(b'line 1\nline 2\n', msgpack.unpackb(messages[2]['_data'], raw=True)[b'data'])
+        self.assertFalse(messages[0]['_important'])
+
+    def testSpillAndLoad(self):
+        outbox = Outbox(self.path, fsync='never')
+        message = create_message(1, b'x' * 1000)
+        outbox.put(message, False, spill=True)
+        self.assertIsNone(message['_data'])
+
+        outbox.load(message)
+        self.assertEqual(b'x' * 1000, message['_data'])
+
+    def testSegmentsRemovedWhenAcknowledged(self):
+        outbox = Outbox(self.path, segment_size=100)
+        messages = [create_message(i, b'x' * 80) for i in range(5)]
+        for message in messages:
+            outbox.put(message, False)
+
+        self.assertEqual(5, len(os.listdir(self.path)))
+
+        outbox.ack(messages[:3])
+        # the two pending ones plus the new segment holding the acks
+        self.assertEqual(3, len(os.listdir(self.path)))
+
+        outbox.ack(messages[3:])
+        outbox.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def testDamagedTail(self):
+        outbox = Outbox(self.path, fsync='always')
+        outbox.put(create_message(1, b'one'), False)
+        outbox.put(create_message(2, b'two'), False)
+        outbox.close()
+
+        segment = os.path.join(self.path, os.listdir(self.path)[0])
+        with open(segment, 'rb+') as f:
+            f.truncate(os.path.getsize(segment) - 2)
+
+        messages = Outbox(self.path).replay()
+        self.assertEqual([b'one'], [m['_data'] for m in messages])
+
+    def testWrittenWithoutAcknowledgment(self):
+        # a process dying during an outage neither acknowledges nor closes its outbox
+        outbox = Outbox(self.path)
+        outbox.put(create_message(1, b'one'), False)
+        outbox.put(create_message(2, b'two'), False)
+
+        messages = Outbox(self.path).replay()
+        self.assertEqual([b'one', b'two'], [m['_data'] for m in messages])
+
+    def replay_into(self, outbox, remove=True):
+        # what BackendClient.start_outbox does, message ids start over in every process
+        messages = outbox.replay()
+        for id, message in enumerate(messages):
+            message['_id'] = id + 1
+            outbox.put(message, message.pop('_important'))
+
+        if remove:
+            outbox.replayed()
+
+        return messages
+
+    def testRestartsWithoutAcknowledgment(self):
+        outbox = Outbox(self.path)
+        for i in range(3):
+            outbox.put(create_message(i + 1, str(i).encode('utf-8')), False)
+
+        self.replay_into(Outbox(self.path))
+        self.replay_into(Outbox(self.path))
+
+        messages = Outbox(self.path).replay()
+        self.assertEqual([b'0', b'1', b'2'], [m['_data'] for m in messages])
+
+    def testDiedBeforeReplayedSegmentsRemoved(self):
+        outbox = Outbox(self.path)
+        outbox.put(create_message(1, b'one'), False)
+
+        outbox = Outbox(self.path)
+        self.replay_into(outbox, remove=False)
+        outbox.write(['replayed', outbox.replayed_segments[-1]])
+
+        messages = Outbox(self.path).replay()
+        self.assertEqual([b'one'], [m['_data'] for m in messages])
+
+    def testSessionAndSeqKept(self):
+        outbox = Outbox(self.path, segment_size=100)
+        outbox.start_session('session', 0)
+        messages = [create_message(i + 1, str(i).encode('utf-8') * 60) for i in range(3)]
+        for message in messages:
+            outbox.put(message, False)
+
+        for seq, message in enumerate(messages[:2]):
+            message['_seq'] = seq + 1
+        outbox.sequenced(messages[:2])
+        outbox.ack(messages[:1])
+
+        outbox = Outbox(self.path)
+        replayed = self.replay_into(outbox)
+        self.assertEqual(('session', 2), (outbox.client_session, outbox.last_seq))
+        self.assertEqual([2, None], [m.get('_seq') for m in replayed])
+
+        # still known after the replayed segments are gone
+        outbox = Outbox(self.path)
+        self.assertEqual([2, None], [m.get('_seq') for m in outbox.replay()])
+        self.assertEqual(('session', 2), (outbox.client_session, outbox.last_seq))
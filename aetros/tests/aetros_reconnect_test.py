@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from aetros.reconnect import ReconnectScheduler
+
+
+class TestReconnectScheduler(unittest.TestCase):
+
+    def testBackoffIsCapped(self):
+        scheduler = ReconnectScheduler(base_delay=1, max_delay=10, random_func=lambda: 1.0)
+
+        delays = []
+        for i in range(6):
+            scheduler.record_failure('')
+            delays.append(scheduler.delay())
+            scheduler.state = 'half-open'
+            scheduler.probe = ''
+
+        self.assertEqual([1, 2, 4, 8, 10, 10], delays)
+
+    def testJitter(self):
+        scheduler = ReconnectScheduler(base_delay=1, max_delay=10, random_func=lambda: 0.25)
+        scheduler.failures = 3
+        self.assertEqual(1.0, scheduler.delay())
+
+    def testOneProbeAfterOutage(self):
+        scheduler = ReconnectScheduler(base_delay=0.01, max_delay=0.05)
+        self.assertTrue(scheduler.wait_for_attempt('', lambda: True))
+
+        # both channels notice the outage, it counts once
+        scheduler.record_failure('')
+        scheduler.record_failure('files')
+        self.assertEqual(1, scheduler.failures)
+        self.assertEqual('open', scheduler.state)
+
+        self.assertTrue(scheduler.wait_for_attempt('files', lambda: True))
+        self.assertEqual('half-open', scheduler.state)
+        self.assertEqual('files', scheduler.probe)
+
+        # the other channel waits for the probe
+        self.assertFalse(scheduler.wait_for_attempt('', lambda: False))
+
+        scheduler.record_failure('files')
+        self.assertEqual(2, scheduler.failures)
+        self.assertEqual('open', scheduler.state)
+
+        self.assertTrue(scheduler.wait_for_attempt('', lambda: True))
+        scheduler.record_success('', 0.2)
+        self.assertEqual('closed', scheduler.state)
+        self.assertEqual(0, scheduler.failures)
+
+        metrics = scheduler.metrics()
+        self.assertEqual(1, metrics['reconnects'])
+        self.assertEqual(0.2, metrics['handshake_last'])
+        self.assertTrue(metrics['disconnected_time'] > 0)
+
+    def testStalledProbeIsReplaced(self):
+        scheduler = ReconnectScheduler(base_delay=0.01, max_delay=0.05)
+        scheduler.record_failure('')
+        self.assertTrue(scheduler.wait_for_attempt('', lambda: True))
+
+        start = time.time()
+        self.assertTrue(scheduler.wait_for_attempt('files', lambda: True))
+        self.assertTrue(time.time() - start >= 0.04)
+        self.assertEqual('files', scheduler.probe)
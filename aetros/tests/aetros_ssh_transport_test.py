@@ -0,0 +1,86 @@
+import socket
+import unittest
+
+import aetros.utils
+from aetros.utils import close_ssh_transport, get_ssh_transport, open_ssh_session
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.active = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sessions = 0
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        pass
+
+    def open_session(self):
+        self.sessions += 1
+        return self.sessions
+
+    def close(self):
+        self.active = False
+        self.sock.close()
+
+
+class FakeSSHClient(object):
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.close()
+
+
+class TestSSHTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def create_ssh_stream(config, exit_on_failure=True):
+            self.created.append(FakeSSHClient())
+            return self.created[-1]
+
+        self.create_ssh_stream = aetros.utils.create_ssh_stream
+        aetros.utils.create_ssh_stream = create_ssh_stream
+        self.config = {'host': 'localhost', 'ssh_port': 22, 'ssh_key_base64': None}
+
+    def tearDown(self):
+        aetros.utils.create_ssh_stream = self.create_ssh_stream
+        for ssh_stream in self.created:
+            close_ssh_transport(ssh_stream.get_transport())
+
+    def testSharedPerHost(self):
+        transport = get_ssh_transport(self.config)
+        self.assertIs(transport, get_ssh_transport(self.config))
+
+        # BackendClient batches itself
+        self.assertTrue(transport.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+
+        # every consumer gets its own session on the same connection
+        self.assertEqual(1, open_ssh_session(self.config))
+        self.assertEqual(2, open_ssh_session(self.config))
+        self.assertEqual(1, len(self.created))
+
+        other = get_ssh_transport(dict(self.config, host='other'))
+        self.assertIsNot(transport, other)
+        self.assertEqual(2, len(self.created))
+
+    def testReconnectAfterDeath(self):
+        transport = get_ssh_transport(self.config)
+        transport.active = False
+
+        self.assertIsNot(transport, get_ssh_transport(self.config))
+        self.assertEqual(2, len(self.created))
+
+    def testClose(self):
+        transport = get_ssh_transport(self.config)
+        close_ssh_transport(transport)
+
+        self.assertFalse(transport.is_active())
+        self.assertIsNot(transport, get_ssh_transport(self.config))
@@ -0,0 +1,129 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+import zlib
+
+import msgpack
+import paramiko
+
+from aetros.benchmarks.stream_server import StandInServer
+
+
+class TestStandInServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(key_bits=1024)
+        self.server.start()
+
+        self.transport = paramiko.Transport(('127.0.0.1', self.server.port))
+        self.transport.connect(username='git', pkey=paramiko.RSAKey.generate(1024))
+        self.channel = self.transport.open_session()
+        self.channel.settimeout(5)
+        self.channel.exec_command('stream')
+        self.unpacker = msgpack.Unpacker(encoding='utf-8')
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def read(self):
+        for message in self.unpacker:
+            return message
+
+        while True:
+            self.unpacker.feed(self.channel.recv(65536))
+            for message in self.unpacker:
+                return message
+
+    def send(self, *messages):
+        # like BackendClient, all messages in one write
+        self.channel.sendall(b''.join(msgpack.packb(message) for message in messages))
+
+    def register(self, **options):
+        self.assertEqual({'a': 'welcome'}, self.read())
+        self.send(dict({'type': 'register_job_worker', 'name': 'files', 'session': 'session'}, **options))
+
+        return self.read()
+
+    def received(self, count):
+        deadline = time.time() + 5
+        while len(self.server.messages) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+        return [message for _, name, message in self.server.messages]
+
+    def testHandshake(self):
+        self.assertEqual({'a': 'registered', 'compression': ['zlib'], 'acks': True, 'acked': 0},
+                         self.register(compression=['lz4', 'zlib'], acks=True))
+
+        self.assertEqual('register_job_worker', self.received(1)[0]['type'])
+        self.assertEqual('files', self.server.messages[0][1])
+        self.assertEqual(1, self.server.registrations)
+
+    def testFramesAcknowledgedOnce(self):
+        self.register(acks=True)
+
+        self.send([1, {'type': 'log', 'data': 'a'}], [2, {'type': 'log', 'data': 'b'}],
+                  [1, {'type': 'log', 'data': 'a'}])
+
+        self.assertEqual({'a': 'ack', 'seq': 2}, self.read())
+        self.assertEqual(['a', 'b'], [m['data'] for m in self.received(3)[1:]])
+        self.assertEqual(1, self.server.duplicates)
+
+    def testUnpack(self):
+        self.register()
+
+        log = msgpack.packb({'type': 'log', 'data': 'compressed'})
+        self.channel.sendall(msgpack.packb({'type': 'compressed', 'codec': 'zlib', 'data': zlib.compress(log)},
+                                           use_bin_type=True))
+        self.send({'type': 'git-unpack-objects', 'objects': {}, 'pack': u'PACK'})
+
+        log, pack = self.received(3)[1:]
+        self.assertEqual({'type': 'log', 'data': 'compressed'}, log)
+        self.assertEqual('PACK', pack['pack'])
+
+    def create_pack(self):
+        git_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, git_dir)
+        subprocess.check_call(['git', 'init', '-q', '--bare', git_dir])
+
+        blob = subprocess.Popen(['git', '--git-dir', git_dir, 'hash-object', '-w', '--stdin'],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE).communicate(os.urandom(3000))[0]
+
+        p = subprocess.Popen(['git', '--git-dir', git_dir, 'pack-objects', '--stdout'],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        return p.communicate(blob)[0]
+
+    def testPackParts(self):
+        self.assertTrue(self.register(parts=True)['parts'])
+
+        pack = self.create_pack()
+        message = {'type': 'git-unpack-objects', 'commit': 'c' * 40}
+        self.send(dict(message, pack=pack[:1000], part=0, last=False, objects={'files': []}),
+                  dict(message, pack=pack[1000:2000], part=1, last=False, objects=None),
+                  dict(message, pack=pack[2000:], part=2, last=True, objects=None))
+
+        # a failed pack is dropped
+        self.send(dict(message, pack=pack[:1000], part=0, last=False, objects={'files': []}),
+                  dict(message, pack=b'', part=1, last=True, failed=True, objects=None),
+                  {'type': 'end'})
+
+        messages = self.received(3)
+        self.assertEqual(3, len(messages))
+        self.assertEqual(1, self.server.failed_packs)
+
+        joined = messages[1]
+        self.assertEqual({'type': 'git-unpack-objects', 'commit': 'c' * 40, 'objects': {'files': []}, 'pack': pack},
+                         joined)
+
+        # and is a pack git unpacks
+        git_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, git_dir)
+        subprocess.check_call(['git', 'init', '-q', '--bare', git_dir])
+        p = subprocess.Popen(['git', '--git-dir', git_dir, 'unpack-objects', '-q'], stdin=subprocess.PIPE)
+        p.communicate(joined['pack'])
+        self.assertEqual(0, p.returncode)
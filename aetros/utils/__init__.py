@@ -4,10 +4,11 @@ from __future__ import absolute_import
 import logging
 import os
 import re
+import socket
 import time
 import datetime
 import traceback
-from threading import Thread
+from threading import Thread, Lock
 
 import numpy as np
 import signal
@@ -18,8 +19,6 @@ import sys
 import ruamel.yaml as yaml
 import subprocess
 
-from paramiko.compress import ZlibCompressor
-
 start_time = time.time()
 last_time = None
 
@@ -71,14 +70,9 @@ def get_logger(name='', debug=None, format=None):
 
 def thread_join_non_blocking(thread):
     try:
-        while True:
-            if thread.isAlive():
-                thread.join(0.5)
-
-            if not thread.isAlive():
-                break
-
-            time.sleep(0.5)
+        # join() with a timeout keeps the main thread responsive to signals
+        while thread.is_alive():
+            thread.join(0.5)
 
     except (KeyboardInterrupt, SystemExit):
         raise
@@ -235,15 +229,13 @@ def create_ssh_stream(config, exit_on_failure=True):
 
     key_description = key_filename if key_filename else 'from server'
 
-    try:
-        def lower_compression(self):
-            import zlib
-            # Use the default level of zlib compression
-            self.z = zlib.compressobj(2)
-
-        ZlibCompressor.__init__ = lower_compression
+    # with `compression: message` BackendClient compresses each message depending on its content instead, once
+    # the server accepted a codec. Until then nothing would be compressed, so the transport is the default.
+    compress = config.get('compression', 'transport') == 'transport'
 
-        ssh_stream.connect(config['host'], port=config['ssh_port'], key_filename=key_filename, username='git', compress=True, pkey=key)
+    try:
+        ssh_stream.connect(config['host'], port=config['ssh_port'], key_filename=key_filename, username='git',
+                           compress=compress, pkey=key)
         # ssh_stream.get_transport().window_size = 2147483647
     except (SystemExit, KeyboardInterrupt):
         raise
@@ -259,6 +251,78 @@ def create_ssh_stream(config, exit_on_failure=True):
     return ssh_stream
 
 
+# (host, port, key, pid) -> SSHClient, see get_ssh_transport()
+ssh_transports = {}
+ssh_transports_lock = Lock()
+
+
+def get_ssh_transport(config, exit_on_failure=True):
+    """
+    Returns the SSH transport to config's host shared by all consumers of this process, so only the first
+    one pays for the handshake and authentication. A new one is established when the old one died.
+    """
+    # pid, because a forked child must not write into the socket of its parent
+    key = (config['host'], config['ssh_port'], config['ssh_key_base64'], os.getpid())
+
+    ssh_transports_lock.acquire()
+    try:
+        ssh_stream = ssh_transports.get(key)
+        transport = ssh_stream.get_transport() if ssh_stream else None
+
+        if not transport or not transport.is_active():
+            if ssh_stream:
+                ssh_stream.close()
+
+            ssh_stream = create_ssh_stream(config, exit_on_failure=exit_on_failure)
+            transport = ssh_stream.get_transport()
+            # detects dead connections of idle transports
+            transport.set_keepalive(30)
+
+            try:
+                # BackendClient batches itself. With Nagle, a message written while an ack from the
+                # server is on its way waits for the delayed TCP ack of the previous one.
+                transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (AttributeError, socket.error):
+                # not a TCP socket, e.g. a proxy command
+                pass
+            ssh_transports[key] = ssh_stream
+
+        return transport
+    finally:
+        ssh_transports_lock.release()
+
+
+def open_ssh_session(config, exit_on_failure=True):
+    """
+    Opens a new session (SSH channel) on the shared transport of get_ssh_transport().
+    """
+    transport = get_ssh_transport(config, exit_on_failure=exit_on_failure)
+
+    try:
+        return transport.open_session()
+    except paramiko.SSHException:
+        # transport died in the meantime
+        close_ssh_transport(transport)
+        return get_ssh_transport(config, exit_on_failure=exit_on_failure).open_session()
+
+
+def close_ssh_transport(transport):
+    """
+    Closes a shared transport and all its sessions. The next get_ssh_transport() establishes a new one.
+    """
+    ssh_transports_lock.acquire()
+    try:
+        for key, ssh_stream in list(ssh_transports.items()):
+            if ssh_stream.get_transport() is transport:
+                del ssh_transports[key]
+                ssh_stream.close()
+                return
+
+        transport.close()
+    finally:
+        ssh_transports_lock.release()
+
+
 def setup_git_ssh(config):
     import tempfile
     ssh_command = config['ssh']
@@ -342,6 +406,19 @@ def read_home_config(path = None, logger=None):
         'ssh_port': 22,
         'ssl': True,
         'ssl_verify': True,
+        'compression': 'transport',
+        'bandwidth_limit': None,
+        'bandwidth_limit_channels': {},
+        'bandwidth_host_limit': None,
+        'outbox': False,
+        'outbox_fsync': 'interval',
+        'outbox_fsync_interval': 1,
+        'outbox_memory_window': 32 * 1024 * 1024,
+        'capture': None,
+        'io_core': 'threads',
+        'git_writer': 'cli',
+        'git_delta': 'auto',
+        'git_push_debounce': 0.5,
     }
 
     config.update(custom_config)
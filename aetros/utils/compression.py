@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import time
+import zlib
+from threading import Lock
+
+import msgpack
+
+
+class MessageCompressor(object):
+    """
+    Compresses BackendClient queue entries one by one, instead of compressing the whole SSH transport.
+
+    A compressed message is sent as envelope {'type': 'compressed', 'codec': 'zlib', 'data': <zlib(_data)>}
+    around the original msgpack frame, only if the server accepted the codec during registration.
+
+    Payloads known to be compressed already (images, archives, ...) are sent raw right away. For everything
+    else the compression ratio is measured per (message type, file extension) on a sample and updated with
+    each actual result, so incompressible content stops costing CPU after the first try and is only sampled
+    again every resample_interval messages.
+    """
+
+    codecs = ['zlib']
+
+    incompressible_extensions = (
+        '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.avi', '.mkv',
+        '.gz', '.tgz', '.bz2', '.xz', '.zip', '.7z', '.rar', '.npz', '.pack'
+    )
+
+    # smaller messages are not worth the envelope
+    min_size = 512
+
+    sample_size = 16 * 1024
+
+    # compressed size relative to the raw size, above this it's sent raw
+    max_ratio = 0.9
+
+    # compression level for regular messages and for messages bigger than large_size, which favour speed
+    level = 6
+    large_level = 1
+    large_size = 1024 * 1024
+
+    resample_interval = 32
+
+    def __init__(self):
+        self.lock = Lock()
+
+        # (type, extension) -> last measured ratio
+        self.ratios = {}
+
+        # (type, extension) -> messages sent raw since the last measurement
+        self.skipped = {}
+
+        self.stats = {
+            'compressed': 0,
+            'raw': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'bytes_saved': 0,
+            'time': 0.0,
+        }
+
+    def content_key(self, message):
+        extension = ''
+        if message.get('path'):
+            extension = os.path.splitext(message['path'])[1].lower()
+
+        return message.get('type'), extension
+
+    def choose_level(self, message):
+        """
+        Returns the zlib level to compress the message with, or None to send it raw.
+        """
+        data = message['_data']
+
+        if len(data) < self.min_size:
+            return None
+
+        key = self.content_key(message)
+        if key[1] in self.incompressible_extensions:
+            return None
+
+        ratio = self.ratios.get(key)
+
+        if ratio is not None and ratio > self.max_ratio:
+            self.skipped[key] = self.skipped.get(key, 0) + 1
+            if self.skipped[key] < self.resample_interval:
+                return None
+
+            ratio = None
+
+        if ratio is None:
+            sample = data[:self.sample_size]
+
+            start = time.time()
+            ratio = len(zlib.compress(sample, 1)) / len(sample)
+            self.stats['time'] += time.time() - start
+
+            self.ratios[key] = ratio
+            self.skipped[key] = 0
+
+            if ratio > self.max_ratio:
+                return None
+
+        return self.large_level if len(data) > self.large_size else self.level
+
+    def compress(self, message):
+        """
+        Replaces _data of the queue entry with the compressed envelope, when it pays off.
+        Returns the number of bytes _data changed.
+        """
+        if message.get('_compression'):
+            return 0
+
+        data = message['_data']
+
+        with self.lock:
+            level = self.choose_level(message)
+
+        if level is None:
+            with self.lock:
+                self.stats['raw'] += 1
+                self.stats['bytes_in'] += len(data)
+                self.stats['bytes_out'] += len(data)
+
+            return 0
+
+        start = time.time()
+        compressed = zlib.compress(data, level)
+        envelope = msgpack.packb({'type': 'compressed', 'codec': 'zlib', 'data': compressed}, use_bin_type=True)
+        took = time.time() - start
+
+        with self.lock:
+            self.stats['time'] += took
+            self.ratios[self.content_key(message)] = len(compressed) / len(data)
+            self.stats['bytes_in'] += len(data)
+
+            if len(envelope) > len(data) * self.max_ratio:
+                self.stats['raw'] += 1
+                self.stats['bytes_out'] += len(data)
+                return 0
+
+            self.stats['compressed'] += 1
+            self.stats['bytes_out'] += len(envelope)
+            self.stats['bytes_saved'] += len(data) - len(envelope)
+
+        message['_data'] = envelope
+        message['_compression'] = 'zlib'
+
+        return len(envelope) - len(data)
+
+    def decompress(self, message):
+        """
+        Restores the original _data of a compressed queue entry, e.g. when the server we reconnected to
+        does not support the codec. Returns the number of bytes _data changed.
+        """
+        if not message.get('_compression'):
+            return 0
+
+        envelope = msgpack.unpackb(message['_data'])
+        compressed = envelope.get(b'data', envelope.get('data'))
+
+        data = zlib.decompress(compressed)
+        diff = len(data) - len(message['_data'])
+
+        message['_data'] = data
+        del message['_compression']
+
+        return diff